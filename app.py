@@ -1,55 +1,405 @@
 """
 Main application for Screenshot to Table converter.
+
+create_app() builds the Flask application. Importing this module has no
+side effects: logging, data directories and the configuration check are set
+up by create_app(), and clients, stores and worker pools by their modules on
+first use, so each worker of a pre-fork server creates its own. The
+module-level `app` (as in `gunicorn app:app`) is created on first access.
 """
 import os
+import re
+import json
+import time
+import uuid
+import hashlib
 import logging
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import threading
+from flask import (
+    Blueprint, Flask, Response, g, render_template, request, jsonify, send_file, send_from_directory,
+    stream_with_context
+)
 
 # Import configuration
-from config import DEBUG, HOST, PORT
+from config import (
+    DEBUG, HOST, PORT, BATCH_SOURCE_ROOT, BATCH_OUTPUT_DIR, CAPTURE_REMEMBER_REGION, SCHEDULER_ENABLED,
+    METRICS_ENABLED, ensure_directories, validate_config
+)
 
 # Import modules
-from modules.screenshot import capture_screenshot, get_screenshot_response
-from modules.image_processing import save_cropped_image, create_temp_image, cleanup_temp_file
-from modules.table_extraction import extract_table_from_image
-from modules.utils import convert_to_csv, setup_logger, format_timestamp
+from modules.screenshot import stream_screenshot, get_screenshot_response, capture_from_senders
+from modules.senders import list_senders, default_sender
+from modules.capture_regions import (
+    crop_to_capture_region, get_capture_region, remember_capture_region, forget_capture_region
+)
+from modules.image_processing import save_cropped_image, decode_image_data, save_audit_image, preprocess_image
+from modules.table_extraction import (
+    extract_table_with_backend, stream_table_with_backend, extract_table_from_image,
+    stream_table_from_image, table_events
+)
+from modules.cache import get_extraction_cache
+from modules.near_duplicate import get_near_duplicate_index
+from modules.jobs import get_job_manager, JobQueueFull
+from modules.tiling import should_tile, extract_table_tiled
+from modules.batch import run_batch
+from modules.openai_client import get_openai_client, track_usage
+from modules.scheduler import get_scheduler, start_scheduler
+from modules.timeseries import get_timeseries_store
+from modules.exporters import EXPORT_FORMATS, available_formats, iter_export
+from modules.results import get_result_store, save_result
+from modules.blob_store import storage_stats
+from modules.uploads import MAX_UPLOAD_BYTES, store_upload, crop_capture, load_upload, upload_path
+from modules.metrics import (
+    REQUEST_SECONDS, render as render_metrics, observe_bytes, log_event, set_request_id, reset_request_id
+)
+from modules.profiling import (
+    should_profile, start_request_profile, token_accepted, profile_checkpoint, set_current_profile,
+    reset_current_profile, list_profiles, get_profile, profile_path, profiling_settings,
+    update_profiling_settings
+)
+from modules.utils import setup_logger, format_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Routes and request hooks, registered on each application by create_app()
+bp = Blueprint('main', __name__)
+
+_app = None
+_app_lock = threading.Lock()
+
+def create_app(scheduler=True):
+    """
+    Creates the Flask application
+    
+    Sets up logging, creates the data directories and checks the configuration.
+    
+    Args:
+        scheduler (bool): Whether this process takes part in running schedules
+            (when SCHEDULER_ENABLED); one process among all that do is elected
+            to run them
+    
+    Returns:
+        Flask: The application
+    """
+    setup_logger()
+    ensure_directories()
+    validate_config()
+    if scheduler and SCHEDULER_ENABLED:
+        start_scheduler()
+    
+    flask_app = Flask(__name__)
+    flask_app.register_blueprint(bp)
+    return flask_app
+
+def __getattr__(name):
+    """Creates the module-level `app` on first access"""
+    global _app
+    if name != 'app':
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = create_app()
+    return _app
+
+# Cookie identifying a browser, so each user's last crop can be remembered
+CLIENT_ID_COOKIE = 'client_id'
+
+def _client_id():
+    """Returns the requesting browser's id, assigning a new one if it has none"""
+    if 'client_id' not in g:
+        g.client_id = request.cookies.get(CLIENT_ID_COOKIE) or uuid.uuid4().hex
+    return g.client_id
+
+# Header carrying the request id, taken from the caller when valid and echoed back
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID_PATTERN = re.compile(r'[\w.:-]{1,64}')
+
+@bp.before_app_request
+def start_request():
+    """Assigns the request id reported in span logs and starts the request timer"""
+    request_id = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = request_id if REQUEST_ID_PATTERN.fullmatch(request_id) else uuid.uuid4().hex
+    g.request_id_token = set_request_id(g.request_id)
+    g.request_started = time.perf_counter()
+
+# Header or query flag asking for a request to be profiled, and the header carrying PROFILING_TOKEN
+PROFILE_FLAG = 'profile'
+PROFILE_HEADER = 'X-Profile'
+PROFILE_TOKEN_HEADER = 'X-Profile-Token'
+
+@bp.before_app_request
+def start_profile():
+    """Profiles the request when it asks to be (with the token, if one is set) or is sampled"""
+    if request.path.startswith(('/profiles', '/metrics', '/static/')):
+        return
+    requested = (
+        (request.headers.get(PROFILE_HEADER) in ('1', 'true') or request.args.get(PROFILE_FLAG) in ('1', 'true'))
+        and token_accepted(_profiling_token())
+    )
+    if should_profile(requested):
+        g.profile = start_request_profile(g.request_id, request.method, request.full_path.rstrip('?'))
+
+def _profiling_token():
+    return request.headers.get(PROFILE_TOKEN_HEADER) or request.args.get('token')
+
+@bp.after_app_request
+def finish_request(response):
+    """Records the request's duration and sizes and returns its id to the caller"""
+    response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+    profile = g.pop('profile', None)
+    if profile is not None:
+        # Finished once the body, including any stream, has been sent
+        response.headers['X-Profile-ID'] = profile.profile_id
+        response.call_on_close(lambda: profile.finish(response.status_code))
+    if METRICS_ENABLED and 'request_started' in g:
+        seconds = time.perf_counter() - g.request_started
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        REQUEST_SECONDS.observe(seconds, request.method, endpoint, str(response.status_code))
+        observe_bytes('request', request.content_length)
+        observe_bytes('response', response.content_length)
+        log_event(
+            'http_request', seconds, 'ok' if response.status_code < 500 else 'error',
+            method=request.method, endpoint=endpoint, status_code=response.status_code
+        )
+    return response
 
-# Setup logger
-logger = setup_logger()
+@bp.teardown_app_request
+def end_request(exc):
+    """Clears the request id once the response, including any stream, is finished"""
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        reset_request_id(token)
 
-# Initialize Flask app
-app = Flask(__name__)
+@bp.after_app_request
+def set_client_id_cookie(response):
+    """Stores a newly assigned client id in the browser"""
+    if 'client_id' in g and request.cookies.get(CLIENT_ID_COOKIE) != g.client_id:
+        response.set_cookie(CLIENT_ID_COOKIE, g.client_id, max_age=365 * 24 * 3600, samesite='Lax')
+    return response
 
-@app.route('/')
+def _bypass_cache_requested(data):
+    """Returns True if the request asks to skip the extraction cache"""
+    return bool(data.get('bypass_cache')) or request.args.get('bypass_cache') in ('1', 'true')
+
+def _tiling_requested(data, image):
+    """Returns True if the image should be extracted in bands ('tiled' overrides auto-detection)"""
+    if data.get('tiled') is not None:
+        return bool(data['tiled'])
+    return should_tile(image)
+
+def _requested_backend(data):
+    """Returns the extraction backend named by the request, or None for the configured default"""
+    return data.get('backend') or request.args.get('backend')
+
+def _has_image(data):
+    """Returns True if a request body carries an image, by upload handle or as base64"""
+    return bool(data) and bool(data.get('image_id') or data.get('image'))
+
+def _request_image(data):
+    """
+    Returns the image a request refers to
+    
+    An 'image_id' from POST /images is read from the uploads store; otherwise
+    'image' is decoded from base64.
+    
+    Returns:
+        tuple: (success, payload_or_error)
+    """
+    if data.get('image_id'):
+        return load_upload(data['image_id'])
+    return decode_image_data(data['image'])
+
+def _image_error_status(data):
+    """Status for an image that could not be loaded: an unknown handle is not found, bad data a server error"""
+    return 404 if data.get('image_id') else 500
+
+def _requested_sender(data):
+    """Returns the configured sender the image was captured from, if the request names one"""
+    sender = data.get('sender')
+    return sender if sender in list_senders() else None
+
+def _remote_extractor(data, use_cache, stats=None):
+    """
+    Returns the API extraction used when the local engine does not handle an image
+    
+    Tall tables are extracted in bands; other images are preprocessed first,
+    with the preprocessing stats recorded in stats['preprocessing'].
+    """
+    def extract(image):
+        if _tiling_requested(data, image):
+            return extract_table_tiled(image, use_cache=use_cache)
+        image, preprocessing = preprocess_image(image)
+        if stats is not None:
+            stats['preprocessing'] = preprocessing
+        return extract_table_from_image(image, use_cache=use_cache)
+    return extract
+
+@bp.route('/')
 def home():
     """Render the main application page"""
     return render_template('index.html')
 
-@app.route('/request-screenshot')
+@bp.route('/request-screenshot')
 def request_screenshot():
-    """Endpoint to request a screenshot from the sender"""
+    """
+    Endpoint to request a screenshot from the sender
+    
+    Captures only the region around the user's last crop when one is
+    remembered; '?full=1' captures the whole screen instead. '?sender=name'
+    picks the sender; without it, the sender of the remembered region (or
+    the default sender) is used.
+    
+    An If-None-Match header is passed on to the sender, so an unchanged
+    screen returns 304 and the browser keeps its current image and table.
+    """
     logger.info("Screenshot requested")
     
-    success, result = capture_screenshot()
+    sender = request.args.get('sender')
+    if sender and sender not in list_senders():
+        return jsonify({'success': False, 'error': f"Unknown sender: {sender}"}), 400
+    
+    region = None
+    if CAPTURE_REMEMBER_REGION and request.args.get('full') not in ('1', 'true'):
+        region = get_capture_region(_client_id())
+    if region:
+        # Regions from before multiple senders belong to the default sender
+        region_sender = region.get('sender', default_sender())
+        if sender and sender != region_sender:
+            region = None
+        elif region_sender in list_senders():
+            sender = region_sender
+        else:
+            region = None
+    
+    # The capture is relayed to the browser as it arrives from the sender
+    success, result = stream_screenshot(
+        region=region,
+        monitor=request.args.get('monitor', type=int),
+        scale=request.args.get('scale', type=float),
+        sender=sender,
+        etag=request.headers.get('If-None-Match')
+    )
     
     if success:
-        # result is BytesIO with image data
-        return get_screenshot_response(result)
+        # result is an iterator of image bytes (None if unchanged) and the sender's capture info
+        chunks, capture_info = result
+        return get_screenshot_response(chunks, capture_info)
     else:
         # result is error message
         logger.error(f"Screenshot request failed: {result}")
         return jsonify({'success': False, 'error': result}), 500
 
-@app.route('/save-cropped', methods=['POST'])
+@bp.route('/request-screenshot-all')
+def request_screenshot_all():
+    """
+    Endpoint to capture from several senders at once
+    
+    Returns newline-delimited JSON, one line per sender in the order the
+    captures complete, so one slow sender never holds up the others.
+    '?senders=a,b' limits the capture to those senders.
+    """
+    names = [name for name in request.args.get('senders', '').split(',') if name]
+    unknown = [name for name in names if name not in list_senders()]
+    if unknown:
+        return jsonify({'success': False, 'error': f"Unknown senders: {', '.join(unknown)}"}), 400
+    
+    results = capture_from_senders(names or None, scale=request.args.get('scale', type=float))
+    
+    def generate_lines():
+        for result in results:
+            yield json.dumps(result) + '\n'
+    
+    return Response(
+        stream_with_context(generate_lines()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/senders')
+def senders():
+    """Endpoint to list the configured senders"""
+    return jsonify({'success': True, 'senders': list_senders(), 'default': default_sender()})
+
+@bp.route('/images', methods=['POST'])
+def upload_image():
+    """
+    Endpoint to upload an image once and get a handle (image_id) for it
+    
+    The image is sent as the raw request body (any image Content-Type or
+    application/octet-stream) or as the 'image' file of a multipart form.
+    A JSON body with 'capture_id' and 'crop' instead asks the server to cut
+    the crop from a capture it served (X-Capture-Id); that answers 404 when
+    the capture is not available, and the crop should then be uploaded.
+    The image_id can be passed to /extract-table, /jobs/extract-table and
+    /save-cropped in place of a base64 'image'.
+    """
+    try:
+        if request.content_length and request.content_length > MAX_UPLOAD_BYTES:
+            return jsonify({'success': False, 'error': 'Image is too large'}), 413
+        
+        if request.is_json:
+            data = request.get_json(silent=True) or {}
+            if not data.get('capture_id') or not isinstance(data.get('crop'), dict):
+                return jsonify({'success': False, 'error': 'No capture_id and crop provided'}), 400
+            success, result = crop_capture(data['capture_id'], data['crop'])
+            source, status = 'capture', 404
+        else:
+            if request.mimetype == 'multipart/form-data':
+                upload = request.files.get('image')
+                image_bytes = upload.read(MAX_UPLOAD_BYTES + 1) if upload else b''
+            else:
+                # Read at most one byte past the limit, so a chunked body can't grow unbounded
+                image_bytes = request.stream.read(MAX_UPLOAD_BYTES + 1)
+            success, result = store_upload(image_bytes)
+            source, status = 'upload', 400
+        
+        if success:
+            # result is the image_id
+            return jsonify({
+                'success': True,
+                'image_id': result,
+                'url': f'/images/{result}',
+                'source': source
+            }), 201
+        else:
+            # result is error message
+            return jsonify({'success': False, 'error': result}), status
+            
+    except Exception as e:
+        logger.exception("Error in upload_image endpoint")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/images/<image_id>')
+def download_image(image_id):
+    """Endpoint to fetch an uploaded image by its handle ('?download=1' saves it as a file)"""
+    path = upload_path(image_id)
+    if path is None:
+        return jsonify({'success': False, 'error': f'Unknown image_id: {image_id}'}), 404
+    # Handles are content hashes, so the bytes behind one never change
+    response = send_file(
+        os.path.abspath(path), as_attachment=request.args.get('download') in ('1', 'true'),
+        download_name=os.path.basename(path)
+    )
+    response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+    return response
+
+@bp.route('/save-cropped', methods=['POST'])
 def save_cropped():
-    """Endpoint to save a cropped image"""
+    """Endpoint to save a cropped image, sent as base64 'image' or by 'image_id'"""
     try:
         data = request.json
-        if not data or 'image' not in data:
+        if not _has_image(data):
             return jsonify({'success': False, 'error': 'No image data provided'}), 400
-            
-        image_data = data['image']
-        success, result = save_cropped_image(image_data)
+        
+        success, image = _request_image(data)
+        if not success:
+            # image is error message
+            return jsonify({'success': False, 'error': image}), _image_error_status(data)
+        success, result = save_cropped_image(image)
+        
+        if success and CAPTURE_REMEMBER_REGION and data.get('crop') and data.get('capture'):
+            _remember_crop(data['crop'], data['capture'])
         
         if success:
             # result is filename
@@ -62,32 +412,66 @@ def save_cropped():
         logger.exception("Error in save_cropped endpoint")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/extract-table', methods=['POST'])
+def _remember_crop(crop, capture):
+    """Stores a crop as the user's next capture region; a bad crop never fails the save"""
+    if not capture.get('region'):
+        # The sender does not report regions, so crops can't be mapped back
+        return
+    try:
+        region = crop_to_capture_region(
+            crop, capture['region'].split(','), capture.get('scale') or 1.0
+        )
+        region['monitor'] = int(capture.get('monitor') or 0)
+        region['sender'] = capture.get('sender') or default_sender()
+        remember_capture_region(_client_id(), region)
+    except (KeyError, TypeError, ValueError) as e:
+        logger.warning(f"Could not remember crop region: {str(e)}")
+
+@bp.route('/capture-region', methods=['GET', 'DELETE'])
+def capture_region():
+    """Endpoint to show (GET) or forget (DELETE) the region captured for this user"""
+    if request.method == 'DELETE':
+        forget_capture_region(_client_id())
+        return jsonify({'success': True, 'region': None})
+    return jsonify({'success': True, 'region': get_capture_region(_client_id())})
+
+@bp.route('/extract-table', methods=['POST'])
 def extract_table():
-    """Endpoint to extract table data from an image"""
+    """Endpoint to extract table data from an image, sent as base64 'image' or by 'image_id'"""
     try:
         data = request.json
-        if not data or 'image' not in data:
+        if not _has_image(data):
             return jsonify({'success': False, 'error': 'No image data provided'}), 400
             
-        # Create temporary image file
-        success, temp_file = create_temp_image(data['image'])
+        # Decode the image in memory, or read the upload it refers to
+        success, image = _request_image(data)
         
         if not success:
-            # temp_file is error message
-            return jsonify({'success': False, 'error': temp_file}), 500
+            # image is error message
+            return jsonify({'success': False, 'error': image}), _image_error_status(data)
+        
+        profile_checkpoint('image_decoded')
+        save_audit_image(image)
+        use_cache = not _bypass_cache_requested(data)
         
-        # Extract table data
-        success, result = extract_table_from_image(temp_file)
+        if data.get('stream') or request.args.get('stream') in ('1', 'true'):
+            return _stream_extraction(data, image, use_cache)
         
-        # Clean up temp file
-        cleanup_temp_file(temp_file)
+        # The local engine reads the original image; the API gets a tiled or shrunk one
+        stats = {}
+        success, result = _extract_and_save(
+            image, 'extract', _requested_sender(data),
+            use_cache=use_cache, backend=_requested_backend(data),
+            remote=_remote_extractor(data, use_cache, stats)
+        )
         
         if success:
-            # result is table data
+            # result holds the table data and the result_id it is kept under
             return jsonify({
                 'success': True,
-                'table_data': result
+                'table_data': result['table_data'],
+                'result_id': result['result_id'],
+                'preprocessing': stats.get('preprocessing')
             })
         else:
             # result is error message
@@ -97,32 +481,498 @@ def extract_table():
         logger.exception("Error in extract_table endpoint")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/download-csv', methods=['POST'])
-def download_csv():
-    """Endpoint to download table data as CSV"""
+def _stream_extraction(data, image, use_cache):
+    """
+    Streams an extraction as newline-delimited JSON events
+    
+    Each line is an event from stream_table_with_backend ('columns', 'row',
+    'done' or 'error'). Streamed API extractions are preceded by a
+    'preprocessing' event with the bytes saved. The 'done' event carries the
+    saved result's 'result_id'.
+    """
+    def remote_events(payload):
+        if _tiling_requested(data, payload):
+            # Bands are merged before any row is final, so the result is replayed at the end
+            success, result = extract_table_tiled(payload, use_cache=use_cache)
+            if success:
+                yield from table_events(result)
+            else:
+                yield {'type': 'error', 'error': result}
+            return
+        
+        payload, preprocessing = preprocess_image(payload)
+        yield {'type': 'preprocessing', 'preprocessing': preprocessing}
+        yield from stream_table_from_image(payload, use_cache=use_cache)
+    
+    sender = _requested_sender(data)
+    request_id = g.request_id
+    profile = g.get('profile')
+    
+    def generate_lines():
+        started = time.monotonic()
+        # The body is produced after the view returns, so the request id is set again for its spans
+        token = set_request_id(request_id)
+        profile_token = set_current_profile(profile)
+        try:
+            with track_usage() as usage:
+                events = stream_table_with_backend(
+                    image, use_cache=use_cache, backend=_requested_backend(data), remote=remote_events
+                )
+                for event in events:
+                    if event['type'] == 'done':
+                        event['result_id'] = _save_extraction(
+                            event['table_data'], image, 'stream', sender, usage, started
+                        )
+                    yield json.dumps(event) + '\n'
+        finally:
+            reset_current_profile(profile_token)
+            reset_request_id(token)
+    
+    return Response(
+        stream_with_context(generate_lines()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/jobs/extract-table', methods=['POST'])
+def submit_extract_table_job():
+    """Endpoint to queue a table extraction and return a job id immediately"""
     try:
         data = request.json
-        if not data or 'table_data' not in data:
-            return jsonify({'success': False, 'error': 'No table data provided'}), 400
+        if not _has_image(data):
+            return jsonify({'success': False, 'error': 'No image data provided'}), 400
             
-        csv_data = convert_to_csv(data['table_data'])
-        timestamp = format_timestamp()
+        success, image = _request_image(data)
+        
+        if not success:
+            # image is error message
+            return jsonify({'success': False, 'error': image}), _image_error_status(data)
+        
+        save_audit_image(image)
+        use_cache = not _bypass_cache_requested(data)
+        
+        try:
+            job_id = get_job_manager().submit(
+                'extract-table', _extract_and_save, image, 'job', _requested_sender(data),
+                use_cache=use_cache,
+                backend=_requested_backend(data),
+                remote=_remote_extractor(data, use_cache)
+            )
+        except JobQueueFull as e:
+            response = jsonify({'success': False, 'error': str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 503
         
         return jsonify({
             'success': True,
-            'filename': f'table_data_{timestamp}.csv',
-            'data': csv_data
-        })
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}'
+        }), 202
         
     except Exception as e:
-        logger.exception("Error in download_csv endpoint")
+        logger.exception("Error in submit_extract_table_job endpoint")
         return jsonify({'success': False, 'error': str(e)}), 500
 
-@app.route('/static/<path:path>')
+def _extract_and_save(image, source, sender, **kwargs):
+    """
+    Extracts a table with extract_table_with_backend and saves it in the result store
+    
+    Returns:
+        tuple: (success, result_or_error), the result holding 'table_data' and 'result_id'
+    """
+    started = time.monotonic()
+    with track_usage() as usage:
+        success, result = extract_table_with_backend(image, **kwargs)
+    if not success:
+        return False, result
+    return True, {
+        'table_data': result,
+        'result_id': _save_extraction(result, image, source, sender, usage, started)
+    }
+
+def _save_extraction(table_data, image, source, sender, usage, started):
+    """Saves an extraction with its image hash, model, duration and token usage, returning the result_id"""
+    return save_result(
+        table_data, source=source, sender=sender, image_hash=hashlib.sha256(image.data).hexdigest(),
+        model=usage['model'], seconds=time.monotonic() - started, usage=usage
+    )
+
+def _job_result_fields(job):
+    """Returns a finished job's result as response fields (table_data and result_id for extractions)"""
+    if job['kind'] == 'extract-table':
+        return job['result']
+    return {'result': job['result']}
+
+@bp.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Endpoint to poll a job's status, timing and (once finished) its result"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': f'Unknown job: {job_id}'}), 404
+    
+    response = {
+        'success': True,
+        'job_id': job_id,
+        'kind': job['kind'],
+        'status': job['status'],
+        'queue_seconds': job['queue_seconds'],
+        'run_seconds': job['run_seconds']
+    }
+    if job['status'] == 'succeeded':
+        response.update(_job_result_fields(job))
+    elif job['status'] == 'failed':
+        response['error'] = job['error']
+    
+    return jsonify(response)
+
+@bp.route('/jobs/<job_id>/result')
+def job_result(job_id):
+    """Endpoint to fetch a finished job's result (202 while still pending)"""
+    job = get_job_manager().get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': f'Unknown job: {job_id}'}), 404
+    
+    if job['status'] == 'succeeded':
+        return jsonify({'success': True, **_job_result_fields(job)})
+    if job['status'] == 'failed':
+        return jsonify({'success': False, 'error': job['error']}), 500
+    
+    return jsonify({'success': False, 'status': job['status']}), 202
+
+@bp.route('/jobs')
+def job_stats():
+    """Endpoint to report worker pool capacity and queue depth"""
+    return jsonify({'success': True, 'stats': get_job_manager().stats()})
+
+@bp.route('/extract-batch', methods=['POST'])
+def extract_batch():
+    """Endpoint to queue extraction of a folder (or glob) of stored screenshots"""
+    try:
+        data = request.json
+        if not data or 'source' not in data:
+            return jsonify({'success': False, 'error': 'No source directory or pattern provided'}), 400
+        
+        # Only allow batches over the application's own data directory
+        source = data['source']
+        root = os.path.realpath(BATCH_SOURCE_ROOT)
+        if os.path.commonpath([root, os.path.realpath(source)]) != root:
+            return jsonify({'success': False, 'error': f'Source must be inside {BATCH_SOURCE_ROOT}'}), 400
+        
+        try:
+            concurrency = int(data['concurrency']) if data.get('concurrency') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({'success': False, 'error': 'concurrency must be an integer'}), 400
+        
+        output_format = data.get('format', 'jsonl').lower()
+        output_path = None
+        if data.get('output'):
+            output_path = os.path.join(BATCH_OUTPUT_DIR, os.path.basename(data['output']))
+        
+        try:
+            job_id = get_job_manager().submit(
+                'extract-batch', run_batch, source,
+                output_path=output_path,
+                output_format=output_format,
+                concurrency=concurrency,
+                use_cache=not _bypass_cache_requested(data),
+                resume=data.get('resume', True),
+                backend=_requested_backend(data)
+            )
+        except JobQueueFull as e:
+            response = jsonify({'success': False, 'error': str(e)})
+            response.headers['Retry-After'] = '5'
+            return response, 503
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'status_url': f'/jobs/{job_id}'
+        }), 202
+        
+    except Exception as e:
+        logger.exception("Error in extract_batch endpoint")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@bp.route('/results')
+def results():
+    """
+    Endpoint to list and search saved extraction results, newest first
+    
+    Query parameters 'sender', 'image_hash', 'model', 'source', 'since' and
+    'until' (Unix timestamps) and 'q' (text in the table) filter the list.
+    Pages hold up to 'limit' results; pass a page's 'next_cursor' as 'cursor'
+    to get the next one.
+    """
+    store = get_result_store()
+    if store is None:
+        return jsonify({'success': False, 'error': 'Result store is not available'}), 503
+    
+    try:
+        found, next_cursor = store.search(
+            sender=request.args.get('sender'),
+            image_hash=request.args.get('image_hash'),
+            model=request.args.get('model'),
+            source=request.args.get('source'),
+            since=request.args.get('since', type=float),
+            until=request.args.get('until', type=float),
+            text=request.args.get('q'),
+            limit=max(1, min(request.args.get('limit', 50, type=int), 500)),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'results': found, 'next_cursor': next_cursor})
+
+@bp.route('/results/<result_id>')
+def result_detail(result_id):
+    """Endpoint to fetch a saved extraction result with its metadata and table data"""
+    store = get_result_store()
+    record = store.get_record(result_id) if store else None
+    if record is None:
+        return jsonify({'success': False, 'error': f'Unknown result: {result_id}'}), 404
+    return jsonify({'success': True, 'result': record})
+
+@bp.route('/results/<result_id>/download', methods=['GET', 'POST'])
+def download_result(result_id):
+    """
+    Endpoint to download a saved extraction result as a file
+    
+    '?format=' picks csv (default), json, jsonl, parquet, arrow or xlsx. The
+    file is encoded from the stored table and streamed as it is written.
+    """
+    store = get_result_store()
+    table_data = store.get(result_id) if store else None
+    if table_data is None:
+        return jsonify({'success': False, 'error': f'Unknown result: {result_id}'}), 404
+    return _download_response(table_data, request.args.get('format', 'csv'), f'table_{result_id[:12]}')
+
+@bp.route('/download-csv', methods=['GET', 'POST'])
+def download_csv():
+    """
+    Endpoint to download table data as a CSV file
+    
+    Takes a 'result_id' (query parameter or JSON body) of a saved result,
+    or, for older clients, the 'table_data' itself in the body.
+    """
+    data = request.get_json(silent=True) or {}
+    result_id = request.args.get('result_id') or data.get('result_id')
+    if result_id:
+        return download_result(result_id)
+    if 'table_data' not in data:
+        return jsonify({'success': False, 'error': 'No result_id or table data provided'}), 400
+    return _download_response(data['table_data'], 'csv', f'table_data_{format_timestamp()}')
+
+def _download_response(table_data, fmt, basename):
+    """Streams table data in an export format as a file attachment"""
+    fmt = str(fmt).lower()
+    try:
+        chunks = iter_export(table_data, fmt)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e), 'formats': available_formats()}), 400
+    except (KeyError, TypeError, AttributeError):
+        return jsonify({'success': False, 'error': 'table_data must have columns and rows'}), 400
+    
+    return Response(
+        chunks,
+        mimetype=EXPORT_FORMATS[fmt]['mimetype'],
+        headers={'Content-Disposition': f'attachment; filename="{basename}.{EXPORT_FORMATS[fmt]["extension"]}"'}
+    )
+
+@bp.route('/export', methods=['POST'])
+def export():
+    """
+    Endpoint to download table data as a file
+    
+    The body holds 'table_data' and a 'format': csv, json, jsonl, parquet,
+    arrow or xlsx (the last three need pyarrow or openpyxl on the server).
+    Saved results are better downloaded with /results/<result_id>/download.
+    """
+    data = request.json
+    if not data or 'table_data' not in data:
+        return jsonify({'success': False, 'error': 'No table data provided'}), 400
+    return _download_response(data['table_data'], data.get('format', 'csv'), f'table_data_{format_timestamp()}')
+
+@bp.route('/cache-stats')
+def cache_stats():
+    """Endpoint to report extraction cache hit/miss counters"""
+    cache = get_extraction_cache()
+    near_index = get_near_duplicate_index()
+    return jsonify({
+        'success': True,
+        'enabled': cache is not None,
+        'stats': cache.stats() if cache else None,
+        'near_duplicates': near_index.stats() if near_index else None
+    })
+
+@bp.route('/storage-stats')
+def storage_stats_endpoint():
+    """Endpoint to report the screenshot stores' sizes, deduplicated writes and compaction counters"""
+    return jsonify({'success': True, 'stores': storage_stats()})
+
+@bp.route('/openai-stats')
+def openai_stats():
+    """Endpoint to report OpenAI client retries, rate-limit waits and circuit state"""
+    client = get_openai_client()
+    if client is None:
+        return jsonify({'success': False, 'error': 'No OpenAI client available'}), 503
+    return jsonify({'success': True, 'stats': client.stats()})
+
+def _schedule_definition(data):
+    """Turns a request body into a schedule definition, mapping a browser crop to a screen region"""
+    if 'region' not in data and data.get('crop') and data.get('capture'):
+        capture = data['capture']
+        if not capture.get('region'):
+            raise ValueError("The sender does not report capture regions")
+        try:
+            region = crop_to_capture_region(
+                data['crop'], capture['region'].split(','), capture.get('scale') or 1.0, margin=0
+            )
+        except (KeyError, TypeError, AttributeError):
+            raise ValueError("crop must have x, y, width and height")
+        region['monitor'] = int(capture.get('monitor') or 0)
+        data = dict(data, region=region, sender=data.get('sender') or capture.get('sender'))
+        if data.get('scale') is None and capture.get('scale'):
+            data['scale'] = float(capture['scale'])
+    return data
+
+@bp.route('/schedules', methods=['GET', 'POST'])
+def schedules():
+    """
+    Endpoint to list (GET) or create (POST) scheduled capture-and-extract jobs
+    
+    A schedule is created from 'sender', 'region' (monitor, left, top, width,
+    height) and 'interval' in seconds, or from a browser 'crop' and the
+    'capture' info it was cropped from, as sent to /save-cropped.
+    """
+    if not SCHEDULER_ENABLED:
+        return jsonify({'success': False, 'error': 'Scheduler is disabled'}), 503
+    scheduler = get_scheduler()
+    
+    if request.method == 'GET':
+        return jsonify({'success': True, 'schedules': scheduler.list(), 'stats': scheduler.stats()})
+    
+    data = request.json
+    if not data:
+        return jsonify({'success': False, 'error': 'No schedule provided'}), 400
+    try:
+        schedule = scheduler.add(_schedule_definition(data))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'schedule': schedule}), 201
+
+@bp.route('/schedules/<schedule_id>', methods=['GET', 'DELETE'])
+def schedule_detail(schedule_id):
+    """Endpoint to show (GET) or delete (DELETE) a schedule"""
+    if not SCHEDULER_ENABLED:
+        return jsonify({'success': False, 'error': 'Scheduler is disabled'}), 503
+    scheduler = get_scheduler()
+    
+    if request.method == 'DELETE':
+        if not scheduler.remove(schedule_id):
+            return jsonify({'success': False, 'error': 'Unknown schedule'}), 404
+        return jsonify({'success': True})
+    
+    schedule = scheduler.get(schedule_id)
+    if schedule is None:
+        return jsonify({'success': False, 'error': 'Unknown schedule'}), 404
+    schedule['samples'] = get_timeseries_store().count(schedule_id)
+    return jsonify({'success': True, 'schedule': schedule})
+
+@bp.route('/schedules/<schedule_id>/run', methods=['POST'])
+def run_schedule_now(schedule_id):
+    """Endpoint to run a schedule immediately; 409 if it is already running"""
+    if not SCHEDULER_ENABLED:
+        return jsonify({'success': False, 'error': 'Scheduler is disabled'}), 503
+    try:
+        started = get_scheduler().run_now(schedule_id)
+    except KeyError:
+        return jsonify({'success': False, 'error': 'Unknown schedule'}), 404
+    if not started:
+        return jsonify({'success': False, 'error': 'Schedule is already running'}), 409
+    return jsonify({'success': True}), 202
+
+@bp.route('/schedules/<schedule_id>/series')
+def schedule_series(schedule_id):
+    """
+    Endpoint to read the tables a schedule has extracted, newest first
+    
+    Query parameters 'columns' (comma-separated), 'since' and 'until' (Unix
+    timestamps) and 'limit' narrow the result.
+    """
+    columns = [name for name in request.args.get('columns', '').split(',') if name]
+    samples = get_timeseries_store().query(
+        schedule_id,
+        columns=columns or None,
+        since=request.args.get('since', type=float),
+        until=request.args.get('until', type=float),
+        limit=min(request.args.get('limit', 100, type=int), 10000)
+    )
+    return jsonify({'success': True, 'schedule_id': schedule_id, 'samples': samples})
+
+@bp.route('/metrics')
+def metrics():
+    """Endpoint to report request, stage, payload, token, cache and queue metrics for Prometheus"""
+    if not METRICS_ENABLED:
+        return jsonify({'success': False, 'error': 'Metrics are disabled'}), 404
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@bp.route('/profiles')
+def profiles():
+    """Endpoint to list saved request profiles, newest first"""
+    if not token_accepted(_profiling_token()):
+        return jsonify({'success': False, 'error': 'Invalid profiling token'}), 403
+    return jsonify({'success': True, 'settings': profiling_settings(), 'profiles': list_profiles()})
+
+@bp.route('/profiles/settings', methods=['GET', 'POST'])
+def profiles_settings():
+    """
+    Endpoint to show (GET) or change (POST) profiling until the next restart
+    
+    The body may set 'enabled' and 'sample_rate' (0 to 1). Changes are only
+    accepted when PROFILING_TOKEN is configured.
+    """
+    if not token_accepted(_profiling_token()):
+        return jsonify({'success': False, 'error': 'Invalid profiling token'}), 403
+    if request.method == 'GET':
+        return jsonify({'success': True, 'settings': profiling_settings()})
+    if not profiling_settings()['token_required']:
+        return jsonify({'success': False, 'error': 'Set PROFILING_TOKEN to change profiling at runtime'}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        settings = update_profiling_settings(data.get('enabled'), data.get('sample_rate'))
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({'success': True, 'settings': settings})
+
+@bp.route('/profiles/<profile_id>')
+def profile_detail(profile_id):
+    """Endpoint to return a saved profile's slowest functions and allocation sites"""
+    if not token_accepted(_profiling_token()):
+        return jsonify({'success': False, 'error': 'Invalid profiling token'}), 403
+    record = get_profile(profile_id)
+    if record is None:
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return jsonify({'success': True, 'profile': record})
+
+@bp.route('/profiles/<profile_id>/download')
+def download_profile(profile_id):
+    """Endpoint to download a profile as a cProfile .prof file (or ?format=json)"""
+    if not token_accepted(_profiling_token()):
+        return jsonify({'success': False, 'error': 'Invalid profiling token'}), 403
+    extension = request.args.get('format', 'prof')
+    path = profile_path(profile_id, extension)
+    if path is None or not os.path.exists(path):
+        return jsonify({'success': False, 'error': 'Profile not found'}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f"{profile_id}.{extension}")
+
+@bp.route('/static/<path:path>')
 def serve_static(path):
     """Serve static files"""
     return send_from_directory('static', path)
 
 if __name__ == '__main__':
+    # With the debug reloader, only the serving child process runs schedules
+    app = create_app(scheduler=not DEBUG or os.environ.get('WERKZEUG_RUN_MAIN') == 'true')
     logger.info(f"Starting Screenshot to Table application on {HOST}:{PORT}")
     app.run(host=HOST, port=PORT, debug=DEBUG)
\ No newline at end of file
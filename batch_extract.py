@@ -0,0 +1,72 @@
+"""
+Batch Extraction Script
+
+Extracts tables from a folder (or glob) of stored screenshots and writes the
+results to a JSONL or CSV file as each image completes. Re-running with the
+same output file resumes where an interrupted run stopped.
+
+Examples:
+    python batch_extract.py data/cropped_screenshots
+    python batch_extract.py "data/screenshots/*.png" --format csv --output results.csv
+"""
+import sys
+import argparse
+
+from config import BATCH_CONCURRENCY, BATCH_REQUESTS_PER_MINUTE, validate_config
+from modules.batch import run_batch
+from modules.utils import setup_logger
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description="Extract tables from a folder of screenshots")
+    parser.add_argument('source', help="Directory or glob pattern of images to extract")
+    parser.add_argument('--output', help="Output file (default: timestamped file in BATCH_OUTPUT_DIR)")
+    parser.add_argument('--format', choices=['jsonl', 'csv'], default='jsonl', help="Output format")
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY,
+                        help="Maximum extractions in flight (at most BATCH_CONCURRENCY)")
+    parser.add_argument('--rpm', type=int, default=BATCH_REQUESTS_PER_MINUTE,
+                        help="Maximum extraction requests per minute (0 for no limit)")
+    parser.add_argument('--backend', choices=['openai', 'local', 'auto'],
+                        help="Extraction backend (default: EXTRACTION_BACKEND)")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore the extraction cache")
+    parser.add_argument('--no-resume', action='store_true',
+                        help="Re-extract images already present in the output file")
+    return parser.parse_args()
+
+def print_progress(record):
+    """Print one line per completed image"""
+    status = 'ok' if record['success'] else 'FAILED'
+    detail = f"{len(record['table_data']['rows'])} rows" if record['success'] else record['error']
+    print(f"[{status}] {record['source']}: {detail}")
+
+def main():
+    """Run the batch and print a summary"""
+    args = parse_args()
+    setup_logger()
+    validate_config()
+
+    success, result = run_batch(
+        args.source,
+        output_path=args.output,
+        output_format=args.format,
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        use_cache=not args.no_cache,
+        resume=not args.no_resume,
+        on_result=print_progress,
+        backend=args.backend
+    )
+
+    if not success:
+        print(f"Error: {result}")
+        return 1
+
+    print(
+        f"\nDone: {result['succeeded']} succeeded, {result['failed']} failed, "
+        f"{result['skipped']} skipped in {result['seconds']}s"
+    )
+    print(f"Results written to {result['output_path']}")
+    return 0 if result['failed'] == 0 else 2
+
+if __name__ == '__main__':
+    sys.exit(main())
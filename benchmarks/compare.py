@@ -0,0 +1,75 @@
+"""
+Compare Benchmark Results
+
+Prints each scenario and concurrency level found in two run.py result files
+side by side, with the relative change of every metric.
+
+Example:
+    python benchmarks/compare.py before.json after.json
+"""
+import sys
+import json
+import argparse
+
+# Metrics shown, and whether a higher value is better
+METRICS = [
+    ('p50_ms', False),
+    ('p95_ms', False),
+    ('p99_ms', False),
+    ('throughput_rps', True),
+    ('errors', False),
+    ('peak_rss_bytes', False)
+]
+
+# Relative change flagged as a regression by default
+THRESHOLD = 0.10
+
+def load(path):
+    with open(path) as f:
+        report = json.load(f)
+    return report, {(result['scenario'], result['concurrency']): result for result in report['results']}
+
+def change(before, after, higher_is_better, threshold):
+    """Returns the relative change as text, marked with ! when it is a regression beyond the threshold"""
+    if before is None or after is None:
+        return 'n/a'
+    if before == 0:
+        return 'same' if after == 0 else 'new'
+    delta = (after - before) / before
+    worse = delta < 0 if higher_is_better else delta > 0
+    return f"{delta:+.1%}" + (' !' if worse and abs(delta) >= threshold else '')
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument('before', help="Baseline results from run.py")
+    parser.add_argument('after', help="New results from run.py")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help="Relative change flagged as a regression (default: 0.10)")
+    return parser.parse_args()
+
+def main():
+    """Print the comparison; exits with 1 when any metric regressed beyond the threshold"""
+    args = parse_args()
+    before_report, before = load(args.before)
+    after_report, after = load(args.after)
+    print(f"before: {before_report.get('commit') or 'unknown'} ({before_report.get('created_at')})")
+    print(f"after:  {after_report.get('commit') or 'unknown'} ({after_report.get('created_at')})")
+    if before_report.get('settings') != after_report.get('settings'):
+        print("warning: the runs used different settings")
+
+    regressed = False
+    for key in sorted(set(before) | set(after)):
+        print(f"\n{key[0]} x{key[1]}")
+        if key not in before or key not in after:
+            print("  only in " + ('after' if key in after else 'before'))
+            continue
+        for metric, higher_is_better in METRICS:
+            old, new = before[key].get(metric), after[key].get(metric)
+            text = change(old, new, higher_is_better, args.threshold)
+            regressed = regressed or text.endswith('!')
+            print(f"  {metric:<16} {str(old):>14} -> {str(new):<14} {text}")
+    return 1 if regressed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
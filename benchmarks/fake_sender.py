@@ -0,0 +1,57 @@
+"""
+Fake Sender for Benchmarks
+
+Runs the real sender.py server with its screen grabber replaced by a fixture
+desktop, so captures exercise the same cropping, scaling, ETag and encoding
+code as a live sender without needing a display.
+
+Saved captures and sender.log are written to the current directory, as with
+sender.py.
+
+Example:
+    python benchmarks/fake_sender.py --port 5077 --size 4k
+"""
+import os
+import sys
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sender
+from fixtures import FIXTURE_SIZES, render_desktop
+
+class FixtureBackend:
+    """Grabs regions of a fixed fixture desktop"""
+    name = 'fixture'
+
+    def __init__(self, desktop):
+        self.desktop = desktop
+
+    def available(self):
+        return True
+
+    def grab(self, left, top, width, height):
+        return self.desktop.crop((left, top, left + width, top + height))
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description="Serve fixture screenshots through sender.py")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=5077, help="Port to listen on")
+    parser.add_argument('--size', choices=sorted(FIXTURE_SIZES), default='hd', help="Fixture desktop size")
+    return parser.parse_args()
+
+def main():
+    """Install the fixture backend and run the sender"""
+    args = parse_args()
+    backend = FixtureBackend(render_desktop(args.size))
+    width, height = backend.desktop.size
+    screen = {'left': 0, 'top': 0, 'width': width, 'height': height}
+
+    sender.CAPTURE_BACKENDS = {backend.name: backend}
+    sender.CAPTURE_BACKEND = backend.name
+    sender.list_monitors = lambda: [screen, dict(screen)]
+    sender.app.run(host=args.host, port=args.port, threaded=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Fixture screenshots for the benchmarks.
+
+Each fixture is a desktop of a given size with a ruled table drawn on it, so
+the sender encodes realistic content (text and grid lines on a flat
+background) and crops of the table look like what users extract.
+"""
+import random
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+# Desktop sizes the fake sender can serve
+FIXTURE_SIZES = {
+    'small': (800, 600),
+    'hd': (1920, 1080),
+    '4k': (3840, 2160)
+}
+
+COLUMNS = ['Date', 'Ticker', 'Open', 'Close', 'Change', 'Volume']
+
+ROW_HEIGHT = 22
+COLUMN_WIDTH = 110
+TABLE_MARGIN = 40
+
+def table_rows(count, seed=0):
+    """
+    Returns rows of plausible table data
+
+    Args:
+        count (int): Number of rows
+        seed (int): Random seed, so every run draws the same table
+
+    Returns:
+        list: Dicts keyed by COLUMNS
+    """
+    rng = random.Random(seed)
+    rows = []
+    for index in range(count):
+        opening = rng.uniform(10, 500)
+        closing = opening * rng.uniform(0.95, 1.05)
+        rows.append({
+            'Date': f"2024-{index % 12 + 1:02d}-{index % 28 + 1:02d}",
+            'Ticker': ''.join(rng.choice('ABCDEFGHIJKLMNOPQRSTUVWXYZ') for _ in range(4)),
+            'Open': f"{opening:,.2f}",
+            'Close': f"{closing:,.2f}",
+            'Change': f"{(closing - opening) / opening:.2%}",
+            'Volume': f"{rng.randint(1000, 9999999):,}"
+        })
+    return rows
+
+def table_box(size):
+    """Returns the (left, top, width, height) of the table drawn on a desktop of this size"""
+    width, height = size
+    columns = min(len(COLUMNS), (width - 2 * TABLE_MARGIN) // COLUMN_WIDTH)
+    rows = (height - 2 * TABLE_MARGIN) // ROW_HEIGHT
+    return TABLE_MARGIN, TABLE_MARGIN, columns * COLUMN_WIDTH, rows * ROW_HEIGHT
+
+def render_desktop(name):
+    """
+    Draws a fixture desktop
+
+    Args:
+        name (str): One of FIXTURE_SIZES
+
+    Returns:
+        PIL.Image.Image: RGB desktop with a table on it
+    """
+    size = FIXTURE_SIZES[name]
+    image = Image.new('RGB', size, (236, 239, 244))
+    draw = ImageDraw.Draw(image)
+
+    # Window chrome and some text outside the table
+    draw.rectangle((0, 0, size[0], 24), fill=(45, 52, 64))
+    for y in range(TABLE_MARGIN, size[1] - 20, 18):
+        draw.text((size[0] - 300, y), "Notes 12:34 lorem ipsum", fill=(90, 90, 90))
+
+    left, top, width, height = table_box(size)
+    columns = COLUMNS[:width // COLUMN_WIDTH]
+    rows = table_rows(height // ROW_HEIGHT - 1)
+    draw.rectangle((left, top, left + width, top + height), fill='white', outline='black')
+    for index, column in enumerate(columns):
+        x = left + index * COLUMN_WIDTH
+        draw.line((x, top, x, top + height), fill='black')
+        draw.text((x + 6, top + 5), column, fill='black')
+    for row_index, row in enumerate(rows, start=1):
+        y = top + row_index * ROW_HEIGHT
+        draw.line((left, y, left + width, y), fill=(160, 160, 160))
+        for index, column in enumerate(columns):
+            draw.text((left + index * COLUMN_WIDTH + 6, y + 5), row[column], fill='black')
+    return image
+
+def table_crop_png(name):
+    """
+    Returns the fixture's table as PNG bytes, as a user's crop would be
+
+    Args:
+        name (str): One of FIXTURE_SIZES
+
+    Returns:
+        bytes: PNG image of the table
+    """
+    left, top, width, height = table_box(FIXTURE_SIZES[name])
+    crop = render_desktop(name).crop((left, top, left + width + 1, top + height + 1))
+    output = BytesIO()
+    crop.save(output, format='PNG')
+    return output.getvalue()
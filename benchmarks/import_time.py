@@ -0,0 +1,160 @@
+"""
+Startup Benchmark
+
+Runs each target (importing the configuration, the web application, creating
+it, answering its first request, importing the batch CLI) in a fresh
+interpreter several times and writes the results as JSON: the median and
+minimum wall time of each, and the modules with the largest own import time
+reported by `python -X importtime`. Every run works in an empty temporary
+folder, so any file a target writes on import shows up in `created_files`.
+
+Results use the scenario and p50_ms fields of run.py, so two files can be
+compared with compare.py.
+
+Examples:
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --targets app,create-app --runs 20 --output startup.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime, timezone
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Code run by each target; 'python' measures the interpreter alone
+TARGETS = {
+    'python': 'pass',
+    'config': 'import config',
+    'app': 'import app',
+    'create-app': 'import app; app.create_app()',
+    'first-request': "import app; app.create_app().test_client().get('/senders')",
+    'batch': 'import batch_extract',
+}
+
+def run_once(code, env, workdir, importtime=False):
+    """Returns the wall time of one run in seconds and its stderr"""
+    args = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    started = time.perf_counter()
+    completed = subprocess.run(args, cwd=workdir, env=env, capture_output=True, text=True)
+    seconds = time.perf_counter() - started
+    if completed.returncode != 0:
+        raise RuntimeError(f"{code!r} failed:\n{completed.stderr[-2000:]}")
+    return seconds, completed.stderr
+
+def top_modules(importtime_output, count):
+    """Returns the modules with the largest own import time from -X importtime output"""
+    modules = []
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        modules.append({
+            'module': fields[2].strip(),
+            'self_ms': round(int(fields[0]) / 1000, 2),
+            'cumulative_ms': round(int(fields[1]) / 1000, 2)
+        })
+    modules.sort(key=lambda module: module['self_ms'], reverse=True)
+    return modules[:count]
+
+def run_target(name, runs, env, workdir, top):
+    code = TARGETS[name]
+    # One unmeasured run warms the file system cache and writes bytecode
+    run_once(code, env, workdir)
+    for entry in os.listdir(workdir):
+        path = os.path.join(workdir, entry)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    times = [run_once(code, env, workdir)[0] for _ in range(runs)]
+    created_files = sorted(os.listdir(workdir))
+    _, importtime_output = run_once(code, env, workdir, importtime=True)
+    return {
+        'scenario': name,
+        'concurrency': 1,
+        'code': code,
+        'runs': runs,
+        'p50_ms': round(statistics.median(times) * 1000, 2),
+        'min_ms': round(min(times) * 1000, 2),
+        'max_ms': round(max(times) * 1000, 2),
+        'created_files': created_files,
+        'top_modules': top_modules(importtime_output, top)
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description="Measure how long the application takes to start")
+    parser.add_argument('--targets', default=','.join(TARGETS),
+                        help=f"Comma-separated targets (default: all of {', '.join(TARGETS)})")
+    parser.add_argument('--runs', type=int, default=10, help="Measured runs per target")
+    parser.add_argument('--top', type=int, default=15, help="Slowest modules listed per target")
+    parser.add_argument('--output', help="File to write the JSON results to (default: stdout)")
+    return parser.parse_args()
+
+def main():
+    """Run every target and write the results"""
+    args = parse_args()
+    targets = [name for name in args.targets.split(',') if name.strip()]
+    unknown = [name for name in targets if name not in TARGETS]
+    if unknown:
+        print(f"Error: unknown target(s): {', '.join(unknown)}")
+        return 1
+
+    env = dict(
+        os.environ,
+        PYTHONPATH=os.pathsep.join(filter(None, [REPO_DIR, os.environ.get('PYTHONPATH')])),
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY') or 'benchmark',
+        SCHEDULER_ENABLED='False'
+    )
+    results = []
+    for name in targets:
+        workdir = tempfile.mkdtemp(prefix='screenshot-to-table-startup-')
+        try:
+            result = run_target(name, args.runs, env, workdir, args.top)
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+        print(
+            f"{name:>13} median {result['p50_ms']} ms, min {result['min_ms']} ms, "
+            f"{len(result['created_files'])} files created",
+            file=sys.stderr
+        )
+        results.append(result)
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {'runs': args.runs},
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
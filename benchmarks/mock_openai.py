@@ -0,0 +1,175 @@
+"""
+OpenAI-Compatible Mock Server for Benchmarks
+
+Answers POST /v1/chat/completions with a fixture table, after a configurable
+delay, optionally failing a share of requests with 429 or 500 and streaming
+the answer as server-sent events when the request asks for it. Point the
+application at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+Built on the standard library so the mock costs as little as possible next
+to the application being measured.
+
+Example:
+    python benchmarks/mock_openai.py --port 5078 --latency 0.8 --error-rate 0.05
+"""
+import sys
+import json
+import time
+import random
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fixtures import COLUMNS, table_rows
+
+class MockSettings:
+    """
+    How the mock answers
+
+    Args:
+        latency (float): Seconds before the first byte of each answer
+        jitter (float): Up to this many seconds added to or removed from the latency
+        error_rate (float): Share of requests failed with 429 or 500 (0 to 1)
+        rows (int): Rows in the returned table
+        stream_chunks (int): Pieces a streamed answer is split into
+        stream_delay (float): Seconds between streamed pieces
+    """
+
+    def __init__(self, latency=0.5, jitter=0.0, error_rate=0.0, rows=30, stream_chunks=20, stream_delay=0.02):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stream_chunks = stream_chunks
+        self.stream_delay = stream_delay
+        self.content = json.dumps({'columns': COLUMNS, 'rows': table_rows(rows)})
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """Handles chat completion requests as the OpenAI API would"""
+
+    protocol_version = 'HTTP/1.1'
+    settings = MockSettings()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': f'Unknown path {self.path}'}})
+            return
+
+        request = json.loads(body or b'{}')
+        settings = self.settings
+        time.sleep(max(0.0, settings.latency + random.uniform(-settings.jitter, settings.jitter)))
+
+        if random.random() < settings.error_rate:
+            if random.random() < 0.5:
+                self._send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit'}},
+                                {'Retry-After': '1'})
+            else:
+                self._send_json(500, {'error': {'message': 'Mock server error', 'type': 'server_error'}})
+            return
+
+        model = request.get('model', 'mock')
+        prompt_tokens = len(body) // 4
+        completion_tokens = len(settings.content) // 4
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens
+        }
+        if request.get('stream'):
+            include_usage = (request.get('stream_options') or {}).get('include_usage')
+            self._stream(model, usage if include_usage else None)
+            return
+
+        self._send_json(200, {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': settings.content},
+                'finish_reason': 'stop'
+            }],
+            'usage': usage
+        })
+
+    def _stream(self, model, usage):
+        """Sends the answer as server-sent events in settings.stream_chunks pieces"""
+        settings = self.settings
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+
+        content = settings.content
+        size = max(1, -(-len(content) // settings.stream_chunks))
+        for start in range(0, len(content), size):
+            delta = {'content': content[start:start + size]}
+            self._event(model, [{'index': 0, 'delta': delta, 'finish_reason': None}])
+            time.sleep(settings.stream_delay)
+        self._event(model, [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}])
+        if usage:
+            self._event(model, [], usage)
+        self.wfile.write(b'data: [DONE]\n\n')
+        self.wfile.flush()
+        self.close_connection = True
+
+    def _event(self, model, choices, usage=None):
+        chunk = {
+            'id': 'chatcmpl-mock',
+            'object': 'chat.completion.chunk',
+            'created': int(time.time()),
+            'model': model,
+            'choices': choices
+        }
+        if usage:
+            chunk['usage'] = usage
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.flush()
+
+    def _send_json(self, status, payload, headers=None):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description="Serve an OpenAI-compatible mock for benchmarks")
+    parser.add_argument('--host', default='127.0.0.1', help="Address to listen on")
+    parser.add_argument('--port', type=int, default=5078, help="Port to listen on")
+    parser.add_argument('--latency', type=float, default=0.5, help="Seconds before each answer")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Random +/- seconds on the latency")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Share of requests failed (0 to 1)")
+    parser.add_argument('--rows', type=int, default=30, help="Rows in the returned table")
+    parser.add_argument('--stream-chunks', type=int, default=20, help="Pieces a streamed answer is split into")
+    parser.add_argument('--stream-delay', type=float, default=0.02, help="Seconds between streamed pieces")
+    return parser.parse_args()
+
+def main():
+    """Run the mock until interrupted"""
+    args = parse_args()
+    MockOpenAIHandler.settings = MockSettings(
+        latency=args.latency, jitter=args.jitter, error_rate=args.error_rate, rows=args.rows,
+        stream_chunks=args.stream_chunks, stream_delay=args.stream_delay
+    )
+    server = ThreadingHTTPServer((args.host, args.port), MockOpenAIHandler)
+    server.daemon_threads = True
+    print(f"Mock OpenAI API listening on http://{args.host}:{args.port}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
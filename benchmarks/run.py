@@ -0,0 +1,391 @@
+"""
+Benchmark Runner
+
+Starts the fake sender, the OpenAI mock and the application on free local
+ports, with every data directory in a temporary folder, then drives the
+application's endpoints at each concurrency level and writes the results as
+JSON: latency percentiles, throughput, bytes moved and the application's
+peak resident memory per scenario and level. Results of two commits can be
+compared with compare.py.
+
+Examples:
+    python benchmarks/run.py
+    python benchmarks/run.py --scenarios extract,extract-stream --concurrency 1,8 --requests 100
+    python benchmarks/run.py --output before.json --latency 1.0 --error-rate 0.05
+"""
+import os
+import sys
+import json
+import time
+import base64
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fixtures import FIXTURE_SIZES, table_crop_png
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Seconds to wait for each server to start answering
+STARTUP_TIMEOUT = 60
+
+# How often the application's resident memory is sampled during a run
+RSS_SAMPLE_INTERVAL = 0.02
+
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+def scenario_screenshot(session, context):
+    response = session.get(f"{context['url']}/request-screenshot", params={'full': 1})
+    response.raise_for_status()
+    return 0, len(response.content)
+
+def scenario_save_cropped(session, context):
+    body = json.dumps({'image': context['image']})
+    response = session.post(f"{context['url']}/save-cropped", data=body, headers=JSON_HEADERS)
+    response.raise_for_status()
+    return len(body), len(response.content)
+
+def scenario_extract(session, context):
+    body = json.dumps({'image': context['image']})
+    response = session.post(f"{context['url']}/extract-table", data=body, headers=JSON_HEADERS)
+    response.raise_for_status()
+    if not response.json().get('success'):
+        raise RuntimeError(response.json().get('error'))
+    return len(body), len(response.content)
+
+def scenario_extract_stream(session, context):
+    body = json.dumps({'image': context['image']})
+    received = 0
+    last = None
+    with session.post(f"{context['url']}/extract-table", params={'stream': 1}, data=body,
+                      headers=JSON_HEADERS, stream=True) as response:
+        response.raise_for_status()
+        for line in response.iter_lines():
+            received += len(line) + 1
+            if line:
+                last = json.loads(line)
+    if not last or last.get('type') != 'done':
+        raise RuntimeError((last or {}).get('error', 'Stream ended without a result'))
+    return len(body), received
+
+def upload_image(session, context):
+    response = session.post(
+        f"{context['url']}/images", data=context['image_bytes'], headers={'Content-Type': 'image/png'}
+    )
+    response.raise_for_status()
+    return response
+
+def scenario_upload(session, context):
+    response = upload_image(session, context)
+    return len(context['image_bytes']), len(response.content)
+
+def scenario_extract_upload(session, context):
+    # The browser's flow: the crop is uploaded once as bytes, then extracted by its handle
+    uploaded = upload_image(session, context)
+    body = json.dumps({'image_id': uploaded.json()['image_id']})
+    response = session.post(f"{context['url']}/extract-table", data=body, headers=JSON_HEADERS)
+    response.raise_for_status()
+    if not response.json().get('success'):
+        raise RuntimeError(response.json().get('error'))
+    return len(context['image_bytes']) + len(body), len(uploaded.content) + len(response.content)
+
+def scenario_download_csv(session, context):
+    response = session.get(f"{context['url']}/download-csv", params={'result_id': context['result_id']})
+    response.raise_for_status()
+    return 0, len(response.content)
+
+SCENARIOS = {
+    'screenshot': scenario_screenshot,
+    'save-cropped': scenario_save_cropped,
+    'extract': scenario_extract,
+    'extract-stream': scenario_extract_stream,
+    'upload': scenario_upload,
+    'extract-upload': scenario_extract_upload,
+    'download-csv': scenario_download_csv
+}
+
+class RssSampler:
+    """
+    Tracks a process's peak resident memory while it is running
+
+    Reads /proc, so it reports None on systems without it.
+
+    Args:
+        pid (int): Process to watch
+    """
+
+    def __init__(self, pid):
+        self.path = f"/proc/{pid}/status"
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = self._read()
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            rss = self._read()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+def percentile(sorted_values, fraction):
+    """Returns the nearest-rank percentile of already sorted values"""
+    if not sorted_values:
+        return None
+    index = max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+def run_level(scenario, context, concurrency, requests_count, warmup, pid):
+    """
+    Runs one scenario at one concurrency level
+
+    Returns:
+        dict: Request and error counts, latency percentiles in milliseconds,
+            throughput, bytes sent and received, and peak RSS in bytes
+    """
+    func = SCENARIOS[scenario]
+    local = threading.local()
+    lock = threading.Lock()
+    latencies = []
+    totals = {'errors': 0, 'bytes_sent': 0, 'bytes_received': 0}
+    errors = []
+
+    def session():
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        return local.session
+
+    def one(_):
+        started = time.perf_counter()
+        try:
+            sent, received = func(session(), context)
+        except Exception as e:
+            with lock:
+                totals['errors'] += 1
+                if len(errors) < 5:
+                    errors.append(str(e))
+            return
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            totals['bytes_sent'] += sent
+            totals['bytes_received'] += received
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(lambda _: func(session(), context), range(warmup)))
+        latencies.clear()
+        with RssSampler(pid) as rss:
+            started = time.perf_counter()
+            list(executor.map(one, range(requests_count)))
+            seconds = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        'scenario': scenario,
+        'concurrency': concurrency,
+        'requests': requests_count,
+        'errors': totals['errors'],
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(latencies) / seconds, 2) if seconds else None,
+        'mean_ms': round(sum(latencies) / len(latencies) * 1000, 2) if latencies else None,
+        'bytes_sent': totals['bytes_sent'],
+        'bytes_received': totals['bytes_received'],
+        'peak_rss_bytes': rss.peak
+    }
+    for name, fraction in (('p50_ms', 0.50), ('p95_ms', 0.95), ('p99_ms', 0.99)):
+        value = percentile(latencies, fraction)
+        result[name] = round(value * 1000, 2) if value is not None else None
+    if errors:
+        result['sample_errors'] = errors
+    return result
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_process(args, cwd, env, log_path):
+    log = open(log_path, 'wb')
+    return subprocess.Popen([sys.executable] + args, cwd=cwd, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+def wait_until_up(url, process, name):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"{name} exited during startup (code {process.returncode})")
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.exceptions.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f"{name} did not start within {STARTUP_TIMEOUT}s")
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_list(value, convert=str):
+    return [convert(item) for item in value.split(',') if item.strip()]
+
+def parse_args():
+    """Parse command-line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmark the application against local stand-ins")
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"Comma-separated scenarios (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument('--concurrency', default='1,4,16', help="Comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=50, help="Measured requests per scenario and level")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests before each level")
+    parser.add_argument('--size', choices=sorted(FIXTURE_SIZES), default='hd', help="Fixture desktop size")
+    parser.add_argument('--latency', type=float, default=0.5, help="Mock API seconds per answer")
+    parser.add_argument('--jitter', type=float, default=0.0, help="Mock API random +/- seconds")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="Mock API share of failed requests")
+    parser.add_argument('--rows', type=int, default=30, help="Rows in the mock API's tables")
+    parser.add_argument('--cache', action='store_true',
+                        help="Leave the extraction cache on (off by default so every extraction reaches the mock)")
+    parser.add_argument('--env', action='append', default=[], metavar='KEY=VALUE',
+                        help="Extra application setting, e.g. --env OPENAI_MAX_CONCURRENCY=16")
+    parser.add_argument('--output', help="File to write the JSON results to (default: stdout)")
+    parser.add_argument('--keep', action='store_true', help="Keep the temporary folder with logs and data")
+    return parser.parse_args()
+
+def main():
+    """Start the servers, run every scenario at every level and write the results"""
+    args = parse_args()
+    scenarios = parse_list(args.scenarios)
+    unknown = [name for name in scenarios if name not in SCENARIOS]
+    if unknown:
+        print(f"Error: unknown scenario(s): {', '.join(unknown)}")
+        return 1
+    levels = parse_list(args.concurrency, int)
+
+    workdir = tempfile.mkdtemp(prefix='screenshot-to-table-bench-')
+    sender_port, mock_port, app_port = free_port(), free_port(), free_port()
+    app_env = dict(
+        os.environ,
+        DEBUG='False', HOST='127.0.0.1', PORT=str(app_port),
+        SENDERS='', SENDER_IP='127.0.0.1', SENDER_PORT=str(sender_port),
+        OPENAI_API_KEY=os.environ.get('OPENAI_API_KEY') or 'benchmark',
+        OPENAI_BASE_URL=f"http://127.0.0.1:{mock_port}/v1",
+        OPENAI_REQUESTS_PER_MINUTE='0', OPENAI_MAX_RETRIES='2', OPENAI_BACKOFF_BASE='0.1',
+        EXTRACTION_BACKEND='openai', SCHEDULER_ENABLED='False', CAPTURE_REMEMBER_REGION='False',
+        EXTRACTION_CACHE_ENABLED=str(args.cache), NEAR_DUPLICATE_ENABLED=str(args.cache),
+        SCREENSHOTS_DIR=os.path.join(workdir, 'screenshots'),
+        CROPPED_SCREENSHOTS_DIR=os.path.join(workdir, 'cropped_screenshots'),
+        CACHE_DIR=os.path.join(workdir, 'cache'),
+        UPLOADS_DIR=os.path.join(workdir, 'uploads'), BATCH_OUTPUT_DIR=os.path.join(workdir, 'batches'),
+        EXTRACTION_AUDIT_DIR=''
+    )
+    for setting in args.env:
+        key, _, value = setting.partition('=')
+        app_env[key] = value
+
+    processes = []
+    try:
+        sender = start_process(
+            [os.path.join(BENCHMARK_DIR, 'fake_sender.py'), '--port', str(sender_port), '--size', args.size],
+            workdir, dict(os.environ), os.path.join(workdir, 'sender.out')
+        )
+        processes.append(sender)
+        mock = start_process(
+            [os.path.join(BENCHMARK_DIR, 'mock_openai.py'), '--port', str(mock_port),
+             '--latency', str(args.latency), '--jitter', str(args.jitter),
+             '--error-rate', str(args.error_rate), '--rows', str(args.rows)],
+            workdir, dict(os.environ), os.path.join(workdir, 'mock.out')
+        )
+        processes.append(mock)
+        app = start_process([os.path.join(REPO_DIR, 'app.py')], workdir, app_env, os.path.join(workdir, 'app.out'))
+        processes.append(app)
+
+        wait_until_up(f"http://127.0.0.1:{sender_port}/status", sender, 'Fake sender')
+        wait_until_up(f"http://127.0.0.1:{mock_port}/", mock, 'Mock API')
+        wait_until_up(f"http://127.0.0.1:{app_port}/senders", app, 'Application')
+
+        image_bytes = table_crop_png(args.size)
+        context = {
+            'url': f"http://127.0.0.1:{app_port}",
+            'image_bytes': image_bytes,
+            'image': 'data:image/png;base64,' + base64.b64encode(image_bytes).decode('ascii')
+        }
+        if 'download-csv' in scenarios:
+            response = requests.post(f"{context['url']}/extract-table", json={'image': context['image']})
+            context['result_id'] = response.json().get('result_id')
+            if not context['result_id']:
+                print(f"Error: could not prepare a result to download: {response.text}")
+                return 1
+
+        results = []
+        for scenario in scenarios:
+            for level in levels:
+                result = run_level(scenario, context, level, args.requests, args.warmup, app.pid)
+                print(
+                    f"{scenario:>15} x{level:<3} p50 {result['p50_ms']} ms, p95 {result['p95_ms']} ms, "
+                    f"{result['throughput_rps']} req/s, {result['errors']} errors",
+                    file=sys.stderr
+                )
+                results.append(result)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait()
+
+    report = {
+        'commit': git_commit(),
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'size': args.size, 'latency': args.latency, 'jitter': args.jitter,
+            'error_rate': args.error_rate, 'rows': args.rows, 'cache': args.cache,
+            'requests': args.requests, 'warmup': args.warmup, 'env': args.env
+        },
+        'results': results
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.keep:
+        print(f"Logs and data kept in {workdir}", file=sys.stderr)
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,6 +1,10 @@
 """
 Configuration settings for the Screenshot to Table application.
 This file combines environment variables and secrets.py (for sensitive data).
+
+Importing it only reads settings. Directories are created by
+ensure_directories() and the settings are checked by validate_config(), both
+called by the app factory (app.create_app) and the command-line scripts.
 """
 import os
 import logging
@@ -22,52 +26,193 @@ SENDER_IP = os.getenv('SENDER_IP', '192.168.1.100')  # Replace with actual sende
 SENDER_PORT = int(os.getenv('SENDER_PORT', 5000))
 SENDER_URL = f"http://{SENDER_IP}:{SENDER_PORT}"
 
+def _parse_senders(value):
+    """Parses SENDERS ('name=host:port,...'; names and ports optional) into {name: url}"""
+    senders = {}
+    for entry in filter(None, (part.strip() for part in value.split(','))):
+        name, _, address = entry.rpartition('=')
+        if '://' not in address:
+            # Bare host[:port]; full URLs are used as given
+            address = f"http://{address}" if ':' in address else f"http://{address}:{SENDER_PORT}"
+        senders[name or address.split('://', 1)[1]] = address.rstrip('/')
+    return senders
+
+# Every sender machine by name; the first is the default (SENDER_IP/SENDER_PORT if unset)
+SENDERS = _parse_senders(os.getenv('SENDERS', '')) or {'default': SENDER_URL}
+SENDER_CONNECT_TIMEOUT = float(os.getenv('SENDER_CONNECT_TIMEOUT', 3))  # seconds, per sender
+SENDER_TIMEOUT = float(os.getenv('SENDER_TIMEOUT', 10))  # seconds between bytes, per sender
+SENDER_POOL_SIZE = int(os.getenv('SENDER_POOL_SIZE', 4))  # kept-alive connections per sender
+SENDER_FANOUT_WORKERS = int(os.getenv('SENDER_FANOUT_WORKERS', 16))  # concurrent captures for /request-screenshot-all
+
 # Try to load API keys from secrets.py first (preferred method)
 try:
     from api_keys import OPENAI_API_KEY as SECRET_OPENAI_API_KEY
     OPENAI_API_KEY = SECRET_OPENAI_API_KEY
-    logger.info("Loaded OpenAI API key from api_keys.py")
+    OPENAI_API_KEY_SOURCE = 'api_keys.py'
 except ImportError:
     # Fall back to environment variables if secrets.py not found
     OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', '')
-    if OPENAI_API_KEY:
-        logger.info("Loaded OpenAI API key from environment variables")
-    else:
-        logger.warning(
-            "No OpenAI API key found. Please add your API key to secrets.py "
-            "or set the OPENAI_API_KEY environment variable."
-        )
+    OPENAI_API_KEY_SOURCE = 'environment variables' if OPENAI_API_KEY else None
 
 # Other OpenAI Configuration
 OPENAI_MODEL = os.getenv('OPENAI_MODEL', 'gpt-4-vision-preview')
 OPENAI_MAX_TOKENS = int(os.getenv('OPENAI_MAX_TOKENS', 4000))
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', '')  # leave empty for the official API
+OPENAI_TIMEOUT = float(os.getenv('OPENAI_TIMEOUT', 120))  # seconds
+
+# OpenAI Client Limits
+OPENAI_POOL_CONNECTIONS = int(os.getenv('OPENAI_POOL_CONNECTIONS', 10))
+OPENAI_MAX_CONCURRENCY = int(os.getenv('OPENAI_MAX_CONCURRENCY', 4))
+OPENAI_REQUESTS_PER_MINUTE = int(os.getenv('OPENAI_REQUESTS_PER_MINUTE', 60))  # 0 disables
+OPENAI_TOKENS_PER_MINUTE = int(os.getenv('OPENAI_TOKENS_PER_MINUTE', 0))  # 0 disables
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', 4))
+OPENAI_BACKOFF_BASE = float(os.getenv('OPENAI_BACKOFF_BASE', 1.0))  # seconds
+OPENAI_BACKOFF_MAX = float(os.getenv('OPENAI_BACKOFF_MAX', 60.0))  # seconds
+OPENAI_CIRCUIT_FAILURE_THRESHOLD = int(os.getenv('OPENAI_CIRCUIT_FAILURE_THRESHOLD', 5))
+OPENAI_CIRCUIT_RESET_SECONDS = float(os.getenv('OPENAI_CIRCUIT_RESET_SECONDS', 30))
+
+# Extraction Backend Configuration
+# 'openai' always uses the API, 'local' only the local engine, and 'auto' tries
+# the local engine first and falls back to the API when it is not confident
+EXTRACTION_BACKEND = os.getenv('EXTRACTION_BACKEND', 'auto').lower()
+LOCAL_MIN_CONFIDENCE = float(os.getenv('LOCAL_MIN_CONFIDENCE', 0.8))  # 0 to 1
+TESSERACT_CMD = os.getenv('TESSERACT_CMD', '')  # leave empty to find tesseract on PATH
+TESSERACT_LANGUAGE = os.getenv('TESSERACT_LANGUAGE', 'eng')
 
 # File Storage Configuration
 SCREENSHOTS_DIR = os.getenv('SCREENSHOTS_DIR', 'data/screenshots')
 CROPPED_SCREENSHOTS_DIR = os.getenv('CROPPED_SCREENSHOTS_DIR', 'data/cropped_screenshots')
-TEMP_DIR = os.getenv('TEMP_DIR', 'data/temp')
+CACHE_DIR = os.getenv('CACHE_DIR', 'data/cache')
+# Images uploaded once and referenced by handle (image_id) afterwards
+UPLOADS_DIR = os.getenv('UPLOADS_DIR', 'data/uploads')
+# Optional copy of every image sent for extraction (empty disables it)
+EXTRACTION_AUDIT_DIR = os.getenv('EXTRACTION_AUDIT_DIR', '')
+# OpenAI rate limits shared by every worker process (empty keeps them per process)
+OPENAI_LIMITS_PATH = os.getenv('OPENAI_LIMITS_PATH', f"{CACHE_DIR}/openai_limits.sqlite3")
+
+# Screenshot Storage Configuration (content-addressed; retention and size limits apply to captures)
+SCREENSHOT_RETENTION_DAYS = float(os.getenv('SCREENSHOT_RETENTION_DAYS', 30))  # 0 keeps screenshots forever
+SCREENSHOT_MAX_MB = float(os.getenv('SCREENSHOT_MAX_MB', 0))  # 0 for no size limit
+# Saved crops and audit copies are records the user asked for, so they are kept forever by default
+CROPPED_RETENTION_DAYS = float(os.getenv('CROPPED_RETENTION_DAYS', 0))  # 0 keeps saved crops forever
+AUDIT_RETENTION_DAYS = float(os.getenv('AUDIT_RETENTION_DAYS', 0))  # 0 keeps audit copies forever
+SCREENSHOT_RECOMPRESS_AFTER = int(os.getenv('SCREENSHOT_RECOMPRESS_AFTER', 3600))  # seconds, 0 disables
+SCREENSHOT_COMPACT_INTERVAL = int(os.getenv('SCREENSHOT_COMPACT_INTERVAL', 600))  # seconds, 0 disables
+
+# Uploaded Image Configuration
+UPLOAD_RETENTION_HOURS = float(os.getenv('UPLOAD_RETENTION_HOURS', 24))  # 0 keeps uploads forever
+UPLOAD_MAX_MB = float(os.getenv('UPLOAD_MAX_MB', 32))  # largest image accepted by POST /images
+# Seconds a crop request waits for its capture to finish being stored
+CAPTURE_STORE_WAIT = float(os.getenv('CAPTURE_STORE_WAIT', 5))
+
+# Capture Configuration
+CAPTURE_MONITOR = int(os.getenv('CAPTURE_MONITOR', 0))  # 0 is the whole desktop, 1.. single monitors
+CAPTURE_SCALE = float(os.getenv('CAPTURE_SCALE', 1.0))  # sender-side downscale, 0 to 1
+# Encoding requested from the sender: png, webp, jpeg or raw (converted to PNG here)
+CAPTURE_FORMAT = os.getenv('CAPTURE_FORMAT', 'png').lower()
+# Repeat captures request only the region around each user's last crop
+CAPTURE_REMEMBER_REGION = os.getenv('CAPTURE_REMEMBER_REGION', 'True').lower() in ('true', '1', 't')
+CAPTURE_REGION_MARGIN = int(os.getenv('CAPTURE_REGION_MARGIN', 32))  # pixels around the last crop
+CAPTURE_REGIONS_PATH = os.getenv('CAPTURE_REGIONS_PATH', f"{CACHE_DIR}/capture_regions.sqlite3")
+CAPTURE_REGIONS_MAX_ENTRIES = int(os.getenv('CAPTURE_REGIONS_MAX_ENTRIES', 1000))  # least recently used dropped
+
+# Extraction Cache Configuration
+EXTRACTION_CACHE_ENABLED = os.getenv('EXTRACTION_CACHE_ENABLED', 'True').lower() in ('true', '1', 't')
+EXTRACTION_CACHE_PATH = os.getenv('EXTRACTION_CACHE_PATH', f"{CACHE_DIR}/extractions.sqlite3")
+EXTRACTION_CACHE_MEMORY_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MEMORY_ENTRIES', 256))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv('EXTRACTION_CACHE_MAX_ENTRIES', 10000))
+EXTRACTION_CACHE_MAX_AGE = int(os.getenv('EXTRACTION_CACHE_MAX_AGE', 30 * 24 * 3600))  # seconds
 
-# Ensure directories exist
-for directory in [SCREENSHOTS_DIR, CROPPED_SCREENSHOTS_DIR, TEMP_DIR]:
-    os.makedirs(directory, exist_ok=True)
+# Near-Duplicate Lookup Configuration
+# Off by default: a match answers a new image with an earlier image's table
+NEAR_DUPLICATE_ENABLED = os.getenv('NEAR_DUPLICATE_ENABLED', 'False').lower() in ('true', '1', 't')
+NEAR_DUPLICATE_INDEX_PATH = os.getenv('NEAR_DUPLICATE_INDEX_PATH', f"{CACHE_DIR}/near_duplicates.sqlite3")
+NEAR_DUPLICATE_THRESHOLD = int(os.getenv('NEAR_DUPLICATE_THRESHOLD', 16))  # max differing bits of 256
+NEAR_DUPLICATE_MAX_ASPECT_DIFF = float(os.getenv('NEAR_DUPLICATE_MAX_ASPECT_DIFF', 0.1))
+NEAR_DUPLICATE_MAX_SHIFT = int(os.getenv('NEAR_DUPLICATE_MAX_SHIFT', 8))  # pixels two crops may be offset by
+# Pixels that may still differ once two crops are aligned (0 requires identical content)
+NEAR_DUPLICATE_MAX_CHANGED_PIXELS = int(os.getenv('NEAR_DUPLICATE_MAX_CHANGED_PIXELS', 0))
+NEAR_DUPLICATE_MAX_ENTRIES = int(os.getenv('NEAR_DUPLICATE_MAX_ENTRIES', 2000))
+
+# Image Preprocessing Configuration (applied before extraction)
+PREPROCESS_ENABLED = os.getenv('PREPROCESS_ENABLED', 'True').lower() in ('true', '1', 't')
+PREPROCESS_TRIM = os.getenv('PREPROCESS_TRIM', 'True').lower() in ('true', '1', 't')
+# The vision model fits images within 2048x2048 and then scales the short side to 768
+PREPROCESS_MAX_LONG_EDGE = int(os.getenv('PREPROCESS_MAX_LONG_EDGE', 2048))
+PREPROCESS_MAX_SHORT_EDGE = int(os.getenv('PREPROCESS_MAX_SHORT_EDGE', 768))
+PREPROCESS_COLOR_MODE = os.getenv('PREPROCESS_COLOR_MODE', 'grayscale')  # grayscale, palette or keep
+PREPROCESS_FORMAT = os.getenv('PREPROCESS_FORMAT', 'png')  # png or jpeg
+PREPROCESS_JPEG_QUALITY = int(os.getenv('PREPROCESS_JPEG_QUALITY', 85))
+
+# Tiled Extraction Configuration (very tall tables)
+TILING_ENABLED = os.getenv('TILING_ENABLED', 'True').lower() in ('true', '1', 't')
+TILE_TRIGGER_ASPECT = float(os.getenv('TILE_TRIGGER_ASPECT', 2.5))  # height / width
+TILE_BAND_HEIGHT = int(os.getenv('TILE_BAND_HEIGHT', 1200))  # pixels
+TILE_OVERLAP = int(os.getenv('TILE_OVERLAP', 80))  # pixels
+TILE_MAX_CONCURRENCY = int(os.getenv('TILE_MAX_CONCURRENCY', 4))
+
+# Batch Extraction Configuration
+BATCH_SOURCE_ROOT = os.getenv('BATCH_SOURCE_ROOT', 'data')  # /extract-batch may only read below this
+BATCH_OUTPUT_DIR = os.getenv('BATCH_OUTPUT_DIR', 'data/batches')
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', 4))
+BATCH_REQUESTS_PER_MINUTE = int(os.getenv('BATCH_REQUESTS_PER_MINUTE', 60))
+
+# Background Job Configuration
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 4))
+JOB_QUEUE_SIZE = int(os.getenv('JOB_QUEUE_SIZE', 32))
+JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 3600))  # seconds
+BATCH_JOB_WORKERS = int(os.getenv('BATCH_JOB_WORKERS', 1))  # batches running at once, apart from JOB_WORKERS
+BATCH_JOB_QUEUE_SIZE = int(os.getenv('BATCH_JOB_QUEUE_SIZE', 4))
+# Job status and results, readable by every worker process
+JOBS_PATH = os.getenv('JOBS_PATH', f"{CACHE_DIR}/jobs.sqlite3")
+
+# Result Storage Configuration (extraction results kept for download by id)
+RESULTS_PATH = os.getenv('RESULTS_PATH', f"{CACHE_DIR}/results.sqlite3")
+
+# Scheduled Capture Configuration
+SCHEDULER_ENABLED = os.getenv('SCHEDULER_ENABLED', 'True').lower() in ('true', '1', 't')
+SCHEDULER_WORKERS = int(os.getenv('SCHEDULER_WORKERS', 4))  # scheduled runs executing at once
+SCHEDULE_MIN_INTERVAL = float(os.getenv('SCHEDULE_MIN_INTERVAL', 30))  # seconds
+SCHEDULES_PATH = os.getenv('SCHEDULES_PATH', f"{CACHE_DIR}/schedules.json")
+TIMESERIES_PATH = os.getenv('TIMESERIES_PATH', f"{CACHE_DIR}/timeseries.sqlite3")
+
+# Metrics Configuration (stage timings and counters served on /metrics)
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() in ('true', '1', 't')
+METRICS_JSON_LOGS = os.getenv('METRICS_JSON_LOGS', 'False').lower() in ('true', '1', 't')  # one JSON line per span
+METRICS_JSON_LOG_PATH = os.getenv('METRICS_JSON_LOG_PATH', 'screenshot_to_table.spans.jsonl')
+
+# Profiling Configuration (opt-in cProfile and tracemalloc runs of single requests)
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', 'False').lower() in ('true', '1', 't')
+PROFILING_SAMPLE_RATE = float(os.getenv('PROFILING_SAMPLE_RATE', 0))  # share of requests profiled unasked, 0 to 1
+PROFILING_TOKEN = os.getenv('PROFILING_TOKEN', '')  # when set, required to profile or read profiles
+PROFILING_MAX_PROFILES = int(os.getenv('PROFILING_MAX_PROFILES', 50))  # newest profiles kept
+PROFILING_TOP_ALLOCATIONS = int(os.getenv('PROFILING_TOP_ALLOCATIONS', 25))  # allocation sites per snapshot
+PROFILES_DIR = os.getenv('PROFILES_DIR', 'data/profiles')
+
+def ensure_directories():
+    """Creates the data directories the application writes to"""
+    for directory in [SCREENSHOTS_DIR, CROPPED_SCREENSHOTS_DIR, CACHE_DIR, UPLOADS_DIR,
+                      EXTRACTION_AUDIT_DIR, BATCH_OUTPUT_DIR]:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
 
 # Validate required configuration
 def validate_config():
     """Validate that all required configuration is present"""
-    if not OPENAI_API_KEY:
+    if OPENAI_API_KEY_SOURCE:
+        logger.info(f"Loaded OpenAI API key from {OPENAI_API_KEY_SOURCE}")
+    
+    if not OPENAI_API_KEY and EXTRACTION_BACKEND != 'local':
         logger.error(
             "OpenAI API key is missing. Table extraction functionality will not work. "
             "Please set up your API key in secrets.py or as an environment variable."
         )
         return False
         
-    if SENDER_IP == '192.168.1.100':  # Default value
+    if SENDER_IP == '192.168.1.100' and not os.getenv('SENDERS'):  # Default value
         logger.warning(
             "Using default sender IP address. Update SENDER_IP in .env or environment variables "
             "with the actual IP address of the sender machine."
         )
         
     return True
-
-# Run validation
-CONFIG_VALID = validate_config()
\ No newline at end of file
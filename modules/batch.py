@@ -0,0 +1,295 @@
+"""
+Module for extracting tables from whole folders of stored screenshots.
+
+Images are extracted with bounded concurrency and a requests-per-minute
+throttle, and each result is appended to a JSONL or CSV file as soon as it
+completes. Every record carries the image's content hash, so an interrupted
+batch can be resumed by skipping images already extracted successfully. CSV
+output has no line for a table without rows, so CSV batches also list the
+hashes of completed images in a COMPLETED_SUFFIX file next to the output.
+"""
+import os
+import csv
+import glob
+import json
+import time
+import hashlib
+import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from config import (
+    BATCH_OUTPUT_DIR, BATCH_CONCURRENCY, BATCH_REQUESTS_PER_MINUTE
+)
+from modules.image_processing import preprocess_image
+from modules.table_extraction import extract_table_with_backend, extract_table_from_image
+from modules.tiling import should_tile, extract_table_tiled
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.gif', '.bmp')
+
+# Columns of the long-format CSV output (one line per table cell)
+CSV_FIELDS = ['image_hash', 'source', 'row_index', 'column', 'value']
+
+# Appended to a CSV output path for the file listing completed image hashes
+COMPLETED_SUFFIX = '.completed'
+
+def find_images(source):
+    """
+    Lists the images in a directory (including its subdirectories, where the
+    screenshot stores shard their files) or matching a glob pattern
+
+    Args:
+        source (str): Directory path or glob pattern (e.g. "data/screenshots/**/*.png")
+
+    Returns:
+        list: Sorted image file paths
+    """
+    if os.path.isdir(source):
+        paths = [
+            os.path.join(directory, name)
+            for directory, _, names in os.walk(source)
+            for name in names
+        ]
+    else:
+        paths = glob.glob(source, recursive=True)
+
+    return sorted(
+        path for path in paths
+        if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS)
+    )
+
+def load_completed_hashes(output_path, output_format):
+    """
+    Reads the image hashes already extracted successfully into an output file
+
+    Args:
+        output_path (str): JSONL or CSV output of an earlier run
+        output_format (str): 'jsonl' or 'csv'
+
+    Returns:
+        set: Content hashes to skip
+    """
+    completed = set()
+    if output_format == 'csv' and os.path.exists(output_path + COMPLETED_SUFFIX):
+        with open(output_path + COMPLETED_SUFFIX, encoding='utf-8') as f:
+            # A crash can leave a partial last line behind, which matches no hash
+            completed.update(line.strip() for line in f)
+    if not os.path.exists(output_path):
+        return completed
+
+    with open(output_path, newline='', encoding='utf-8') as f:
+        if output_format == 'csv':
+            # Outputs written before the completed file existed
+            for row in csv.DictReader(f):
+                completed.add(row['image_hash'])
+        else:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash can leave a partial last line behind
+                    continue
+                if record.get('success'):
+                    completed.add(record['image_hash'])
+
+    return completed
+
+class RequestThrottle:
+    """
+    Spaces requests evenly to stay under a requests-per-minute limit
+
+    Args:
+        requests_per_minute (int): Maximum request rate (0 disables throttling)
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Blocks until the caller may send its next request"""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class BatchWriter:
+    """Appends batch results to a JSONL or CSV file as they complete"""
+
+    def __init__(self, output_path, output_format):
+        self.output_format = output_format
+        self._lock = threading.Lock()
+        is_new = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+        self._file = open(output_path, 'a', newline='', encoding='utf-8')
+        self._completed_file = None
+        if output_format == 'csv':
+            self._writer = csv.DictWriter(self._file, fieldnames=CSV_FIELDS)
+            if is_new:
+                self._writer.writeheader()
+            self._completed_file = open(output_path + COMPLETED_SUFFIX, 'a', encoding='utf-8')
+
+    def write(self, record):
+        """
+        Writes one image's result and flushes it to disk
+
+        Args:
+            record (dict): Result with image_hash, source, success and table_data or error
+        """
+        with self._lock:
+            if self.output_format == 'csv':
+                # Failed images are left out so a resumed run retries them
+                if record['success']:
+                    table_data = record['table_data']
+                    for index, row in enumerate(table_data['rows']):
+                        for column in table_data['columns']:
+                            self._writer.writerow({
+                                'image_hash': record['image_hash'],
+                                'source': record['source'],
+                                'row_index': index,
+                                'column': column,
+                                'value': row.get(column)
+                            })
+                    self._file.flush()
+                    # Listed only once its rows are on disk, so a resumed run never loses them
+                    self._completed_file.write(record['image_hash'] + '\n')
+                    self._completed_file.flush()
+            else:
+                self._file.write(json.dumps(record) + '\n')
+                self._file.flush()
+
+    def close(self):
+        self._file.close()
+        if self._completed_file:
+            self._completed_file.close()
+
+def run_batch(source, output_path=None, output_format='jsonl', concurrency=None,
+              requests_per_minute=None, use_cache=True, resume=True, on_result=None, backend=None):
+    """
+    Extracts tables from every image in a directory or glob
+
+    Args:
+        source (str): Directory path or glob pattern
+        output_path (str): Output file (defaults to a timestamped file in BATCH_OUTPUT_DIR)
+        output_format (str): 'jsonl' or 'csv'
+        concurrency (int): Maximum extractions in flight, clamped to 1..BATCH_CONCURRENCY
+        requests_per_minute (int): Maximum extraction start rate
+        use_cache (bool): Whether extractions may use the extraction cache
+        resume (bool): Skip images already extracted successfully into output_path
+        on_result (callable): Called with each record as it completes
+        backend (str): 'openai', 'local' or 'auto' (defaults to EXTRACTION_BACKEND)
+
+    Returns:
+        tuple: (success, summary_or_error)
+            - If successful, returns (True, summary dict with counts and output path)
+            - If failed, returns (False, error message)
+    """
+    try:
+        output_format = output_format.lower()
+        if output_format not in ('jsonl', 'csv'):
+            return False, f"Unsupported output format: {output_format}"
+
+        # Callers may lower the configured concurrency but never raise it
+        concurrency = max(1, min(int(concurrency or BATCH_CONCURRENCY), BATCH_CONCURRENCY))
+        requests_per_minute = BATCH_REQUESTS_PER_MINUTE if requests_per_minute is None else requests_per_minute
+
+        if not output_path:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            output_path = f"{BATCH_OUTPUT_DIR}/batch_{timestamp}.{output_format}"
+            os.makedirs(BATCH_OUTPUT_DIR, exist_ok=True)
+
+        paths = find_images(source)
+        completed = load_completed_hashes(output_path, output_format) if resume else set()
+        throttle = RequestThrottle(requests_per_minute)
+        writer = BatchWriter(output_path, output_format)
+
+        summary = {
+            'output_path': output_path,
+            'total': len(paths),
+            'succeeded': 0,
+            'failed': 0,
+            'skipped': 0,
+            'started_at': time.time()
+        }
+        logger.info(f"Starting batch of {len(paths)} images from {source} into {output_path}")
+
+        def process(path):
+            with open(path, 'rb') as f:
+                image_bytes = f.read()
+            image_hash = hashlib.sha256(image_bytes).hexdigest()
+            if image_hash in completed:
+                return None
+
+            started = time.time()
+            success, result = extract_table_with_backend(
+                image_bytes, use_cache=use_cache, backend=backend,
+                remote=lambda payload: _extract_throttled(payload, use_cache, throttle)
+            )
+            record = {
+                'image_hash': image_hash,
+                'source': path,
+                'success': success,
+                'seconds': round(time.time() - started, 3)
+            }
+            record['table_data' if success else 'error'] = result
+            return record
+
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = {executor.submit(process, path): path for path in paths}
+                for future in as_completed(futures):
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        record = {
+                            'image_hash': None,
+                            'source': futures[future],
+                            'success': False,
+                            'error': str(e)
+                        }
+
+                    if record is None:
+                        summary['skipped'] += 1
+                        continue
+
+                    writer.write(record)
+                    summary['succeeded' if record['success'] else 'failed'] += 1
+                    if on_result:
+                        on_result(record)
+        finally:
+            writer.close()
+
+        summary['seconds'] = round(time.time() - summary['started_at'], 3)
+        logger.info(
+            f"Batch finished: {summary['succeeded']} succeeded, {summary['failed']} failed, "
+            f"{summary['skipped']} skipped in {summary['seconds']}s"
+        )
+        return True, summary
+
+    except Exception as e:
+        error_msg = f"Error running batch extraction: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+def _extract_throttled(payload, use_cache, throttle):
+    """
+    Extracts one image with the API once the throttle allows it
+
+    Rate limits and transient errors are retried by the shared API client
+    (OPENAI_MAX_RETRIES), so they are not retried again here.
+    """
+    tiled = should_tile(payload)
+    if not tiled:
+        payload, _ = preprocess_image(payload)
+
+    throttle.wait()
+    if tiled:
+        return extract_table_tiled(payload, use_cache=use_cache)
+    return extract_table_from_image(payload, use_cache=use_cache)
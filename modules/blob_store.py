@@ -0,0 +1,464 @@
+"""
+Module for storing screenshots by content.
+
+Each image is stored once under the SHA-256 of its bytes, in directories
+sharded by the first characters of the hash (ab/cd/abcd...png), so no
+directory grows large and capturing an unchanged screen again takes no extra
+space. Files are written under a temporary name and renamed into place, so
+readers never see a partial image and two captures in the same second can
+never overwrite each other.
+
+A SQLite index in each store's root records every blob's size and when it
+was last stored. Retention deletes blobs not stored for longer than the
+maximum age, then the least recently stored ones while the store is over its
+size limit. A background compactor applies retention, removes leftovers of
+interrupted writes and recompresses PNGs once they are old enough: they are
+re-encoded losslessly at the highest compression level, spending CPU on idle
+files instead of on captures, and keep their name, the hash of the bytes as
+captured. Counts and sizes are kept in memory, so reporting them is O(1);
+retention reads the real total from the index, which every worker of a
+pre-fork server writes to. Each store is compacted by one process at a time,
+elected with a lock file in its root.
+"""
+import os
+import time
+import uuid
+import sqlite3
+import hashlib
+import logging
+import threading
+from io import BytesIO
+
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from config import (
+    SCREENSHOTS_DIR, CROPPED_SCREENSHOTS_DIR, EXTRACTION_AUDIT_DIR, SCREENSHOT_RETENTION_DAYS,
+    SCREENSHOT_MAX_MB, SCREENSHOT_RECOMPRESS_AFTER, SCREENSHOT_COMPACT_INTERVAL, UPLOADS_DIR,
+    UPLOAD_RETENTION_HOURS, CROPPED_RETENTION_DAYS, AUDIT_RETENTION_DAYS
+)
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Directory of each store (an empty directory disables the store)
+STORE_DIRS = {
+    'screenshots': SCREENSHOTS_DIR,
+    'cropped': CROPPED_SCREENSHOTS_DIR,
+    'audit': EXTRACTION_AUDIT_DIR,
+    'uploads': UPLOADS_DIR
+}
+
+# Settings that differ from the SCREENSHOT_* ones. Uploads are looked up by the
+# hash of their bytes, so recompressing them would break their handles
+STORE_OVERRIDES = {
+    'cropped': {'max_age': CROPPED_RETENTION_DAYS * 24 * 3600, 'max_bytes': 0},
+    'audit': {'max_age': AUDIT_RETENTION_DAYS * 24 * 3600, 'max_bytes': 0},
+    'uploads': {'max_age': UPLOAD_RETENTION_HOURS * 3600, 'recompress_after': 0}
+}
+
+INDEX_NAME = 'index.sqlite3'
+TEMP_DIR_NAME = 'tmp'
+# Held by the one process that compacts the store
+COMPACT_LOCK_NAME = 'compact.lock'
+
+# Temporary files older than this are leftovers of interrupted writes
+STALE_TEMP_SECONDS = 3600
+
+# PNGs recompressed per compaction pass, so a pass never runs for long
+RECOMPRESS_BATCH = 50
+
+_stores = {}
+_stores_lock = threading.Lock()
+_compactor = None
+
+class BlobStore:
+    """
+    Content-addressed file store with retention and recompression
+
+    Args:
+        root (str): Directory holding the blobs and their index
+        max_age (float): Seconds a blob is kept after it was last stored (0 keeps blobs forever)
+        max_bytes (int): Total size to prune the store down to (0 for no limit)
+        recompress_after (float): Age in seconds at which PNGs are recompressed (0 disables it)
+    """
+
+    def __init__(self, root, max_age=0, max_bytes=0, recompress_after=0):
+        self.root = root
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        self.recompress_after = recompress_after
+        self._lock = threading.Lock()
+        self._compact_lock_file = None
+        self._temp_dir = os.path.join(root, TEMP_DIR_NAME)
+        os.makedirs(self._temp_dir, exist_ok=True)
+
+        self._conn = sqlite3.connect(os.path.join(root, INDEX_NAME), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "hash TEXT PRIMARY KEY, "
+            "extension TEXT NOT NULL, "
+            "size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "stored_at REAL NOT NULL, "
+            "recompressed INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_stored_at ON blobs (stored_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_blobs_created_at ON blobs (created_at)")
+        self._conn.commit()
+
+        count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+        self._counters = {
+            'blobs': count,
+            'bytes': size,
+            'writes': 0,
+            'deduplicated': 0,
+            'pruned': 0,
+            'recompressed': 0,
+            'bytes_saved': 0
+        }
+
+    def path_for(self, digest, extension):
+        """Returns where the blob with this hash is stored"""
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}.{extension}")
+
+    def find(self, digest):
+        """
+        Returns the path of the blob with this hash
+
+        Args:
+            digest (str): SHA-256 hex digest of the blob's bytes
+
+        Returns:
+            str: Path of the stored blob, or None if it is not stored
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT extension FROM blobs WHERE hash = ?", (digest,)).fetchone()
+        if row is None:
+            return None
+        path = self.path_for(digest, row[0])
+        return path if os.path.exists(path) else None
+
+    def put(self, data, extension):
+        """
+        Stores bytes, unless a blob with the same content is already stored
+
+        Args:
+            data (bytes): File content
+            extension (str): File extension without the dot
+
+        Returns:
+            str: Path of the stored blob
+        """
+        writer = self.writer(extension)
+        try:
+            writer.write(data)
+        except Exception:
+            writer.abort()
+            raise
+        return writer.commit()
+
+    def writer(self, extension):
+        """
+        Starts writing a blob whose content arrives in pieces
+
+        Returns:
+            BlobWriter: Call write() for each piece, then commit() or abort()
+        """
+        return BlobWriter(self, extension)
+
+    def stats(self):
+        """
+        Returns the store's counters
+
+        Returns:
+            dict: blobs and bytes stored, and writes, deduplicated writes,
+                pruned and recompressed blobs and bytes saved since startup
+        """
+        with self._lock:
+            stats = dict(self._counters)
+        stats['root'] = self.root
+        return stats
+
+    def compact(self):
+        """
+        Applies retention, removes interrupted writes and recompresses old PNGs
+
+        Returns:
+            dict: Blobs pruned and recompressed by this pass
+        """
+        now = time.time()
+        pruned = self.prune(now)
+        self._remove_stale_temp(now)
+        recompressed = self._recompress(now) if self.recompress_after else 0
+        return {'pruned': pruned, 'recompressed': recompressed}
+
+    def prune(self, now=None):
+        """
+        Deletes blobs past the maximum age, then the oldest while over the size limit
+
+        Returns:
+            int: Number of blobs deleted
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            # Other workers write to the same index, so the in-memory counters can be stale
+            count, total = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            self._counters['blobs'], self._counters['bytes'] = count, total
+
+            victims = []
+            if self.max_age:
+                victims = self._conn.execute(
+                    "SELECT hash, extension, size FROM blobs WHERE stored_at < ?", (now - self.max_age,)
+                ).fetchall()
+            remaining = total - sum(size for _, _, size in victims)
+            if self.max_bytes and remaining > self.max_bytes:
+                expired = {digest for digest, _, _ in victims}
+                for digest, extension, size in self._conn.execute(
+                    "SELECT hash, extension, size FROM blobs ORDER BY stored_at"
+                ):
+                    if remaining <= self.max_bytes:
+                        break
+                    if digest not in expired:
+                        victims.append((digest, extension, size))
+                        remaining -= size
+            if not victims:
+                return 0
+
+            self._conn.executemany("DELETE FROM blobs WHERE hash = ?", [(digest,) for digest, _, _ in victims])
+            self._conn.commit()
+            for digest, extension, size in victims:
+                self._remove(self.path_for(digest, extension))
+                self._counters['blobs'] -= 1
+                self._counters['bytes'] -= size
+            self._counters['pruned'] += len(victims)
+
+        logger.info(f"Pruned {len(victims)} blob(s) from {self.root}")
+        return len(victims)
+
+    def acquire_compaction(self):
+        """
+        Tries to become the process that compacts this store
+
+        The lock is kept until the process exits, so another process takes
+        over on its next pass.
+
+        Returns:
+            bool: True if this process holds the store's compaction lock
+        """
+        if fcntl is None:
+            # No file locks (Windows): only one process serves the API there
+            return True
+        if self._compact_lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.root, COMPACT_LOCK_NAME), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._compact_lock_file = lock_file
+        logger.info(f"Process {os.getpid()} compacts {self.root}")
+        return True
+
+    def _commit(self, temp_path, digest, extension, size):
+        """Moves a finished temporary file into place, or drops it if the content is already stored"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT extension, size FROM blobs WHERE hash = ?", (digest,)).fetchone()
+            if row and os.path.exists(self.path_for(digest, row[0])):
+                os.remove(temp_path)
+                self._conn.execute("UPDATE blobs SET stored_at = ? WHERE hash = ?", (now, digest))
+                self._conn.commit()
+                self._counters['deduplicated'] += 1
+                return self.path_for(digest, row[0])
+
+            path = self.path_for(digest, extension)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+            self._conn.execute(
+                "INSERT OR REPLACE INTO blobs (hash, extension, size, created_at, stored_at) VALUES (?, ?, ?, ?, ?)",
+                (digest, extension, size, now, now)
+            )
+            self._conn.commit()
+            self._counters['writes'] += 1
+            if row is None:
+                self._counters['blobs'] += 1
+                self._counters['bytes'] += size
+            else:
+                # The indexed file had gone missing and was written again
+                self._counters['bytes'] += size - row[1]
+            return path
+
+    def _recompress(self, now):
+        """Re-encodes a batch of old PNGs at the highest compression, keeping any that shrink"""
+        with self._lock:
+            candidates = self._conn.execute(
+                "SELECT hash, size FROM blobs WHERE extension = 'png' AND recompressed = 0 AND created_at < ? "
+                "ORDER BY created_at LIMIT ?",
+                (now - self.recompress_after, RECOMPRESS_BATCH)
+            ).fetchall()
+
+        count = 0
+        for digest, size in candidates:
+            path = self.path_for(digest, 'png')
+            temp_path = os.path.join(self._temp_dir, f"{uuid.uuid4().hex}.part")
+            try:
+                with Image.open(path) as img:
+                    output = BytesIO()
+                    img.save(output, format='PNG', optimize=True)
+                data = output.getvalue()
+                if len(data) < size:
+                    with open(temp_path, 'wb') as f:
+                        f.write(data)
+            except FileNotFoundError:
+                data = None
+            except Exception as e:
+                logger.error(f"Error recompressing {path}: {str(e)}")
+                data = None
+
+            with self._lock:
+                if not self._conn.execute("SELECT 1 FROM blobs WHERE hash = ?", (digest,)).fetchone():
+                    # Pruned meanwhile
+                    self._remove(temp_path)
+                    continue
+                if data is not None and len(data) < size:
+                    os.replace(temp_path, path)
+                    self._conn.execute(
+                        "UPDATE blobs SET size = ?, recompressed = 1 WHERE hash = ?", (len(data), digest)
+                    )
+                    self._counters['bytes'] -= size - len(data)
+                    self._counters['bytes_saved'] += size - len(data)
+                    self._counters['recompressed'] += 1
+                    count += 1
+                else:
+                    self._conn.execute("UPDATE blobs SET recompressed = 1 WHERE hash = ?", (digest,))
+                self._conn.commit()
+        return count
+
+    def _remove_stale_temp(self, now):
+        with os.scandir(self._temp_dir) as entries:
+            for entry in entries:
+                try:
+                    if entry.stat().st_mtime < now - STALE_TEMP_SECONDS:
+                        os.remove(entry.path)
+                except OSError:
+                    continue
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+class BlobWriter:
+    """
+    Writes one blob to a temporary file, hashing it as it is written
+
+    Args:
+        store (BlobStore): Store the blob belongs to
+        extension (str): File extension without the dot
+    """
+
+    def __init__(self, store, extension):
+        self.store = store
+        self.extension = extension
+        self._digest = hashlib.sha256()
+        self._size = 0
+        self._temp_path = os.path.join(store._temp_dir, f"{uuid.uuid4().hex}.part")
+        self._file = open(self._temp_path, 'wb')
+
+    def write(self, data):
+        self._file.write(data)
+        self._digest.update(data)
+        self._size += len(data)
+
+    def commit(self):
+        """
+        Finishes the blob
+
+        Returns:
+            str: Path of the stored blob
+        """
+        self._file.close()
+        return self.store._commit(self._temp_path, self._digest.hexdigest(), self.extension, self._size)
+
+    def abort(self):
+        """Discards the blob"""
+        self._file.close()
+        self.store._remove(self._temp_path)
+
+def get_blob_store(name):
+    """
+    Returns a named store ('screenshots', 'cropped', 'audit' or 'uploads'), opening it on first use
+
+    The first store opened starts the background compactor.
+
+    Returns:
+        BlobStore: The store, or None if its directory is not configured
+    """
+    root = STORE_DIRS[name]
+    if not root:
+        return None
+
+    if name not in _stores:
+        with _stores_lock:
+            if name not in _stores:
+                options = {
+                    'max_age': SCREENSHOT_RETENTION_DAYS * 24 * 3600,
+                    'max_bytes': int(SCREENSHOT_MAX_MB * 1024 * 1024),
+                    'recompress_after': SCREENSHOT_RECOMPRESS_AFTER
+                }
+                options.update(STORE_OVERRIDES.get(name, {}))
+                _stores[name] = BlobStore(root, **options)
+                logger.info(f"Blob store '{name}' opened at {root}")
+                _start_compactor()
+    return _stores[name]
+
+def storage_stats():
+    """
+    Returns the counters of every configured store
+
+    Returns:
+        dict: Store name -> BlobStore.stats()
+    """
+    return {name: get_blob_store(name).stats() for name, root in STORE_DIRS.items() if root}
+
+def _start_compactor():
+    global _compactor
+
+    if _compactor is None and SCREENSHOT_COMPACT_INTERVAL > 0:
+        _compactor = threading.Thread(target=_compact_loop, name='blob-compactor', daemon=True)
+        _compactor.start()
+
+def _compact_loop():
+    while True:
+        time.sleep(SCREENSHOT_COMPACT_INTERVAL)
+        for name, store in list(_stores.items()):
+            try:
+                if store.acquire_compaction():
+                    store.compact()
+            except Exception as e:
+                logger.error(f"Error compacting blob store '{name}': {str(e)}")
+
+@reset_after_fork
+def _reset_stores():
+    """
+    Forgets the stores in a forked worker
+
+    The child reopens their indexes, and starts its own compactor, since
+    the parent's thread does not survive the fork.
+    """
+    global _stores, _stores_lock, _compactor
+    for store in _stores.values():
+        if store._compact_lock_file is not None:
+            # The parent keeps its lock; the child's copy would outlive the parent and block every takeover
+            store._compact_lock_file.close()
+    _stores = {}
+    _stores_lock = threading.Lock()
+    _compactor = None
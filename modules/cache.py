@@ -0,0 +1,246 @@
+"""
+Module for caching table extraction results.
+
+Results are keyed by a hash of the decoded image bytes together with the
+model, prompt and token limit, so changing any of them is a cache miss.
+A small in-memory LRU tier sits in front of a SQLite database on disk.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from config import (
+    EXTRACTION_CACHE_ENABLED, EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_MEMORY_ENTRIES,
+    EXTRACTION_CACHE_MAX_ENTRIES, EXTRACTION_CACHE_MAX_AGE
+)
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def make_cache_key(image_bytes, model, prompt, max_tokens):
+    """
+    Builds a content-addressed cache key for an extraction request
+
+    Args:
+        image_bytes (bytes): Decoded image data (bytes or memoryview)
+        model (str): Model name used for the extraction
+        prompt (str): Prompt text sent alongside the image
+        max_tokens (int): Token limit for the response
+
+    Returns:
+        str: Hex digest identifying the request
+    """
+    digest = hashlib.sha256(image_bytes)
+    for part in (model, prompt, str(max_tokens)):
+        digest.update(b'\0')
+        digest.update(part.encode('utf-8'))
+    return digest.hexdigest()
+
+class ExtractionCache:
+    """
+    Two-tier cache of extraction results (memory LRU in front of SQLite)
+
+    Values are stored as JSON text so every hit returns a fresh copy that
+    callers are free to mutate.
+    """
+
+    def __init__(self, path, memory_entries=256, max_entries=10000, max_age=None):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {
+            'hits': 0,
+            'misses': 0,
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'writes': 0,
+            'evictions': 0,
+        }
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS extractions ("
+            "key TEXT PRIMARY KEY, "
+            "value TEXT NOT NULL, "
+            "created_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extractions_accessed_at ON extractions (accessed_at)"
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """
+        Looks up a cached extraction result
+
+        Args:
+            key (str): Cache key from make_cache_key()
+
+        Returns:
+            dict: Cached table data, or None on a miss
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and not self._is_expired(entry[1], now):
+                self._memory.move_to_end(key)
+                self._counters['hits'] += 1
+                self._counters['memory_hits'] += 1
+                return json.loads(entry[0])
+
+            row = self._conn.execute(
+                "SELECT value, created_at FROM extractions WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or self._is_expired(row[1], now):
+                if row is not None:
+                    self._delete(key)
+                self._counters['misses'] += 1
+                return None
+
+            self._conn.execute("UPDATE extractions SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self._remember(key, row[0], row[1])
+            self._counters['hits'] += 1
+            self._counters['disk_hits'] += 1
+            return json.loads(row[0])
+
+    def set(self, key, table_data):
+        """
+        Stores an extraction result in both tiers
+
+        Args:
+            key (str): Cache key from make_cache_key()
+            table_data (dict): Validated table data to store
+        """
+        value = json.dumps(table_data)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extractions (key, value, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            self._conn.commit()
+            self._remember(key, value, now)
+            self._counters['writes'] += 1
+            self._evict(now)
+
+    def clear(self):
+        """Removes every entry from both tiers"""
+        with self._lock:
+            self._memory.clear()
+            self._conn.execute("DELETE FROM extractions")
+            self._conn.commit()
+
+    def stats(self):
+        """
+        Returns hit/miss counters and tier sizes
+
+        Returns:
+            dict: Cache statistics
+        """
+        with self._lock:
+            disk_entries = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+            stats = dict(self._counters)
+            stats['memory_entries'] = len(self._memory)
+            stats['disk_entries'] = disk_entries
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _is_expired(self, created_at, now):
+        return bool(self.max_age) and now - created_at > self.max_age
+
+    def _remember(self, key, value, created_at):
+        self._memory[key] = (value, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _delete(self, key):
+        self._memory.pop(key, None)
+        self._conn.execute("DELETE FROM extractions WHERE key = ?", (key,))
+        self._conn.commit()
+
+    def _evict(self, now):
+        """Drops expired entries, then least recently used ones over the size limit"""
+        evicted = 0
+        if self.max_age:
+            evicted += self._conn.execute(
+                "DELETE FROM extractions WHERE created_at < ?", (now - self.max_age,)
+            ).rowcount
+
+        if self.max_entries:
+            count = self._conn.execute("SELECT COUNT(*) FROM extractions").fetchone()[0]
+            if count > self.max_entries:
+                keys = [row[0] for row in self._conn.execute(
+                    "SELECT key FROM extractions ORDER BY accessed_at ASC LIMIT ?",
+                    (count - self.max_entries,)
+                )]
+                self._conn.executemany("DELETE FROM extractions WHERE key = ?", [(key,) for key in keys])
+                evicted += len(keys)
+                # Memory hits never touch accessed_at, so a key can be hot here and least recent on disk
+                for key in keys:
+                    self._memory.pop(key, None)
+
+        if evicted:
+            self._conn.commit()
+            self._counters['evictions'] += evicted
+            # Expired entries are dropped from memory too; LRU-evicted ones were dropped above
+            for key in list(self._memory):
+                if self._is_expired(self._memory[key][1], now):
+                    del self._memory[key]
+            logger.info(f"Evicted {evicted} entries from extraction cache")
+
+def get_extraction_cache():
+    """
+    Returns the shared extraction cache, creating it on first use
+
+    Returns:
+        ExtractionCache: The cache, or None if caching is disabled or unavailable
+    """
+    global _cache
+
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = ExtractionCache(
+                        EXTRACTION_CACHE_PATH,
+                        memory_entries=EXTRACTION_CACHE_MEMORY_ENTRIES,
+                        max_entries=EXTRACTION_CACHE_MAX_ENTRIES,
+                        max_age=EXTRACTION_CACHE_MAX_AGE
+                    )
+                    logger.info(f"Extraction cache opened at {EXTRACTION_CACHE_PATH}")
+                except Exception as e:
+                    logger.error(f"Error opening extraction cache: {str(e)}")
+                    return None
+    return _cache
+
+@reset_after_fork
+def _reset_cache():
+    """Forgets the cache in a forked worker, which must open its own SQLite connection"""
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
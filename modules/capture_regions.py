@@ -0,0 +1,209 @@
+"""
+Module for remembering each user's last crop as a screen capture region.
+
+When a user crops a screenshot, the crop rectangle is converted back into
+the sender's screen coordinates (relative to the captured monitor) and
+stored under the user's client id. The next capture for that user asks the
+sender for just that region, plus a small margin, instead of the whole
+desktop.
+
+Regions are kept in SQLite, so every worker of a pre-fork server sees the
+crops saved by the others. Only the CAPTURE_REGIONS_MAX_ENTRIES most
+recently used regions are kept.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+
+from config import CAPTURE_REGIONS_PATH, CAPTURE_REGION_MARGIN, CAPTURE_REGIONS_MAX_ENTRIES
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+
+def crop_to_capture_region(crop, capture_region, capture_scale=1.0, margin=None):
+    """
+    Converts a crop of a captured image into a region of the sender's monitor
+
+    Args:
+        crop (dict): x, y, width and height of the crop in captured-image pixels
+        capture_region (list): left, top, width, height of the capture on its monitor
+        capture_scale (float): Scale the sender applied to the capture
+        margin (int): Screen pixels added around the crop (defaults to CAPTURE_REGION_MARGIN)
+
+    Returns:
+        dict: left, top, width and height in screen pixels, clamped to the captured region
+    """
+    margin = CAPTURE_REGION_MARGIN if margin is None else margin
+    region_left, region_top, region_width, region_height = [int(value) for value in capture_region]
+    scale = float(capture_scale) or 1.0
+
+    left = region_left + float(crop['x']) / scale - margin
+    top = region_top + float(crop['y']) / scale - margin
+    right = region_left + (float(crop['x']) + float(crop['width'])) / scale + margin
+    bottom = region_top + (float(crop['y']) + float(crop['height'])) / scale + margin
+
+    left = max(region_left, int(left))
+    top = max(region_top, int(top))
+    right = min(region_left + region_width, int(round(right)))
+    bottom = min(region_top + region_height, int(round(bottom)))
+    if right <= left or bottom <= top:
+        raise ValueError("Crop lies outside the captured region")
+
+    return {'left': left, 'top': top, 'width': right - left, 'height': bottom - top}
+
+class RegionStore:
+    """
+    SQLite store of capture regions keyed by client id
+
+    Args:
+        path (str): SQLite database file
+        max_entries (int): Regions kept; the least recently used are deleted first
+    """
+
+    def __init__(self, path, max_entries=1000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS capture_regions ("
+            "client_id TEXT PRIMARY KEY, "
+            "region TEXT NOT NULL, "
+            "used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_capture_regions_used ON capture_regions (used_at)")
+        self._conn.commit()
+        self._import_json()
+
+    def get(self, client_id):
+        """Returns a client's region, marking it as used, or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT region FROM capture_regions WHERE client_id = ?", (client_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                "UPDATE capture_regions SET used_at = ? WHERE client_id = ?", (time.time(), client_id)
+            )
+            self._conn.commit()
+        return json.loads(row[0])
+
+    def set(self, client_id, region):
+        """Stores a client's region, deleting the least recently used beyond max_entries"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO capture_regions (client_id, region, used_at) VALUES (?, ?, ?)",
+                (client_id, json.dumps(region), time.time())
+            )
+            self._conn.execute(
+                "DELETE FROM capture_regions WHERE client_id NOT IN "
+                "(SELECT client_id FROM capture_regions ORDER BY used_at DESC LIMIT ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def delete(self, client_id):
+        """Drops a client's region"""
+        with self._lock:
+            self._conn.execute("DELETE FROM capture_regions WHERE client_id = ?", (client_id,))
+            self._conn.commit()
+
+    def _import_json(self):
+        """Moves regions from the JSON file earlier versions kept next to the database"""
+        legacy_path = f"{os.path.splitext(self.path)[0]}.json"
+        if not os.path.exists(legacy_path):
+            return
+        try:
+            with open(legacy_path, encoding='utf-8') as f:
+                regions = json.load(f)
+            now = time.time()
+            with self._lock:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO capture_regions (client_id, region, used_at) VALUES (?, ?, ?)",
+                    [(client_id, json.dumps(region), now) for client_id, region in regions.items()]
+                )
+                self._conn.commit()
+            os.remove(legacy_path)
+            logger.info(f"Imported {len(regions)} capture region(s) from {legacy_path}")
+        except FileNotFoundError:
+            # Another worker imported it first
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Error importing capture regions: {str(e)}")
+
+def get_region_store():
+    """
+    Returns the shared region store, creating it on first use
+
+    Returns:
+        RegionStore: The store, or None if it could not be opened
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = RegionStore(CAPTURE_REGIONS_PATH, max_entries=CAPTURE_REGIONS_MAX_ENTRIES)
+                except Exception as e:
+                    logger.error(f"Error opening capture region store: {str(e)}")
+                    return None
+    return _store
+
+def get_capture_region(client_id):
+    """
+    Returns the remembered capture region for a client
+
+    Args:
+        client_id (str): Id from the client's cookie
+
+    Returns:
+        dict: monitor, left, top, width and height, or None if none is remembered
+    """
+    store = get_region_store()
+    return store.get(client_id) if store else None
+
+def remember_capture_region(client_id, region):
+    """
+    Stores a client's capture region
+
+    Args:
+        client_id (str): Id from the client's cookie
+        region (dict): monitor, left, top, width and height
+    """
+    store = get_region_store()
+    if store is None:
+        return
+    store.set(client_id, region)
+    logger.info(f"Remembered capture region {region} for client {client_id[:8]}")
+
+def forget_capture_region(client_id):
+    """
+    Drops a client's capture region so the next capture is the full desktop
+
+    Args:
+        client_id (str): Id from the client's cookie
+    """
+    store = get_region_store()
+    if store:
+        store.delete(client_id)
+
+@reset_after_fork
+def _reset_store():
+    """Forgets the store in a forked worker so it connects to the database itself"""
+    global _store, _store_lock
+    _store = None
+    _store_lock = threading.Lock()
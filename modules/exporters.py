@@ -0,0 +1,214 @@
+"""
+Module for writing tables in download formats.
+
+Every exporter writes from a ColumnarTable. CSV, JSON and JSONL are produced
+in chunks as rows are encoded, so a response can stream them; they keep
+cell values exactly as extracted. Parquet, Arrow IPC and XLSX store each column
+in its inferred type (numbers, percentages and currency amounts as numbers,
+dates as dates) and are written whole, since their writers need the
+complete file. They need pyarrow and openpyxl respectively, both optional
+and imported by the first export that needs them, since either takes longer
+to import than the rest of the application.
+"""
+import io
+import csv
+import json
+import logging
+from functools import lru_cache
+from importlib.util import find_spec
+
+from modules.table import ColumnarTable
+
+logger = logging.getLogger(__name__)
+
+# Encoded output is yielded in chunks of about this size
+EXPORT_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'csv': {'mimetype': 'text/csv', 'extension': 'csv'},
+    'json': {'mimetype': 'application/json', 'extension': 'json'},
+    'jsonl': {'mimetype': 'application/x-ndjson', 'extension': 'jsonl'},
+    'parquet': {'mimetype': 'application/vnd.apache.parquet', 'extension': 'parquet'},
+    'arrow': {'mimetype': 'application/vnd.apache.arrow.file', 'extension': 'arrow'},
+    'xlsx': {
+        'mimetype': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+        'extension': 'xlsx'
+    }
+}
+
+# Spreadsheet number formats for typed columns
+XLSX_NUMBER_FORMATS = {'percent': '0.00%', 'currency': '#,##0.00', 'date': 'yyyy-mm-dd'}
+
+def available_formats():
+    """
+    Lists the export formats whose libraries are installed
+
+    Returns:
+        list: Format names usable with iter_export
+    """
+    formats = ['csv', 'json', 'jsonl']
+    if _installed('pyarrow'):
+        formats += ['parquet', 'arrow']
+    if _installed('openpyxl'):
+        formats.append('xlsx')
+    return formats
+
+@lru_cache(maxsize=None)
+def _installed(library):
+    """Returns True if a library can be imported, without importing it"""
+    return find_spec(library) is not None
+
+def iter_export(table, fmt):
+    """
+    Encodes a table in an export format, yielding the output in chunks
+
+    Args:
+        table: ColumnarTable, or table data with 'columns' and 'rows'
+        fmt (str): One of EXPORT_FORMATS
+
+    Yields:
+        bytes: Consecutive pieces of the encoded file
+
+    Raises:
+        ValueError: If the format is unknown or its library is not installed
+    """
+    fmt = fmt.lower()
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    if fmt not in available_formats():
+        library = 'openpyxl' if fmt == 'xlsx' else 'pyarrow'
+        raise ValueError(f"Exporting {fmt} requires {library} to be installed")
+
+    if not isinstance(table, ColumnarTable):
+        table = ColumnarTable.from_table_data(table)
+    return _EXPORTERS[fmt](table)
+
+def export_table(table, fmt, fp):
+    """
+    Writes a table to a binary file object
+
+    Args:
+        table: ColumnarTable, or table data with 'columns' and 'rows'
+        fmt (str): One of EXPORT_FORMATS
+        fp: Binary file object to write to
+
+    Raises:
+        ValueError: If the format is unknown or its library is not installed
+    """
+    for chunk in iter_export(table, fmt):
+        fp.write(chunk)
+
+def iter_csv_text(table):
+    """Yields a table as CSV text in chunks, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(table.columns)
+    for row in table.iter_rows():
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def _export_csv(table):
+    for text in iter_csv_text(table):
+        yield text.encode('utf-8')
+
+def _export_json(table):
+    """Writes {"columns": [...], "rows": [{...}, ...]}, the shape extraction results have"""
+    columns = table.columns
+    parts = ['{"columns": ', json.dumps(columns, ensure_ascii=False), ', "rows": [']
+    size = 0
+    separator = ''
+    for row in table.iter_rows():
+        item = separator + json.dumps(dict(zip(columns, row)), ensure_ascii=False)
+        separator = ', '
+        parts.append(item)
+        size += len(item)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(parts).encode('utf-8')
+            parts, size = [], 0
+    parts.append(']}\n')
+    yield ''.join(parts).encode('utf-8')
+
+def _export_jsonl(table):
+    columns = table.columns
+    lines = []
+    size = 0
+    for row in table.iter_rows():
+        line = json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines).encode('utf-8')
+            lines, size = [], 0
+    if lines:
+        yield ''.join(lines).encode('utf-8')
+
+def _arrow_table(table):
+    """Builds a pyarrow table with typed columns, recording each column's dtype as field metadata"""
+    import pyarrow
+    arrays = []
+    fields = []
+    for index, field in enumerate(table.schema):
+        values = table.typed_column(index)
+        array = pyarrow.array(values, type=pyarrow.string() if field['dtype'] == 'text' else None)
+        arrays.append(array)
+        fields.append(pyarrow.field(field['name'], array.type, metadata={'dtype': field['dtype']}))
+    return pyarrow.Table.from_arrays(arrays, schema=pyarrow.schema(fields))
+
+def _export_parquet(table):
+    import pyarrow.parquet
+    output = io.BytesIO()
+    pyarrow.parquet.write_table(_arrow_table(table), output)
+    yield from _chunks(output.getbuffer())
+
+def _export_arrow(table):
+    import pyarrow.ipc
+    arrow_table = _arrow_table(table)
+    output = io.BytesIO()
+    with pyarrow.ipc.new_file(output, arrow_table.schema) as writer:
+        writer.write_table(arrow_table)
+    yield from _chunks(output.getbuffer())
+
+def _export_xlsx(table):
+    import openpyxl
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Table')
+    sheet.append(table.columns)
+
+    columns = [table.typed_column(index) for index in range(len(table.columns))]
+    formats = [XLSX_NUMBER_FORMATS.get(field['dtype']) for field in table.schema]
+    for row in zip(*columns):
+        cells = []
+        for value, number_format in zip(row, formats):
+            if isinstance(value, str):
+                # Control characters are not allowed in worksheet XML
+                value = ILLEGAL_CHARACTERS_RE.sub('', value)
+            if number_format and value is not None:
+                cell = WriteOnlyCell(sheet, value=value)
+                cell.number_format = number_format
+                value = cell
+            cells.append(value)
+        sheet.append(cells)
+
+    output = io.BytesIO()
+    workbook.save(output)
+    yield from _chunks(output.getbuffer())
+
+def _chunks(buffer):
+    """Yields a finished file's bytes in EXPORT_CHUNK_SIZE pieces"""
+    for start in range(0, len(buffer), EXPORT_CHUNK_SIZE):
+        yield bytes(buffer[start:start + EXPORT_CHUNK_SIZE])
+
+_EXPORTERS = {
+    'csv': _export_csv,
+    'json': _export_json,
+    'jsonl': _export_jsonl,
+    'parquet': _export_parquet,
+    'arrow': _export_arrow,
+    'xlsx': _export_xlsx
+}
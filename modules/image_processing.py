@@ -1,27 +1,112 @@
 """
 Module for handling image processing operations like cropping and saving.
 """
-import os
 import base64
 from io import BytesIO
-from datetime import datetime
 import logging
-from PIL import Image
+from PIL import Image, ImageChops
 
-from config import CROPPED_SCREENSHOTS_DIR, TEMP_DIR
+from config import (
+    PREPROCESS_ENABLED, PREPROCESS_TRIM, PREPROCESS_MAX_LONG_EDGE, PREPROCESS_MAX_SHORT_EDGE,
+    PREPROCESS_COLOR_MODE, PREPROCESS_FORMAT, PREPROCESS_JPEG_QUALITY
+)
+from modules.blob_store import get_blob_store
+from modules.metrics import span, timed, observe_bytes
 
 logger = logging.getLogger(__name__)
 
-def save_cropped_image(base64_image):
+# Leading bytes of the formats the vision API accepts as-is
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+)
+
+class ImagePayload:
+    """
+    Decoded image bytes, kept together with the base64 text they came from
+
+    Holding on to the original base64 text lets the image be forwarded to the
+    API without encoding it a second time.
+
+    Args:
+        data (bytes): Encoded image data (bytes or memoryview)
+        mime_type (str): MIME type of the data
+        base64_data (str): Base64 text of the data, if already available
     """
-    Saves a base64-encoded image to the cropped screenshots directory
+
+    __slots__ = ('data', 'mime_type', '_base64_data')
+
+    def __init__(self, data, mime_type='image/png', base64_data=None):
+        self.data = data
+        self.mime_type = mime_type
+        self._base64_data = base64_data
+
+    @property
+    def base64_data(self):
+        """Base64 text of the image, encoded on first use if necessary"""
+        if self._base64_data is None:
+            self._base64_data = base64.b64encode(self.data).decode('ascii')
+        return self._base64_data
+
+    def to_data_url(self):
+        """Returns the image as a data URL"""
+        return f"data:{self.mime_type};base64,{self.base64_data}"
+
+def sniff_image_type(image_bytes):
+    """
+    Identifies PNG and JPEG data from its leading bytes
     
     Args:
-        base64_image (str): Base64-encoded image data
+        image_bytes (bytes): Encoded image data
         
     Returns:
-        tuple: (success, filename_or_error)
-            - If successful, returns (True, saved filename)
+        str: MIME type, or None if the data is neither PNG nor JPEG
+    """
+    header = bytes(image_bytes[:8])
+    for signature, mime_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return mime_type
+    return None
+
+def load_image_payload(image):
+    """
+    Wraps raw image data as an ImagePayload ready to send to the API
+    
+    Formats other than PNG and JPEG are re-encoded as PNG.
+    
+    Args:
+        image: ImagePayload, bytes, bytearray, memoryview or path to an image file
+        
+    Returns:
+        ImagePayload: The wrapped image
+    """
+    if isinstance(image, ImagePayload):
+        return image
+    
+    if isinstance(image, str):
+        with open(image, 'rb') as f:
+            image = f.read()
+    
+    mime_type = sniff_image_type(image)
+    if mime_type is None:
+        with Image.open(BytesIO(image)) as img:
+            output = BytesIO()
+            img.save(output, format='PNG')
+        return ImagePayload(output.getvalue(), 'image/png')
+    
+    return ImagePayload(image, mime_type)
+
+@timed('decode_image')
+def decode_image_data(base64_image):
+    """
+    Decodes a base64 image or data URL in memory
+    
+    Args:
+        base64_image (str): Base64-encoded image data, optionally with a data URL prefix
+        
+    Returns:
+        tuple: (success, payload_or_error)
+            - If successful, returns (True, ImagePayload)
             - If failed, returns (False, error message)
     """
     try:
@@ -30,85 +115,79 @@ def save_cropped_image(base64_image):
             base64_data = base64_image.split(',', 1)[1]
         else:
             base64_data = base64_image
-            
-        # Decode base64 data
-        image_bytes = base64.b64decode(base64_data)
         
-        # Generate filename with timestamp
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"{CROPPED_SCREENSHOTS_DIR}/cropped_{timestamp}.png"
+        image_bytes = base64.b64decode(base64_data)
+        observe_bytes('image', len(image_bytes))
         
-        # Save the image
-        with open(filename, 'wb') as f:
-            f.write(image_bytes)
-            
-        logger.info(f"Cropped image saved to {filename}")
+        # Valid PNG/JPEG keeps its original base64 text for the API request
+        mime_type = sniff_image_type(image_bytes)
+        if mime_type is not None:
+            return True, ImagePayload(image_bytes, mime_type, base64_data)
         
-        return True, filename
+        return True, load_image_payload(image_bytes)
         
     except Exception as e:
-        error_msg = f"Error saving cropped image: {str(e)}"
+        error_msg = f"Error decoding image data: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
 
-def create_temp_image(base64_image):
+def save_cropped_image(image):
     """
-    Creates a temporary image file from base64 data for processing
+    Saves an image to the cropped screenshots blob store
     
     Args:
-        base64_image (str): Base64-encoded image data
+        image: Base64-encoded image data, or an ImagePayload already in memory
+            (such as an upload loaded by its image_id)
         
     Returns:
         tuple: (success, filename_or_error)
-            - If successful, returns (True, temp filename)
+            - If successful, returns (True, saved filename)
             - If failed, returns (False, error message)
     """
     try:
-        # Extract the base64 data
-        if ',' in base64_image:
-            base64_data = base64_image.split(',', 1)[1]
+        if isinstance(image, ImagePayload):
+            payload = image
         else:
-            base64_data = base64_image
-            
-        # Decode base64 data
-        image_bytes = base64.b64decode(base64_data)
+            success, payload = decode_image_data(image)
+            if not success:
+                return False, payload
         
-        # Generate temporary filename
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        temp_filename = f"{TEMP_DIR}/temp_image_{timestamp}.png"
+        # Stored under its content hash; saving the same crop again reuses the file
+        with span('save_image', store='cropped', bytes=len(payload.data)):
+            filename = get_blob_store('cropped').put(payload.data, _extension(payload))
         
-        # Save the image
-        with open(temp_filename, 'wb') as f:
-            f.write(image_bytes)
-            
-        logger.info(f"Temporary image created at {temp_filename}")
+        logger.info(f"Cropped image saved to {filename}")
         
-        return True, temp_filename
+        return True, filename
         
     except Exception as e:
-        error_msg = f"Error creating temporary image: {str(e)}"
+        error_msg = f"Error saving cropped image: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
 
-def cleanup_temp_file(filename):
+def save_audit_image(payload):
     """
-    Removes a temporary file
+    Keeps a copy of an image sent for extraction when auditing is enabled
     
     Args:
-        filename (str): Path to the file to remove
+        payload (ImagePayload): Image sent for extraction
         
     Returns:
-        bool: True if successful, False otherwise
+        str: Saved filename, or None if auditing is disabled or the write failed
     """
     try:
-        if os.path.exists(filename):
-            os.remove(filename)
-            logger.info(f"Temporary file {filename} removed")
-            return True
-        return False
+        store = get_blob_store('audit')
+        if store is None:
+            return None
+        with span('save_image', store='audit', bytes=len(payload.data)):
+            return store.put(payload.data, _extension(payload))
+        
     except Exception as e:
-        logger.error(f"Error removing temporary file {filename}: {str(e)}")
-        return False
+        logger.error(f"Error saving audit image: {str(e)}")
+        return None
+
+def _extension(payload):
+    return 'jpg' if payload.mime_type == 'image/jpeg' else 'png'
 
 def get_image_dimensions(image_path):
     """
@@ -125,4 +204,135 @@ def get_image_dimensions(image_path):
             return img.size
     except Exception as e:
         logger.error(f"Error getting image dimensions: {str(e)}")
-        return None
\ No newline at end of file
+        return None
+
+@timed('preprocess')
+def preprocess_image(payload, trim=None, max_long_edge=None, max_short_edge=None,
+                     color_mode=None, output_format=None, jpeg_quality=None):
+    """
+    Shrinks an image before it is sent to the vision API
+    
+    Trims uniform borders, downscales to the resolution the model actually
+    looks at, reduces colour and re-encodes compactly. Options default to the
+    PREPROCESS_* configuration. The original image is returned unchanged if
+    preprocessing is disabled, fails, or would not make the payload smaller.
+    
+    Args:
+        payload (ImagePayload): Image to preprocess
+        trim (bool): Remove whitespace borders
+        max_long_edge (int): Maximum length of the longer side in pixels
+        max_short_edge (int): Maximum length of the shorter side in pixels
+        color_mode (str): 'grayscale', 'palette' or 'keep'
+        output_format (str): 'png' or 'jpeg'
+        jpeg_quality (int): JPEG quality (1-95)
+        
+    Returns:
+        tuple: (payload, stats)
+            - payload is the ImagePayload to send
+            - stats is a dict with byte counts, sizes and the steps applied
+    """
+    trim = PREPROCESS_TRIM if trim is None else trim
+    max_long_edge = max_long_edge or PREPROCESS_MAX_LONG_EDGE
+    max_short_edge = max_short_edge or PREPROCESS_MAX_SHORT_EDGE
+    color_mode = color_mode or PREPROCESS_COLOR_MODE
+    output_format = (output_format or PREPROCESS_FORMAT).lower()
+    jpeg_quality = jpeg_quality or PREPROCESS_JPEG_QUALITY
+    
+    original_bytes = len(payload.data)
+    stats = {
+        'original_bytes': original_bytes,
+        'processed_bytes': original_bytes,
+        'bytes_saved': 0,
+        'steps': []
+    }
+    
+    if not PREPROCESS_ENABLED:
+        return payload, stats
+    
+    try:
+        with Image.open(BytesIO(payload.data)) as img:
+            img.load()
+            stats['original_size'] = list(img.size)
+            
+            # Flatten transparency onto white so trimming and colour reduction behave
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                background = Image.new('RGB', img.size, 'white')
+                background.paste(img, mask=img.convert('RGBA').split()[-1])
+                img = background
+            elif img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            
+            if trim:
+                trimmed = _trim_borders(img)
+                if trimmed.size != img.size:
+                    img = trimmed
+                    stats['steps'].append('trim')
+            
+            target = _model_target_size(img.size, max_long_edge, max_short_edge)
+            if target != img.size:
+                img = img.resize(target, Image.LANCZOS)
+                stats['steps'].append('resize')
+            
+            if color_mode == 'grayscale' and img.mode != 'L':
+                img = img.convert('L')
+                stats['steps'].append('grayscale')
+            elif color_mode == 'palette' and img.mode == 'RGB':
+                img = img.quantize(colors=256)
+                stats['steps'].append('palette')
+            
+            output = BytesIO()
+            if output_format == 'jpeg':
+                if img.mode not in ('RGB', 'L'):
+                    img = img.convert('RGB')
+                img.save(output, format='JPEG', quality=jpeg_quality, optimize=True)
+                mime_type = 'image/jpeg'
+            else:
+                img.save(output, format='PNG', optimize=True)
+                mime_type = 'image/png'
+            stats['steps'].append(output_format)
+            processed_size = list(img.size)
+        
+        data = output.getvalue()
+        if len(data) >= original_bytes and 'trim' not in stats['steps'] and 'resize' not in stats['steps']:
+            # Re-encoding alone did not help; keep the original bytes
+            stats['steps'] = []
+            stats['processed_size'] = stats['original_size']
+            return payload, stats
+        
+        stats['processed_size'] = processed_size
+        stats['processed_bytes'] = len(data)
+        stats['bytes_saved'] = original_bytes - len(data)
+        logger.info(
+            f"Preprocessed image {stats['original_size']} -> {processed_size}, "
+            f"{original_bytes} -> {len(data)} bytes ({', '.join(stats['steps'])})"
+        )
+        return ImagePayload(data, mime_type), stats
+        
+    except Exception as e:
+        logger.error(f"Error preprocessing image: {str(e)}")
+        return payload, stats
+
+def _trim_borders(img, tolerance=16, margin=4):
+    """Crops away uniform borders matching the top-left pixel's colour"""
+    background = Image.new(img.mode, img.size, img.getpixel((0, 0)))
+    diff = ImageChops.difference(img, background)
+    if diff.mode != 'L':
+        diff = diff.convert('L')
+    bbox = diff.point(lambda value: 255 if value > tolerance else 0).getbbox()
+    if not bbox:
+        return img
+    left, top, right, bottom = bbox
+    return img.crop((
+        max(left - margin, 0),
+        max(top - margin, 0),
+        min(right + margin, img.width),
+        min(bottom + margin, img.height)
+    ))
+
+def _model_target_size(size, max_long_edge, max_short_edge):
+    """Returns the largest size, no bigger than the original, that fits both edge limits"""
+    width, height = size
+    scale = min(1.0, max_long_edge / max(width, height), max_short_edge / min(width, height))
+    if scale >= 1.0:
+        return size
+    return max(1, round(width * scale)), max(1, round(height * scale))
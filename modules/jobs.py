@@ -0,0 +1,290 @@
+"""
+Module for running slow operations (such as table extraction) in the background.
+
+Jobs are executed by a bounded worker pool so long API calls no longer tie up
+the web server's request threads. Callers poll for status and results by id.
+
+A job runs in the process that accepted it, but its status and result are
+also written to SQLite, so under a pre-fork server a poll answered by any
+other worker finds it too.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+
+from config import (
+    JOB_WORKERS, JOB_QUEUE_SIZE, JOB_RESULT_TTL, BATCH_JOB_WORKERS, BATCH_JOB_QUEUE_SIZE, JOBS_PATH
+)
+from modules.metrics import QUEUE_DEPTH
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+_manager = None
+_manager_lock = threading.Lock()
+
+class JobQueueFull(Exception):
+    """Raised when the job queue has no room for another job"""
+
+class JobManager:
+    """
+    Bounded pool of worker threads with per-job status and timing
+
+    Job functions follow the module convention of returning a
+    (success, result_or_error) tuple. Kinds listed in 'pools' run on their
+    own workers with their own queue limit, so long jobs such as batches
+    never hold the workers that serve single extractions.
+
+    Args:
+        workers (int): Number of jobs that may run at once
+        queue_size (int): Number of jobs that may wait for a worker
+        result_ttl (int): Seconds to keep finished jobs for polling
+        pools (dict): Job kind -> (workers, queue_size) for kinds with their own workers
+        path (str): SQLite database shared with other processes (None keeps jobs in memory only)
+    """
+
+    def __init__(self, workers=4, queue_size=32, result_ttl=3600, pools=None, path=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job-worker')
+        self._pools = {
+            kind: (ThreadPoolExecutor(max_workers=pool_workers, thread_name_prefix=f'{kind}-worker'),
+                   pool_workers, pool_queue_size)
+            for kind, (pool_workers, pool_queue_size) in (pools or {}).items()
+        }
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._conn = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, "
+                "kind TEXT NOT NULL, "
+                "status TEXT NOT NULL, "
+                "created_at REAL NOT NULL, "
+                "started_at REAL, "
+                "finished_at REAL, "
+                "result TEXT, "
+                "error TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_finished ON jobs (finished_at)")
+            self._conn.commit()
+        self._counters = {'submitted': 0, 'rejected': 0, 'succeeded': 0, 'failed': 0}
+
+    def submit(self, kind, func, *args, **kwargs):
+        """
+        Queues a job for execution
+
+        Args:
+            kind (str): Short label for the job type
+            func (callable): Function returning (success, result_or_error)
+            *args, **kwargs: Arguments passed to func
+
+        Returns:
+            str: The new job id
+
+        Raises:
+            JobQueueFull: If all workers are busy and the queue is full
+        """
+        executor, workers, queue_size = self._pools.get(kind, (self._executor, self.workers, self.queue_size))
+        with self._lock:
+            self._prune()
+            if self._active_count(kind) >= workers + queue_size:
+                self._counters['rejected'] += 1
+                raise JobQueueFull(f"Job queue is full ({workers} running, {queue_size} queued)")
+
+            job_id = uuid.uuid4().hex
+            self._jobs[job_id] = {
+                'id': job_id,
+                'kind': kind,
+                'status': 'queued',
+                'created_at': time.time(),
+                'started_at': None,
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            self._counters['submitted'] += 1
+            self._persist(self._jobs[job_id])
+        QUEUE_DEPTH.inc('jobs', 'queued')
+
+        # The job runs in a copy of the caller's context, keeping its request id for logs
+        executor.submit(contextvars.copy_context().run, self._run, job_id, func, args, kwargs)
+        logger.info(f"Queued {kind} job {job_id}")
+        return job_id
+
+    def get(self, job_id):
+        """
+        Returns a snapshot of a job's status, timing and outcome
+
+        Args:
+            job_id (str): Job id returned by submit()
+
+        Returns:
+            dict: Job details, or None if the job is unknown or expired
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            # Jobs accepted by another worker are only in the database
+            snapshot = dict(job) if job is not None else self._load(job_id)
+        if snapshot is None:
+            return None
+
+        now = time.time()
+        started = snapshot['started_at']
+        finished = snapshot['finished_at']
+        snapshot['queue_seconds'] = round((started or now) - snapshot['created_at'], 3)
+        snapshot['run_seconds'] = round((finished or now) - started, 3) if started else None
+        return snapshot
+
+    def stats(self):
+        """
+        Returns pool capacity, queue depth and job counters
+
+        'queued' and 'running' count the shared workers' jobs; 'pools' has
+        the same figures for each kind with its own workers.
+
+        Returns:
+            dict: Job manager statistics
+        """
+        with self._lock:
+            jobs = [(job['kind'], job['status']) for job in self._jobs.values()]
+            stats = dict(self._counters)
+        shared = [status for kind, status in jobs if kind not in self._pools]
+        stats['workers'] = self.workers
+        stats['queue_size'] = self.queue_size
+        stats['queued'] = shared.count('queued')
+        stats['running'] = shared.count('running')
+        stats['pools'] = {}
+        for kind, (_, workers, queue_size) in self._pools.items():
+            statuses = [status for job_kind, status in jobs if job_kind == kind]
+            stats['pools'][kind] = {
+                'workers': workers,
+                'queue_size': queue_size,
+                'queued': statuses.count('queued'),
+                'running': statuses.count('running')
+            }
+        return stats
+
+    def _run(self, job_id, func, args, kwargs):
+        with self._lock:
+            job = self._jobs[job_id]
+            job['status'] = 'running'
+            job['started_at'] = time.time()
+            self._persist(job)
+        QUEUE_DEPTH.dec('jobs', 'queued')
+        QUEUE_DEPTH.inc('jobs', 'running')
+
+        try:
+            success, result = func(*args, **kwargs)
+        except Exception as e:
+            logger.exception(f"Job {job_id} raised an exception")
+            success, result = False, str(e)
+
+        with self._lock:
+            job['finished_at'] = time.time()
+            if success:
+                job['status'] = 'succeeded'
+                job['result'] = result
+                self._counters['succeeded'] += 1
+            else:
+                job['status'] = 'failed'
+                job['error'] = result
+                self._counters['failed'] += 1
+            elapsed = job['finished_at'] - job['started_at']
+            self._persist(job)
+        QUEUE_DEPTH.dec('jobs', 'running')
+
+        logger.info(f"Job {job_id} {job['status']} in {elapsed:.2f}s")
+
+    def _active_count(self, kind):
+        """Counts unfinished jobs on the same workers as 'kind' (caller holds the lock)"""
+        pool = kind if kind in self._pools else None
+        return sum(
+            1 for job in self._jobs.values()
+            if job['status'] in ('queued', 'running')
+            and (job['kind'] if job['kind'] in self._pools else None) == pool
+        )
+
+    def _prune(self):
+        """Forgets finished jobs older than the result TTL"""
+        cutoff = time.time() - self.result_ttl
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job['finished_at'] is not None and job['finished_at'] < cutoff
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+        if self._conn:
+            self._conn.execute("DELETE FROM jobs WHERE finished_at < ?", (cutoff,))
+            self._conn.commit()
+
+    def _persist(self, job):
+        """Writes a job's current state for other processes (caller holds the lock)"""
+        if not self._conn:
+            return
+        try:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, kind, status, created_at, started_at, finished_at, result, error) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job['id'], job['kind'], job['status'], job['created_at'], job['started_at'],
+                 job['finished_at'], json.dumps(job['result'], ensure_ascii=False, default=str),
+                 None if job['error'] is None else str(job['error']))
+            )
+            self._conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"Error saving job {job['id']}: {str(e)}")
+
+    def _load(self, job_id):
+        """Reads a job written by any process (caller holds the lock)"""
+        if not self._conn:
+            return None
+        row = self._conn.execute(
+            "SELECT id, kind, status, created_at, started_at, finished_at, result, error FROM jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if row is None or (row[5] is not None and row[5] < time.time() - self.result_ttl):
+            return None
+        job = dict(zip(('id', 'kind', 'status', 'created_at', 'started_at', 'finished_at', 'result', 'error'), row))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+def get_job_manager():
+    """
+    Returns the shared job manager, creating it on first use
+
+    Returns:
+        JobManager: The job manager
+    """
+    global _manager
+
+    if _manager is None:
+        with _manager_lock:
+            if _manager is None:
+                _manager = JobManager(
+                    workers=JOB_WORKERS,
+                    queue_size=JOB_QUEUE_SIZE,
+                    result_ttl=JOB_RESULT_TTL,
+                    pools={'extract-batch': (BATCH_JOB_WORKERS, BATCH_JOB_QUEUE_SIZE)},
+                    path=JOBS_PATH
+                )
+    return _manager
+
+@reset_after_fork
+def _reset_manager():
+    """Forgets the manager in a forked worker; the parent's worker threads are not copied"""
+    global _manager, _manager_lock
+    _manager = None
+    _manager_lock = threading.Lock()
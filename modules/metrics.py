@@ -0,0 +1,365 @@
+"""
+Module for lightweight stage timings and Prometheus-style metrics.
+
+span() times one stage of a request (decoding, disk I/O, re-encoding, the API
+call, parsing, validation...) into the stage_duration_seconds histogram and,
+when METRICS_JSON_LOGS is on, writes it as a JSON line carrying the request
+id. Counters, gauges and histograms live in memory and render() returns them
+in the Prometheus text format for /metrics.
+
+With METRICS_ENABLED off, span() returns a shared no-op, timed() leaves
+functions undecorated and every observation returns immediately.
+"""
+import json
+import time
+import bisect
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+from functools import wraps
+
+from config import METRICS_ENABLED, METRICS_JSON_LOGS, METRICS_JSON_LOG_PATH
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in seconds
+DURATION_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Upper bounds of the size buckets, in bytes
+BYTES_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# Upper bounds of the token count buckets
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+# Id of the request being handled in the current context (see set_request_id)
+_request_id = contextvars.ContextVar('request_id', default=None)
+
+_registry = []
+_registry_lock = threading.Lock()
+
+class _Metric:
+    """Base for metrics with a fixed set of label names"""
+
+    type = None
+
+    def __init__(self, name, description, labels=()):
+        self.name = name
+        self.description = description
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        with _registry_lock:
+            _registry.append(self)
+
+    def _label_text(self, values, extra=None):
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape_label(value)}"' for name, value in pairs) + '}'
+
+    def render(self):
+        """Returns the metric's lines in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for values, value in items:
+            lines.extend(self._render_value(values, value))
+        return lines
+
+    def _render_value(self, values, value):
+        return [f"{self.name}{self._label_text(values)} {_number(value)}"]
+
+class Counter(_Metric):
+    """
+    Monotonically increasing count
+
+    Args:
+        name (str): Metric name
+        description (str): Help text
+        labels (tuple): Label names; inc() takes their values in order
+    """
+
+    type = 'counter'
+
+    def inc(self, *values, amount=1):
+        """Adds amount to the count for these label values"""
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down, such as a queue depth
+
+    Args:
+        name (str): Metric name
+        description (str): Help text
+        labels (tuple): Label names; set(), inc() and dec() take their values in order
+    """
+
+    type = 'gauge'
+
+    def set(self, value, *values):
+        """Sets the value for these label values"""
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[values] = value
+
+    def inc(self, *values, amount=1):
+        """Raises the value for these label values"""
+        if not METRICS_ENABLED:
+            return
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def dec(self, *values, amount=1):
+        """Lowers the value for these label values"""
+        self.inc(*values, amount=-amount)
+
+class Histogram(_Metric):
+    """
+    Distribution of observed values in cumulative buckets
+
+    Args:
+        name (str): Metric name
+        description (str): Help text
+        labels (tuple): Label names; observe() takes their values after the value
+        buckets (tuple): Sorted upper bounds of the buckets (+Inf is implied)
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name, description, labels=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, description, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *values):
+        """Records one observation for these label values"""
+        if not METRICS_ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(values)
+            if state is None:
+                # Per-bucket counts (the last one is +Inf), then the sum and the count
+                state = self._values[values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = {values: [list(state[0]), state[1], state[2]] for values, state in self._values.items()}
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {self.type}"]
+        for values, (counts, total, count) in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                label = self._label_text(values, ('le', bound if bound == '+Inf' else _number(bound)))
+                lines.append(f"{self.name}_bucket{label} {cumulative}")
+            lines.append(f"{self.name}_sum{self._label_text(values)} {_number(total)}")
+            lines.append(f"{self.name}_count{self._label_text(values)} {count}")
+        return lines
+
+# Metrics recorded across the application
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time to answer HTTP requests (to the first byte for streams)',
+    ('method', 'endpoint', 'status')
+)
+STAGE_SECONDS = Histogram('stage_duration_seconds', 'Time spent in each processing stage', ('stage',))
+STAGE_ERRORS = Counter('stage_errors_total', 'Processing stages that raised an exception', ('stage',))
+PAYLOAD_BYTES = Histogram(
+    'payload_bytes', 'Size of request and response bodies, images and captures', ('kind',), BYTES_BUCKETS
+)
+API_TOKENS = Histogram('openai_tokens', 'Tokens reported per OpenAI API response', ('kind',), TOKEN_BUCKETS)
+CACHE_LOOKUPS = Counter(
+    'extraction_cache_lookups_total', 'Extraction cache lookups by outcome (hit, near_hit, miss, bypass)',
+    ('result',)
+)
+QUEUE_DEPTH = Gauge('queue_depth', 'Work waiting for or holding a worker, by queue and state', ('queue', 'state'))
+
+class _Span:
+    """Times a block into STAGE_SECONDS and, if enabled, the JSON span log"""
+
+    __slots__ = ('name', 'fields', 'started')
+
+    def __init__(self, name, fields):
+        self.name = name
+        self.fields = fields
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.perf_counter() - self.started
+        STAGE_SECONDS.observe(seconds, self.name)
+        # A generator closed early by its consumer has not failed
+        failed = exc_type is not None and not issubclass(exc_type, GeneratorExit)
+        if failed:
+            STAGE_ERRORS.inc(self.name)
+        if _span_logger is not None:
+            log_event(self.name, seconds, 'error' if failed else 'ok', **self.fields)
+        return False
+
+    def set(self, **fields):
+        """Adds fields to the span's JSON log line"""
+        self.fields.update(fields)
+
+class _NoopSpan:
+    """Stands in for _Span when metrics are disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+    def set(self, **fields):
+        pass
+
+_NOOP_SPAN = _NoopSpan()
+
+def span(name, **fields):
+    """
+    Times a stage
+
+    Use as `with span('decode_image'):`. Time spent by the caller between
+    iterations is included when the block spans a generator's yields.
+
+    Args:
+        name (str): Stage name, used as the stage label
+        **fields: Extra fields for the JSON span log line
+
+    Returns:
+        A context manager; its set(**fields) adds fields to the log line
+    """
+    if not METRICS_ENABLED:
+        return _NOOP_SPAN
+    return _Span(name, fields)
+
+def timed(name):
+    """
+    Decorator timing every call of a function as a stage
+
+    The function is returned unchanged when metrics are disabled. Not for
+    generator functions, whose body runs after the call returns.
+
+    Args:
+        name (str): Stage name
+    """
+    def decorate(func):
+        if not METRICS_ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with _Span(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def observe_bytes(kind, size):
+    """Records the size of a payload of the given kind"""
+    if size is not None:
+        PAYLOAD_BYTES.observe(size, kind)
+
+def set_request_id(request_id):
+    """
+    Sets the request id reported with spans in the current context
+
+    Returns:
+        Token to pass to reset_request_id()
+    """
+    return _request_id.set(request_id)
+
+def reset_request_id(token):
+    """Restores the request id that was current before set_request_id()"""
+    try:
+        _request_id.reset(token)
+    except ValueError:
+        # The token was created in another context (e.g. a stream finished elsewhere)
+        pass
+
+def current_request_id():
+    """Returns the current request id, or None outside a request"""
+    return _request_id.get()
+
+def log_event(name, seconds, status='ok', **fields):
+    """
+    Writes one JSON line to the span log, if METRICS_JSON_LOGS is on
+
+    Args:
+        name (str): Span or event name
+        seconds (float): Duration
+        status (str): 'ok' or 'error'
+        **fields: Extra fields for the line
+    """
+    if _span_logger is None:
+        return
+    record = {
+        'time': datetime.now(timezone.utc).isoformat(timespec='milliseconds'),
+        'request_id': _request_id.get(),
+        'span': name,
+        'seconds': round(seconds, 6),
+        'status': status
+    }
+    record.update(fields)
+    _span_logger.info(json.dumps(record, default=str))
+
+def render():
+    """
+    Returns every metric in the Prometheus text exposition format
+
+    Returns:
+        str: Metrics text, ending with a newline
+    """
+    with _registry_lock:
+        metrics = list(_registry)
+    lines = []
+    for metric in metrics:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+@reset_after_fork
+def _reset_locks():
+    """
+    Replaces the metric locks in a forked worker
+
+    A lock held by another thread of the parent at the fork would never be
+    released in the child. The values recorded so far are kept.
+    """
+    global _registry_lock
+    _registry_lock = threading.Lock()
+    for metric in _registry:
+        metric._lock = threading.Lock()
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _create_span_logger():
+    """Returns a logger writing bare JSON lines to METRICS_JSON_LOG_PATH, or None if disabled"""
+    if not (METRICS_ENABLED and METRICS_JSON_LOGS):
+        return None
+    span_logger = logging.getLogger('screenshot_to_table.spans')
+    span_logger.setLevel(logging.INFO)
+    span_logger.propagate = False
+    # The file is opened by the first span written, not on import
+    handler = logging.FileHandler(METRICS_JSON_LOG_PATH, delay=True)
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    span_logger.addHandler(handler)
+    return span_logger
+
+_span_logger = _create_span_logger()
@@ -0,0 +1,460 @@
+"""
+Module for answering extractions of near-duplicate images from earlier results.
+
+Hand-drawn crops of the same table never match byte for byte, so previously
+extracted images are indexed by a 256-bit perceptual hash (dHash). Lookups use
+multi-index hashing: the hash is split into sixteen 16-bit chunks, and by the
+pigeonhole principle any hash within distance t of the query is within
+t // 16 bits of it in at least one chunk. Probing those few neighbouring
+buckets and comparing only their members keeps the hash search to about a
+tenth of a millisecond at the default 2000 entries (around 1.5 ms at 100k).
+A lookup's cost is dominated by the content check below, which takes tens of
+milliseconds per candidate, so the index is kept small.
+
+A close hash only means a similar layout: two tables with the same grid and
+different numbers hash almost alike. A candidate is therefore only served
+after a content check. The two grayscale images are aligned over the small
+offset a hand-drawn crop can differ by, and may then differ in no more than
+NEAR_DUPLICATE_MAX_CHANGED_PIXELS pixels. Matches are never written to the
+exact extraction cache, and the index keeps at most NEAR_DUPLICATE_MAX_ENTRIES
+images.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from io import BytesIO
+
+from PIL import Image, ImageChops, ImageStat
+
+from config import (
+    NEAR_DUPLICATE_ENABLED, NEAR_DUPLICATE_INDEX_PATH, NEAR_DUPLICATE_THRESHOLD,
+    NEAR_DUPLICATE_MAX_ASPECT_DIFF, NEAR_DUPLICATE_MAX_SHIFT, NEAR_DUPLICATE_MAX_CHANGED_PIXELS,
+    NEAR_DUPLICATE_MAX_ENTRIES
+)
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Rows and columns of the dHash grid; the hash has HASH_SIZE ** 2 bits
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+# Grayscale difference above which a pixel counts as changed (ignores re-encoding noise)
+PIXEL_TOLERANCE = 64
+
+# Closest hash candidates given the content check per lookup
+MAX_CANDIDATES = 5
+
+# Downscale factor of the coarse alignment pass
+COARSE_FACTOR = 4
+
+# Maps a difference image to 255 where a pixel changed and 0 elsewhere
+_CHANGED_LUT = [255 if value > PIXEL_TOLERANCE else 0 for value in range(256)]
+
+_index = None
+_index_lock = threading.Lock()
+
+def hamming_distance(a, b):
+    """Returns the number of differing bits between two hashes"""
+    return bin(a ^ b).count('1')
+
+class Fingerprint:
+    """
+    What the index knows about one image
+
+    Args:
+        image_hash (int): HASH_BITS-bit dHash
+        width (int): Image width
+        height (int): Image height
+        gray (Image): Grayscale copy of the image, for the content check
+    """
+
+    __slots__ = ('image_hash', 'width', 'height', 'gray')
+
+    def __init__(self, image_hash, width, height, gray):
+        self.image_hash = image_hash
+        self.width = width
+        self.height = height
+        self.gray = gray
+
+    @property
+    def aspect(self):
+        return self.width / self.height if self.height else 0.0
+
+def fingerprint_image(image_bytes):
+    """
+    Decodes an image once for both the hash and the content check
+
+    The dHash reduces the image to a (HASH_SIZE + 1) x HASH_SIZE grayscale
+    thumbnail, and each bit records whether a pixel is brighter than its
+    right neighbour, so small shifts and re-encoding barely change it.
+
+    Args:
+        image_bytes (bytes): Encoded image data
+
+    Returns:
+        Fingerprint: The image's fingerprint, or None if it could not be decoded
+    """
+    try:
+        with Image.open(BytesIO(image_bytes)) as img:
+            gray = img.convert('L')
+        small = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+        pixels = small.tobytes()
+
+        value = 0
+        for row in range(HASH_SIZE):
+            offset = row * (HASH_SIZE + 1)
+            for col in range(HASH_SIZE):
+                value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+
+        return Fingerprint(value, gray.width, gray.height, gray)
+    except Exception as e:
+        logger.error(f"Error computing image hash: {str(e)}")
+        return None
+
+def same_content(a, b, max_shift=8, max_changed=0):
+    """
+    Checks whether two grayscale images show the same content, up to a small offset
+
+    The best offset is first searched at 1/COARSE_FACTOR scale, then refined
+    at full resolution, where the overlapping pixels are compared.
+
+    Args:
+        a (Image): First grayscale image
+        b (Image): Second grayscale image
+        max_shift (int): Largest offset in pixels, along each axis, between the two
+        max_changed (int): Pixels that may differ by more than PIXEL_TOLERANCE
+
+    Returns:
+        bool: True if the images match at some offset within max_shift
+    """
+    # Crops of the same table differ only by the offset at their edges
+    if abs(a.width - b.width) > 2 * max_shift or abs(a.height - b.height) > 2 * max_shift:
+        return False
+
+    coarse_a, coarse_b = a.reduce(COARSE_FACTOR), b.reduce(COARSE_FACTOR)
+    coarse_shift = max_shift // COARSE_FACTOR + 1
+    best = None
+    for dy in range(-coarse_shift, coarse_shift + 1):
+        for dx in range(-coarse_shift, coarse_shift + 1):
+            difference = _overlap_difference(coarse_a, coarse_b, dx, dy, max_shift // COARSE_FACTOR + 1)
+            if difference is None:
+                continue
+            mean = ImageStat.Stat(difference).mean[0]
+            if best is None or mean < best[0]:
+                best = (mean, dx, dy)
+    center_x, center_y = (best[1] * COARSE_FACTOR, best[2] * COARSE_FACTOR) if best else (0, 0)
+
+    window = COARSE_FACTOR // 2
+    for dy in range(max(-max_shift, center_y - window), min(max_shift, center_y + window) + 1):
+        for dx in range(max(-max_shift, center_x - window), min(max_shift, center_x + window) + 1):
+            difference = _overlap_difference(a, b, dx, dy, max_shift)
+            if difference is not None and difference.point(_CHANGED_LUT).histogram()[255] <= max_changed:
+                return True
+    return False
+
+def _overlap_difference(a, b, dx, dy, max_shift):
+    """
+    Returns the absolute difference of a and of b moved by (dx, dy), where they overlap
+
+    Returns None if either image has more than 2 * max_shift pixels outside
+    the overlap along an axis.
+    """
+    left, top = max(0, dx), max(0, dy)
+    right, bottom = min(a.width, b.width + dx), min(a.height, b.height + dy)
+    width, height = right - left, bottom - top
+    if width <= 0 or height <= 0 or max(a.width, b.width) - width > 2 * max_shift \
+            or max(a.height, b.height) - height > 2 * max_shift:
+        return None
+    return ImageChops.difference(
+        a.crop((left, top, right, bottom)),
+        b.crop((left - dx, top - dy, right - dx, bottom - dy))
+    )
+
+class MultiIndexHash:
+    """
+    In-memory Hamming-space index over fixed-width integer hashes
+
+    Args:
+        threshold (int): Maximum Hamming distance that counts as a match
+        bits (int): Width of the indexed hashes
+        chunk_bits (int): Width of each sub-hash table key
+    """
+
+    def __init__(self, threshold, bits=HASH_BITS, chunk_bits=16):
+        self.threshold = threshold
+        self.bits = bits
+        self._chunks = [
+            (shift, (1 << min(chunk_bits, bits - shift)) - 1)
+            for shift in range(0, bits, chunk_bits)
+        ]
+        # Every match lies within this many bits of the query in at least one chunk
+        radius = threshold // len(self._chunks)
+        self._probes = [
+            _flip_masks(min(chunk_bits, bits - shift), radius)
+            for shift, _ in self._chunks
+        ]
+        self._tables = [{} for _ in self._chunks]
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, value, item):
+        """
+        Adds a hash to the index
+
+        Args:
+            value (int): Hash value
+            item: Payload returned by lookups
+        """
+        entry = (value, item)
+        for table, (shift, mask) in zip(self._tables, self._chunks):
+            table.setdefault((value >> shift) & mask, []).append(entry)
+        self._size += 1
+
+    def search(self, value):
+        """
+        Finds indexed hashes within the threshold, closest first
+
+        Args:
+            value (int): Hash to look up
+
+        Returns:
+            list: (distance, item) tuples sorted by distance
+        """
+        seen = set()
+        matches = []
+        for table, (shift, mask), probes in zip(self._tables, self._chunks, self._probes):
+            key = (value >> shift) & mask
+            for flip in probes:
+                for candidate, item in table.get(key ^ flip, ()):
+                    marker = id(item)
+                    if marker in seen:
+                        continue
+                    seen.add(marker)
+                    distance = hamming_distance(value, candidate)
+                    if distance <= self.threshold:
+                        matches.append((distance, item))
+        matches.sort(key=lambda match: match[0])
+        return matches
+
+def _flip_masks(width, radius):
+    """Returns every mask of `width` bits with at most `radius` bits set"""
+    masks = [0]
+    frontier = [(0, 0)]
+    for _ in range(radius):
+        next_frontier = []
+        for mask, lowest in frontier:
+            for bit in range(lowest, width):
+                flipped = mask | (1 << bit)
+                masks.append(flipped)
+                next_frontier.append((flipped, bit + 1))
+        frontier = next_frontier
+    return masks
+
+class NearDuplicateIndex:
+    """
+    Persistent perceptual-hash index of extraction results
+
+    Entries are stored in SQLite and loaded into one MultiIndexHash per
+    request namespace (model, prompt and token limit) on first use. Only the
+    row id is kept in memory; the grayscale image and the result are read
+    back from disk for the closest candidates. Once the index holds more than
+    max_entries images, the oldest tenth is deleted.
+
+    Args:
+        path (str): SQLite database file
+        threshold (int): Maximum Hamming distance between candidate hashes
+        max_aspect_diff (float): Largest relative difference of aspect ratios
+        max_shift (int): Largest offset in pixels between two crops of the same table
+        max_changed (int): Pixels that may differ once two crops are aligned
+        max_entries (int): Images kept before the oldest are deleted
+    """
+
+    def __init__(self, path, threshold=16, max_aspect_diff=0.1, max_shift=8, max_changed=0,
+                 max_entries=2000):
+        self.path = path
+        self.threshold = threshold
+        self.max_aspect_diff = max_aspect_diff
+        self.max_shift = max_shift
+        self.max_changed = max_changed
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._namespaces = {}
+        self._counters = {'hits': 0, 'misses': 0, 'rejected': 0, 'evicted': 0}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(near_duplicates)")]
+        if columns and 'pixels' not in columns:
+            # Entries from before the content check have 64-bit hashes and no pixels to compare
+            self._conn.execute("DROP TABLE near_duplicates")
+            logger.info("Dropped near-duplicate entries without pixels for the content check")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS near_duplicates ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "namespace TEXT NOT NULL, "
+            "hash TEXT NOT NULL, "
+            "width INTEGER NOT NULL, "
+            "height INTEGER NOT NULL, "
+            "pixels BLOB NOT NULL, "
+            "value TEXT NOT NULL, "
+            "created_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM near_duplicates").fetchone()[0]
+
+    def lookup(self, namespace, fingerprint):
+        """
+        Returns the stored result of an earlier image with the same content
+
+        Args:
+            namespace (str): Request fingerprint the result must share
+            fingerprint (Fingerprint): The new image, from fingerprint_image()
+
+        Returns:
+            tuple: (table_data, distance), or None if no earlier image matches
+        """
+        with self._lock:
+            index = self._load_namespace(namespace)
+            candidates = []
+            for distance, (row_id, entry_aspect) in index.search(fingerprint.image_hash):
+                # Tables with a similar gist but a different shape are different crops
+                if entry_aspect and abs(fingerprint.aspect - entry_aspect) / entry_aspect > self.max_aspect_diff:
+                    continue
+                candidates.append((distance, row_id))
+                if len(candidates) == MAX_CANDIDATES:
+                    break
+            rows = [
+                (distance, self._conn.execute(
+                    "SELECT pixels, value FROM near_duplicates WHERE id = ?", (row_id,)
+                ).fetchone())
+                for distance, row_id in candidates
+            ]
+
+        # The content check decodes and compares images, so it runs outside the lock
+        for distance, row in rows:
+            if row is None:
+                continue
+            with Image.open(BytesIO(row[0])) as stored:
+                stored.load()
+                matched = same_content(fingerprint.gray, stored, self.max_shift, self.max_changed)
+            if matched:
+                with self._lock:
+                    self._counters['hits'] += 1
+                return json.loads(row[1]), distance
+            with self._lock:
+                self._counters['rejected'] += 1
+
+        with self._lock:
+            self._counters['misses'] += 1
+        return None
+
+    def add(self, namespace, fingerprint, table_data):
+        """
+        Records an extraction result under the image's fingerprint
+
+        Args:
+            namespace (str): Request fingerprint of the extraction
+            fingerprint (Fingerprint): The extracted image, from fingerprint_image()
+            table_data (dict): Validated table data
+        """
+        pixels = BytesIO()
+        fingerprint.gray.save(pixels, format='PNG', compress_level=1)
+        with self._lock:
+            index = self._load_namespace(namespace)
+            cursor = self._conn.execute(
+                "INSERT INTO near_duplicates (namespace, hash, width, height, pixels, value, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (namespace, format(fingerprint.image_hash, f'0{HASH_BITS // 4}x'), fingerprint.width,
+                 fingerprint.height, pixels.getvalue(), json.dumps(table_data), time.time())
+            )
+            self._conn.commit()
+            index.add(fingerprint.image_hash, (cursor.lastrowid, fingerprint.aspect))
+            self._count += 1
+            if self._count > self.max_entries:
+                self._evict()
+
+    def stats(self):
+        """
+        Returns lookup counters and index size
+
+        Returns:
+            dict: Index statistics
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats['entries'] = self._count
+            stats['max_entries'] = self.max_entries
+        return stats
+
+    def _evict(self):
+        """Deletes the oldest entries down to 90% of max_entries (callers hold the lock)"""
+        excess = self._count - int(self.max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM near_duplicates WHERE id IN (SELECT id FROM near_duplicates ORDER BY id LIMIT ?)",
+            (excess,)
+        )
+        self._conn.commit()
+        self._count -= excess
+        self._counters['evicted'] += excess
+        # Hash tables have no removal; they are rebuilt from the remaining rows on next use
+        self._namespaces = {}
+        logger.info(f"Evicted {excess} near-duplicate entries")
+
+    def _load_namespace(self, namespace):
+        index = self._namespaces.get(namespace)
+        if index is None:
+            index = MultiIndexHash(self.threshold)
+            rows = self._conn.execute(
+                "SELECT id, hash, width, height FROM near_duplicates WHERE namespace = ?",
+                (namespace,)
+            )
+            for row_id, image_hash, width, height in rows:
+                index.add(int(image_hash, 16), (row_id, width / height if height else 0.0))
+            self._namespaces[namespace] = index
+            logger.info(f"Loaded {len(index)} entries into near-duplicate index")
+        return index
+
+def get_near_duplicate_index():
+    """
+    Returns the shared near-duplicate index, creating it on first use
+
+    Returns:
+        NearDuplicateIndex: The index, or None if disabled or unavailable
+    """
+    global _index
+
+    if not NEAR_DUPLICATE_ENABLED:
+        return None
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                try:
+                    _index = NearDuplicateIndex(
+                        NEAR_DUPLICATE_INDEX_PATH,
+                        threshold=NEAR_DUPLICATE_THRESHOLD,
+                        max_aspect_diff=NEAR_DUPLICATE_MAX_ASPECT_DIFF,
+                        max_shift=NEAR_DUPLICATE_MAX_SHIFT,
+                        max_changed=NEAR_DUPLICATE_MAX_CHANGED_PIXELS,
+                        max_entries=NEAR_DUPLICATE_MAX_ENTRIES
+                    )
+                except Exception as e:
+                    logger.error(f"Error opening near-duplicate index: {str(e)}")
+                    return None
+    return _index
+
+@reset_after_fork
+def _reset_index():
+    """Forgets the index in a forked worker; it is reloaded from disk on first use"""
+    global _index, _index_lock
+    _index = None
+    _index_lock = threading.Lock()
@@ -0,0 +1,658 @@
+"""
+Module providing a shared, rate-limit-aware OpenAI client.
+
+All API calls go through one client so they share a connection pool, a
+token-bucket limiter for requests and tokens per minute, a cap on concurrent
+in-flight requests, retries with jittered exponential backoff that honour
+Retry-After, and a circuit breaker that fails fast while the API is down.
+
+The token buckets live in SQLite (OPENAI_LIMITS_PATH), so the per-minute
+limits are shared by every worker process; the concurrency cap and the
+circuit breaker apply to each process on its own.
+"""
+import os
+import time
+import sqlite3
+import random
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+
+from config import (
+    OPENAI_API_KEY, OPENAI_BASE_URL, OPENAI_TIMEOUT, OPENAI_POOL_CONNECTIONS,
+    OPENAI_MAX_CONCURRENCY, OPENAI_REQUESTS_PER_MINUTE, OPENAI_TOKENS_PER_MINUTE,
+    OPENAI_MAX_RETRIES, OPENAI_BACKOFF_BASE, OPENAI_BACKOFF_MAX,
+    OPENAI_CIRCUIT_FAILURE_THRESHOLD, OPENAI_CIRCUIT_RESET_SECONDS, OPENAI_LIMITS_PATH
+)
+from modules.metrics import API_TOKENS, QUEUE_DEPTH
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# HTTP statuses worth retrying (timeouts, conflicts, rate limits and server errors)
+RETRYABLE_STATUS_CODES = (408, 409, 429, 500, 502, 503, 504)
+RETRYABLE_ERROR_NAMES = ('APIConnectionError', 'APITimeoutError', 'Timeout', 'ServiceUnavailableError')
+
+_client = None
+_client_lock = threading.Lock()
+
+# Usage totals of the extraction running in the current context (see track_usage)
+_usage = contextvars.ContextVar('extraction_usage', default=None)
+_usage_lock = threading.Lock()
+
+class CircuitOpenError(Exception):
+    """Raised when the circuit breaker is rejecting calls"""
+
+class TokenBucket:
+    """
+    Thread-safe token bucket refilled continuously at a per-minute rate
+
+    Args:
+        rate_per_minute (float): Tokens added per minute
+        capacity (float): Maximum burst size (defaults to one minute's worth)
+    """
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount=1):
+        """
+        Takes tokens from the bucket, blocking until enough are available
+
+        Args:
+            amount (float): Tokens to take (capped at the bucket capacity)
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return waited
+                delay = (amount - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+    def refund(self, amount):
+        """Returns unused tokens to the bucket"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self.capacity, self._tokens + amount)
+
+    def pause(self, seconds):
+        """Empties the bucket so no tokens are available for the given time"""
+        with self._lock:
+            self._refill()
+            self._tokens = min(self._tokens, -self.rate * seconds)
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+class SharedTokenBucket:
+    """
+    Token bucket kept in SQLite so every process using the file draws from it
+
+    Each acquire, refund or pause is one IMMEDIATE transaction, which SQLite
+    serialises across processes. Refills use wall-clock time, as monotonic
+    clocks are not comparable between processes.
+
+    Args:
+        path (str): SQLite database file
+        name (str): Bucket name (one row per bucket)
+        rate_per_minute (float): Tokens added per minute
+        capacity (float): Maximum burst size (defaults to one minute's worth)
+    """
+
+    def __init__(self, path, name, rate_per_minute, capacity=None):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            "name TEXT PRIMARY KEY, "
+            "tokens REAL NOT NULL, "
+            "updated REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)",
+            (name, self.capacity, time.time())
+        )
+
+    def acquire(self, amount=1):
+        """
+        Takes tokens from the bucket, blocking until enough are available
+
+        Args:
+            amount (float): Tokens to take (capped at the bucket capacity)
+
+        Returns:
+            float: Seconds spent waiting
+        """
+        amount = min(amount, self.capacity)
+        waited = 0.0
+        while True:
+            delay = self._update(lambda tokens: (tokens - amount, 0.0) if tokens >= amount
+                                 else (tokens, (amount - tokens) / self.rate))
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def refund(self, amount):
+        """Returns unused tokens to the bucket"""
+        self._update(lambda tokens: (min(self.capacity, tokens + amount), None))
+
+    def pause(self, seconds):
+        """Empties the bucket so no tokens are available for the given time"""
+        self._update(lambda tokens: (min(tokens, -self.rate * seconds), None))
+
+    def _update(self, change):
+        """Refills the bucket, applies change(tokens) -> (tokens, result) and returns result"""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT tokens, updated FROM token_buckets WHERE name = ?", (self.name,)
+                ).fetchone()
+                now = time.time()
+                tokens = self.capacity
+                if row:
+                    tokens = min(self.capacity, row[0] + max(0.0, now - row[1]) * self.rate)
+                tokens, result = change(tokens)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO token_buckets (name, tokens, updated) VALUES (?, ?, ?)",
+                    (self.name, tokens, now)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            return result
+
+class CircuitBreaker:
+    """
+    Stops calling a failing service until it has had time to recover
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    are rejected. Once `reset_seconds` have passed, one trial call is let
+    through; its success closes the circuit and its failure re-opens it.
+
+    Args:
+        failure_threshold (int): Consecutive failures that open the circuit
+        reset_seconds (float): Time to wait before a trial call
+    """
+
+    def __init__(self, failure_threshold=5, reset_seconds=30):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = 'closed'
+        self.opens = 0
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a call may be made now"""
+        with self._lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = 'closed'
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == 'half_open' or self._failures >= self.failure_threshold:
+                if self.state != 'open':
+                    self.opens += 1
+                    logger.warning(f"OpenAI circuit breaker opened after {self._failures} failures")
+                self.state = 'open'
+                self._opened_at = time.monotonic()
+
+class RateLimitedClient:
+    """
+    Wraps an OpenAI client (modern or legacy module) with rate limiting and retries
+
+    Args:
+        client: Modern OpenAI client instance, or None
+        legacy_module: Legacy openai module, used only when client is None
+        requests_per_minute (int): Request rate limit (0 disables it)
+        tokens_per_minute (int): Token rate limit (0 disables it)
+        max_concurrency (int): Maximum requests in flight
+        max_retries (int): Retries after the first attempt
+        backoff_base (float): First backoff delay in seconds
+        backoff_max (float): Longest backoff delay in seconds
+        breaker (CircuitBreaker): Circuit breaker guarding the API
+        limits_path (str): SQLite file sharing the rate limits between processes
+            (None keeps them in this process)
+    """
+
+    def __init__(self, client=None, legacy_module=None, requests_per_minute=0, tokens_per_minute=0,
+                 max_concurrency=4, max_retries=4, backoff_base=1.0, backoff_max=60.0, breaker=None,
+                 limits_path=None):
+        self.client = client
+        self.legacy_module = legacy_module
+        self.request_bucket = _make_bucket(limits_path, 'requests', requests_per_minute)
+        self.token_bucket = _make_bucket(limits_path, 'tokens', tokens_per_minute)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker = breaker or CircuitBreaker()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        self._metrics = {
+            'requests': 0,
+            'succeeded': 0,
+            'failed': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'circuit_rejections': 0,
+            'in_flight': 0,
+            'rate_limit_wait_seconds': 0.0,
+            'concurrency_wait_seconds': 0.0,
+            'backoff_seconds': 0.0,
+            'prompt_tokens': 0,
+            'completion_tokens': 0,
+        }
+
+    def chat_completion(self, estimated_tokens=0, **kwargs):
+        """
+        Creates a chat completion, waiting for rate limits and retrying transient errors
+
+        Args:
+            estimated_tokens (int): Expected total tokens, charged against the token limit
+            **kwargs: Arguments for the chat completions API
+
+        Returns:
+            The API response (an object for the modern client, a dict for the legacy module)
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open
+            Exception: The last API error once retries are exhausted
+        """
+        response = self._request(kwargs, estimated_tokens, stream=False)
+        _track_request(kwargs.get('model'))
+        self._record_usage(response, estimated_tokens)
+        return response
+
+    def chat_completion_stream(self, estimated_tokens=0, **kwargs):
+        """
+        Streams a chat completion, yielding text as the model produces it
+
+        Opening the stream is rate limited and retried like chat_completion();
+        errors after the first chunk are raised to the caller. The concurrency
+        slot is held until the stream is exhausted or closed.
+
+        Args:
+            estimated_tokens (int): Expected total tokens, charged against the token limit
+            **kwargs: Arguments for the chat completions API
+
+        Yields:
+            str: Successive fragments of the response text
+        """
+        kwargs = dict(kwargs, stream=True)
+        if self.client is not None:
+            # The last chunk then reports the tokens used (sent as extra_body,
+            # which every 1.x client accepts, unlike the stream_options argument)
+            kwargs.setdefault('extra_body', {'stream_options': {'include_usage': True}})
+        stream = self._request(kwargs, estimated_tokens, stream=True)
+        _track_request(kwargs.get('model'))
+        try:
+            for chunk in stream:
+                self._record_usage(chunk, estimated_tokens)
+                text = chunk_content(chunk)
+                if text:
+                    yield text
+        finally:
+            self._release_slot()
+
+    def _request(self, kwargs, estimated_tokens, stream):
+        """Sends one request with rate limiting, retries and the circuit breaker"""
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count('circuit_rejections')
+                raise CircuitOpenError("OpenAI API circuit breaker is open; try again shortly")
+
+            self._wait_for_capacity(estimated_tokens)
+            try:
+                response = self._send(kwargs, keep_slot=stream)
+            except Exception as e:
+                retryable, retry_after, status = self._classify(e)
+                if retryable and status != 429:
+                    self.breaker.record_failure()
+                else:
+                    # The API answered (rate limits and client errors are not outages)
+                    self.breaker.record_success()
+                if not retryable or attempt >= self.max_retries:
+                    self._count('failed')
+                    raise
+
+                delay = self._backoff_delay(attempt, retry_after)
+                if retry_after and self.request_bucket:
+                    # Everyone sharing the limits should hold off, not just this caller;
+                    # the bucket now enforces Retry-After, so only the extra jitter is slept here
+                    self.request_bucket.pause(retry_after)
+                    delay = max(0.0, delay - retry_after)
+                logger.warning(f"OpenAI request failed ({str(e)}), retrying in {delay:.1f}s")
+                self._count('retries')
+                self._count('backoff_seconds', delay)
+                time.sleep(delay)
+                attempt += 1
+                continue
+
+            self.breaker.record_success()
+            self._count('succeeded')
+            return response
+
+    def stats(self):
+        """
+        Returns retry, wait and usage metrics
+
+        Returns:
+            dict: Client metrics
+        """
+        with self._lock:
+            stats = dict(self._metrics)
+        stats['circuit_state'] = self.breaker.state
+        stats['circuit_opens'] = self.breaker.opens
+        for key in ('rate_limit_wait_seconds', 'concurrency_wait_seconds', 'backoff_seconds'):
+            stats[key] = round(stats[key], 3)
+        return stats
+
+    def _wait_for_capacity(self, estimated_tokens):
+        waited = 0.0
+        QUEUE_DEPTH.inc('openai', 'rate_limited')
+        try:
+            if self.request_bucket:
+                waited += self.request_bucket.acquire(1)
+            if self.token_bucket and estimated_tokens:
+                waited += self.token_bucket.acquire(estimated_tokens)
+        finally:
+            QUEUE_DEPTH.dec('openai', 'rate_limited')
+        if waited:
+            self._count('rate_limit_wait_seconds', waited)
+
+    def _send(self, kwargs, keep_slot=False):
+        started = time.monotonic()
+        QUEUE_DEPTH.inc('openai', 'waiting')
+        self._slots.acquire()
+        QUEUE_DEPTH.dec('openai', 'waiting')
+        QUEUE_DEPTH.inc('openai', 'in_flight')
+        self._count('concurrency_wait_seconds', time.monotonic() - started)
+        self._count('requests')
+        self._count('in_flight')
+        try:
+            if self.client is not None:
+                response = self.client.chat.completions.create(**kwargs)
+            else:
+                response = self.legacy_module.ChatCompletion.create(**kwargs)
+        except Exception:
+            self._release_slot()
+            raise
+        if not keep_slot:
+            self._release_slot()
+        return response
+
+    def _release_slot(self):
+        self._count('in_flight', -1)
+        QUEUE_DEPTH.dec('openai', 'in_flight')
+        self._slots.release()
+
+    def _classify(self, error):
+        """Returns (retryable, retry_after_seconds, status_code) for an API error"""
+        status = getattr(error, 'status_code', None) or getattr(error, 'http_status', None)
+        if status == 429:
+            self._count('rate_limited')
+
+        retryable = status in RETRYABLE_STATUS_CODES or type(error).__name__ in RETRYABLE_ERROR_NAMES
+
+        retry_after = None
+        headers = getattr(getattr(error, 'response', None), 'headers', None) or getattr(error, 'headers', None)
+        if headers:
+            try:
+                if headers.get('retry-after-ms'):
+                    retry_after = float(headers['retry-after-ms']) / 1000.0
+                elif headers.get('retry-after'):
+                    retry_after = float(headers['retry-after'])
+            except (TypeError, ValueError):
+                retry_after = None
+
+        return retryable, retry_after, status
+
+    def _backoff_delay(self, attempt, retry_after):
+        # Full jitter spreads retries from concurrent callers apart
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def _record_usage(self, response, estimated_tokens):
+        usage = response_usage(response)
+        if not usage:
+            return
+        self._count('prompt_tokens', usage.get('prompt_tokens') or 0)
+        self._count('completion_tokens', usage.get('completion_tokens') or 0)
+        for kind in ('prompt_tokens', 'completion_tokens'):
+            if usage.get(kind) is not None:
+                API_TOKENS.observe(usage[kind], kind.split('_')[0])
+        _track_tokens(usage)
+        if self.token_bucket and estimated_tokens and usage.get('total_tokens'):
+            unused = estimated_tokens - usage['total_tokens']
+            if unused > 0:
+                self.token_bucket.refund(unused)
+
+    def _count(self, key, amount=1):
+        with self._lock:
+            self._metrics[key] += amount
+
+def _make_bucket(path, name, rate_per_minute):
+    """Returns a token bucket for the rate, shared through path when set, or None when disabled"""
+    if not rate_per_minute:
+        return None
+    if path:
+        try:
+            return SharedTokenBucket(path, name, rate_per_minute)
+        except sqlite3.Error as e:
+            logger.warning(f"Could not open shared rate limits at {path}, limiting per process: {str(e)}")
+    return TokenBucket(rate_per_minute)
+
+@contextmanager
+def track_usage():
+    """
+    Totals the API requests and tokens used by the calls made inside the block
+
+    Calls made from other threads count too when they run in a copy of this
+    context (contextvars.copy_context), as tiled band extractions do.
+
+    Yields:
+        dict: 'model', 'requests', 'prompt_tokens' and 'completion_tokens',
+            updated as calls complete
+    """
+    usage = {'model': None, 'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    previous = _usage.get()
+    _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.set(previous)
+
+def record_model(model):
+    """Notes the model that produced the current extraction, if usage is being tracked"""
+    usage = _usage.get()
+    if usage is not None and usage['model'] is None:
+        usage['model'] = model
+
+def _track_request(model):
+    usage = _usage.get()
+    if usage is None:
+        return
+    with _usage_lock:
+        usage['requests'] += 1
+        if usage['model'] is None:
+            usage['model'] = model
+
+def _track_tokens(reported):
+    usage = _usage.get()
+    if usage is None:
+        return
+    with _usage_lock:
+        usage['prompt_tokens'] += reported.get('prompt_tokens') or 0
+        usage['completion_tokens'] += reported.get('completion_tokens') or 0
+
+def response_content(response):
+    """Returns the message text of a chat completion from either client style"""
+    if isinstance(response, dict):
+        return response['choices'][0]['message']['content']
+    return response.choices[0].message.content
+
+def chunk_content(chunk):
+    """Returns the text delta of a streamed chunk from either client style (may be None)"""
+    if isinstance(chunk, dict):
+        choices = chunk.get('choices') or [{}]
+        return choices[0].get('delta', {}).get('content')
+    if not chunk.choices:
+        return None
+    return chunk.choices[0].delta.content
+
+def response_usage(response):
+    """
+    Returns token usage of a chat completion from either client style
+
+    Returns:
+        dict: prompt_tokens, completion_tokens and total_tokens, or None if unreported
+    """
+    usage = response.get('usage') if isinstance(response, dict) else getattr(response, 'usage', None)
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage
+    return {
+        'prompt_tokens': getattr(usage, 'prompt_tokens', None),
+        'completion_tokens': getattr(usage, 'completion_tokens', None),
+        'total_tokens': getattr(usage, 'total_tokens', None),
+    }
+
+def _create_modern_client():
+    """Creates the modern OpenAI client with a bounded connection pool, or None"""
+    try:
+        from openai import OpenAI
+    except ImportError:
+        logger.warning("Modern OpenAI client not available")
+        return None
+
+    options = {
+        'api_key': OPENAI_API_KEY,
+        'timeout': OPENAI_TIMEOUT,
+        # Retries are handled by RateLimitedClient so limits and metrics see them
+        'max_retries': 0,
+    }
+    if OPENAI_BASE_URL:
+        options['base_url'] = OPENAI_BASE_URL
+
+    try:
+        import httpx
+        options['http_client'] = httpx.Client(
+            timeout=OPENAI_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=OPENAI_POOL_CONNECTIONS,
+                max_keepalive_connections=OPENAI_POOL_CONNECTIONS
+            )
+        )
+    except ImportError:
+        # The client keeps its own pooled session; only the pool size is lost
+        pass
+
+    try:
+        client = OpenAI(**options)
+        logger.info("Using modern OpenAI client")
+        return client
+    except Exception as e:
+        logger.warning(f"Error initializing modern OpenAI client: {str(e)}")
+        return None
+
+def _load_legacy_module():
+    """Returns the legacy openai module configured with the API key, or None"""
+    try:
+        import openai as openai_module
+    except ImportError:
+        return None
+    openai_module.api_key = OPENAI_API_KEY
+    if OPENAI_BASE_URL:
+        openai_module.api_base = OPENAI_BASE_URL
+    logger.info("Using legacy OpenAI module")
+    return openai_module
+
+def get_openai_client():
+    """
+    Returns the shared rate-limited client, creating it on first use
+
+    Returns:
+        RateLimitedClient: The client, or None if no OpenAI library is usable
+    """
+    global _client
+
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                client = _create_modern_client()
+                legacy_module = None if client is not None else _load_legacy_module()
+                if client is None and legacy_module is None:
+                    logger.error("Neither modern nor legacy OpenAI client could be initialized")
+                    return None
+
+                _client = RateLimitedClient(
+                    client=client,
+                    legacy_module=legacy_module,
+                    requests_per_minute=OPENAI_REQUESTS_PER_MINUTE,
+                    tokens_per_minute=OPENAI_TOKENS_PER_MINUTE,
+                    max_concurrency=OPENAI_MAX_CONCURRENCY,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    backoff_base=OPENAI_BACKOFF_BASE,
+                    backoff_max=OPENAI_BACKOFF_MAX,
+                    breaker=CircuitBreaker(
+                        failure_threshold=OPENAI_CIRCUIT_FAILURE_THRESHOLD,
+                        reset_seconds=OPENAI_CIRCUIT_RESET_SECONDS
+                    ),
+                    limits_path=OPENAI_LIMITS_PATH or None
+                )
+    return _client
+
+@reset_after_fork
+def _reset_client():
+    """Drops the client in a forked worker; its HTTP connections belong to the parent"""
+    global _client, _client_lock, _usage_lock
+    _client = None
+    _client_lock = threading.Lock()
+    _usage_lock = threading.Lock()
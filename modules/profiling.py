@@ -0,0 +1,384 @@
+"""
+Module for profiling single requests with cProfile and tracemalloc.
+
+When profiling is enabled, a request is profiled if it asks to be
+(X-Profile: 1 or ?profile=1) or is picked at the sample rate. Its call
+profile is saved under PROFILES_DIR as a .prof file (readable with pstats or
+snakeviz) next to a JSON record of its slowest functions, its peak traced
+memory and the allocation sites alive at each checkpoint. profile_checkpoint()
+marks points where large objects are expected to be alive at once, such as
+a decoded image next to its base64 prompt.
+
+Only one request is profiled at a time, because tracemalloc traces the whole
+process and overlapping runs would blame each other's allocations.
+"""
+import os
+import re
+import hmac
+import json
+import time
+import uuid
+import random
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+import contextvars
+from datetime import datetime
+
+from config import (
+    PROFILING_ENABLED, PROFILING_SAMPLE_RATE, PROFILING_TOKEN, PROFILING_MAX_PROFILES,
+    PROFILING_TOP_ALLOCATIONS, PROFILES_DIR
+)
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Functions listed in a profile's JSON record, by cumulative time
+TOP_FUNCTIONS = 40
+
+# Profile ids are generated here; anything else is rejected before touching the disk
+PROFILE_ID_PATTERN = re.compile(r'\d{8}_\d{6}_[0-9a-f]{8}')
+
+# Frames that only show the profiler itself
+_IGNORED_TRACES = (
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+    tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+    tracemalloc.Filter(False, '<unknown>'),
+)
+
+# Settings that can be changed at runtime through update_profiling_settings()
+_settings = {'enabled': PROFILING_ENABLED, 'sample_rate': PROFILING_SAMPLE_RATE}
+
+# Held while a request is being profiled
+_active = threading.Lock()
+
+# Profile of the request running in the current context (see profile_checkpoint)
+_current = contextvars.ContextVar('request_profile', default=None)
+
+class RequestProfile:
+    """
+    cProfile and tracemalloc run of one request
+
+    Created and started by start_request_profile(); finish() saves it and
+    lets the next request be profiled.
+
+    Args:
+        request_id (str): Id of the profiled request
+        method (str): HTTP method
+        path (str): Requested path with its query string
+        top_allocations (int): Allocation sites kept per snapshot
+    """
+
+    def __init__(self, request_id, method, path, top_allocations=25):
+        self.profile_id = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.top_allocations = top_allocations
+        self.checkpoints = []
+        self.finished = False
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._baseline = None
+        self._was_tracing = False
+        self._started = None
+        self._token = None
+
+    def start(self):
+        """Starts tracing allocations and profiling calls"""
+        self._was_tracing = tracemalloc.is_tracing()
+        if not self._was_tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.take_snapshot()
+        self._token = _current.set(self)
+        self._started = time.perf_counter()
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def checkpoint(self, label):
+        """
+        Records memory in use now and the sites that allocated it since the start
+
+        Args:
+            label (str): Name of the point in the request
+        """
+        with self._lock:
+            if self.finished:
+                return
+            current, peak = tracemalloc.get_traced_memory()
+            self.checkpoints.append({
+                'label': label,
+                'seconds': round(time.perf_counter() - self._started, 6),
+                'current_bytes': current,
+                'peak_bytes': peak,
+                'top_allocations': self._allocation_sites()
+            })
+
+    def finish(self, status_code=None):
+        """
+        Stops profiling and saves the profile
+
+        Args:
+            status_code (int): Response status of the request
+
+        Returns:
+            str: The profile id, or None if it was already finished or could not be saved
+        """
+        with self._lock:
+            if self.finished:
+                return None
+            self._profiler.disable()
+            seconds = time.perf_counter() - self._started
+            current, peak = tracemalloc.get_traced_memory()
+            retained = self._allocation_sites()
+            self.finished = True
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Finished from another context (e.g. after a stream); nothing to restore
+            pass
+        if not self._was_tracing:
+            tracemalloc.stop()
+        self._baseline = None
+
+        record = {
+            'profile_id': self.profile_id,
+            'request_id': self.request_id,
+            'method': self.method,
+            'path': self.path,
+            'status_code': status_code,
+            'created_at': time.time(),
+            'seconds': round(seconds, 6),
+            'peak_bytes': peak,
+            'retained_bytes': current,
+            'checkpoints': self.checkpoints,
+            'retained_allocations': retained,
+            'top_functions': self._top_functions()
+        }
+        try:
+            os.makedirs(PROFILES_DIR, exist_ok=True)
+            self._profiler.dump_stats(os.path.join(PROFILES_DIR, f"{self.profile_id}.prof"))
+            with open(os.path.join(PROFILES_DIR, f"{self.profile_id}.json"), 'w') as f:
+                json.dump(record, f, indent=2)
+            _prune_profiles()
+            logger.info(
+                f"Saved profile {self.profile_id} of {self.method} {self.path}: "
+                f"{seconds:.3f}s, peak {peak / 1048576:.1f} MB traced"
+            )
+            return self.profile_id
+        except OSError as e:
+            logger.error(f"Error saving profile {self.profile_id}: {str(e)}")
+            return None
+        finally:
+            _active.release()
+
+    def _allocation_sites(self):
+        """Returns the lines that allocated the most memory still alive since the start"""
+        snapshot = tracemalloc.take_snapshot().filter_traces(_IGNORED_TRACES)
+        sites = []
+        for stat in snapshot.compare_to(self._baseline, 'lineno'):
+            if stat.size_diff <= 0:
+                continue
+            frame = stat.traceback[0]
+            sites.append({
+                'file': frame.filename,
+                'line': frame.lineno,
+                'bytes': stat.size_diff,
+                'blocks': stat.count_diff
+            })
+        sites.sort(key=lambda site: site['bytes'], reverse=True)
+        return sites[:self.top_allocations]
+
+    def _top_functions(self):
+        stats = pstats.Stats(self._profiler).stats
+        ranked = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:TOP_FUNCTIONS]
+        return [
+            {
+                'function': f"{name} ({filename}:{line})",
+                'calls': calls,
+                'own_seconds': round(own, 6),
+                'cumulative_seconds': round(cumulative, 6)
+            }
+            for (filename, line, name), (_, calls, own, cumulative, _) in ranked
+        ]
+
+def profiling_settings():
+    """
+    Returns whether profiling is enabled, the sample rate and whether a token is required
+
+    Returns:
+        dict: Current settings
+    """
+    return dict(_settings, token_required=bool(PROFILING_TOKEN))
+
+def update_profiling_settings(enabled=None, sample_rate=None):
+    """
+    Changes the profiling settings until the next restart
+
+    Args:
+        enabled (bool): Whether requests may be profiled
+        sample_rate (float): Share of requests profiled without asking, 0 to 1
+
+    Returns:
+        dict: The new settings
+
+    Raises:
+        ValueError: If sample_rate is not between 0 and 1
+    """
+    if sample_rate is not None:
+        sample_rate = float(sample_rate)
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        _settings['sample_rate'] = sample_rate
+    if enabled is not None:
+        _settings['enabled'] = bool(enabled)
+    logger.info(f"Profiling settings changed to {_settings}")
+    return profiling_settings()
+
+def token_accepted(token):
+    """Returns True if no profiling token is configured or the given one matches it"""
+    if not PROFILING_TOKEN:
+        return True
+    return bool(token) and hmac.compare_digest(str(token), PROFILING_TOKEN)
+
+def should_profile(requested):
+    """
+    Decides whether to profile a request
+
+    Args:
+        requested (bool): Whether the request asked to be profiled (with a valid token)
+
+    Returns:
+        bool: True if the request should be profiled
+    """
+    if not _settings['enabled']:
+        return False
+    return requested or (_settings['sample_rate'] > 0 and random.random() < _settings['sample_rate'])
+
+def start_request_profile(request_id, method, path):
+    """
+    Starts profiling the request running in the current context
+
+    Returns:
+        RequestProfile: The started profile, or None if another request is being profiled
+    """
+    if not _active.acquire(blocking=False):
+        logger.info(f"Not profiling {method} {path}: another request is being profiled")
+        return None
+    try:
+        profile = RequestProfile(request_id, method, path, PROFILING_TOP_ALLOCATIONS)
+        profile.start()
+        return profile
+    except Exception as e:
+        _active.release()
+        logger.error(f"Could not start profiling: {str(e)}")
+        return None
+
+def set_current_profile(profile):
+    """
+    Makes a profile current in this context, for code running outside the request's own context
+
+    Returns:
+        Token to pass to reset_current_profile()
+    """
+    return _current.set(profile)
+
+def reset_current_profile(token):
+    """Restores the profile that was current before set_current_profile()"""
+    try:
+        _current.reset(token)
+    except ValueError:
+        pass
+
+def profile_checkpoint(label):
+    """
+    Records the current request's memory at a point of interest, if it is being profiled
+
+    Args:
+        label (str): Name of the point in the request
+    """
+    profile = _current.get()
+    if profile is not None:
+        profile.checkpoint(label)
+
+def list_profiles():
+    """
+    Returns summaries of the saved profiles, newest first
+
+    Returns:
+        list: Dicts with the profile id, request, timing and peak memory
+    """
+    if not os.path.isdir(PROFILES_DIR):
+        return []
+    summaries = []
+    for name in os.listdir(PROFILES_DIR):
+        profile_id, extension = os.path.splitext(name)
+        if extension != '.json':
+            continue
+        record = get_profile(profile_id)
+        if record is None:
+            continue
+        summaries.append({
+            key: record.get(key) for key in (
+                'profile_id', 'request_id', 'method', 'path', 'status_code', 'created_at',
+                'seconds', 'peak_bytes', 'retained_bytes'
+            )
+        })
+    summaries.sort(key=lambda summary: summary['created_at'] or 0, reverse=True)
+    return summaries
+
+def get_profile(profile_id):
+    """
+    Loads a saved profile's JSON record
+
+    Args:
+        profile_id (str): Id of the profile
+
+    Returns:
+        dict: The record, or None if there is no such profile
+    """
+    path = profile_path(profile_id, 'json')
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        logger.error(f"Error reading profile {profile_id}: {str(e)}")
+        return None
+
+def profile_path(profile_id, extension):
+    """
+    Returns the path of a profile's 'prof' or 'json' file
+
+    Returns:
+        str: The path, or None if the id is not one this module generates
+    """
+    if not PROFILE_ID_PATTERN.fullmatch(str(profile_id)) or extension not in ('prof', 'json'):
+        return None
+    return os.path.join(PROFILES_DIR, f"{profile_id}.{extension}")
+
+def _prune_profiles():
+    """Deletes the oldest profiles beyond PROFILING_MAX_PROFILES"""
+    records = [os.path.join(PROFILES_DIR, name) for name in os.listdir(PROFILES_DIR) if name.endswith('.json')]
+    records.sort(key=os.path.getmtime)
+    profile_ids = [os.path.splitext(os.path.basename(path))[0] for path in records]
+    for profile_id in profile_ids[:max(0, len(profile_ids) - PROFILING_MAX_PROFILES)]:
+        for extension in ('json', 'prof'):
+            try:
+                os.remove(os.path.join(PROFILES_DIR, f"{profile_id}.{extension}"))
+            except OSError:
+                pass
+
+@reset_after_fork
+def _reset_active():
+    """Frees profiling in a forked worker, in case the parent was profiling a request"""
+    global _active
+    if _active.locked() and tracemalloc.is_tracing():
+        # The parent's profile never finishes in this process
+        tracemalloc.stop()
+    _active = threading.Lock()
@@ -0,0 +1,328 @@
+"""
+Module for keeping extraction results on the server so they can be listed,
+searched and downloaded by id.
+
+Every successful extraction made through the web API or a schedule is saved
+under a new result id, together with where the image came from (sender and
+image hash), which model produced the table, how long it took and the tokens
+it used. Downloads read the table from here and stream it in the requested
+format, instead of the browser posting the table back to be converted, and
+earlier results can be found again without paying for a new extraction.
+
+Lists are paged newest first with a cursor rather than an offset, so every
+page is an index range scan however far back it reaches.
+"""
+import os
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+
+from config import RESULTS_PATH
+from modules.metrics import timed
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Columns returned by list() and search(), besides the table summary
+SUMMARY_FIELDS = (
+    'id', 'created_at', 'source', 'sender', 'image_hash', 'model', 'seconds',
+    'prompt_tokens', 'completion_tokens', 'num_rows', 'num_columns', 'columns'
+)
+
+# Columns added since the first version of the store, with their types
+_ADDED_COLUMNS = (
+    ('source', 'TEXT'), ('sender', 'TEXT'), ('image_hash', 'TEXT'), ('model', 'TEXT'),
+    ('seconds', 'REAL'), ('prompt_tokens', 'INTEGER'), ('completion_tokens', 'INTEGER'),
+    ('num_rows', 'INTEGER'), ('num_columns', 'INTEGER'), ('columns', 'TEXT'), ('cell_text', 'TEXT')
+)
+
+# Results whose cell_text is filled in per transaction when upgrading an older store
+BACKFILL_BATCH = 500
+
+_store = None
+_store_lock = threading.Lock()
+
+class ResultStore:
+    """
+    SQLite store of extraction results keyed by result id
+
+    Args:
+        path (str): SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Listing and downloads never wait for an extraction being saved
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id TEXT PRIMARY KEY, "
+            "created_at REAL NOT NULL, "
+            "table_data TEXT NOT NULL)"
+        )
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(results)")}
+        for column, column_type in _ADDED_COLUMNS:
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE results ADD COLUMN {column} {column_type}")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_created ON results (created_at, id)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_sender ON results (sender, created_at, id)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_results_image_hash ON results (image_hash, created_at, id)"
+        )
+        self._conn.commit()
+        self._backfill_cell_text()
+
+    def save(self, table_data, source=None, sender=None, image_hash=None, model=None,
+             seconds=None, usage=None):
+        """
+        Stores an extraction result
+
+        Args:
+            table_data (dict): Table with 'columns' and 'rows'
+            source (str): What made the extraction ('extract', 'stream', 'job' or 'schedule')
+            sender (str): Sender the image was captured from
+            image_hash (str): SHA-256 of the extracted image
+            model (str): Model that produced the table ('local' for the local engine)
+            seconds (float): Time the extraction took
+            usage (dict): API usage with 'prompt_tokens' and 'completion_tokens'
+
+        Returns:
+            str: The new result id
+        """
+        result_id = uuid.uuid4().hex
+        usage = usage or {}
+        columns = table_data.get('columns') or []
+        record = (
+            result_id, time.time(), json.dumps(table_data, ensure_ascii=False), source, sender, image_hash,
+            model, round(seconds, 3) if seconds is not None else None,
+            usage.get('prompt_tokens'), usage.get('completion_tokens'),
+            len(table_data.get('rows') or []), len(columns), json.dumps(columns, ensure_ascii=False),
+            cell_text(table_data)
+        )
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO results (id, created_at, table_data, source, sender, image_hash, model, "
+                "seconds, prompt_tokens, completion_tokens, num_rows, num_columns, columns, cell_text) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                record
+            )
+            self._conn.commit()
+        return result_id
+
+    def get(self, result_id):
+        """
+        Looks up a stored result's table
+
+        Args:
+            result_id (str): Id returned by save()
+
+        Returns:
+            dict: The table data, or None if there is no such result
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT table_data FROM results WHERE id = ?", (result_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_record(self, result_id):
+        """
+        Looks up a stored result with its metadata
+
+        Args:
+            result_id (str): Id returned by save()
+
+        Returns:
+            dict: The SUMMARY_FIELDS and 'table_data', or None if there is no such result
+        """
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {', '.join(SUMMARY_FIELDS)}, table_data FROM results WHERE id = ?", (result_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        record = _summary(row)
+        record['table_data'] = json.loads(row[-1])
+        return record
+
+    def search(self, sender=None, image_hash=None, model=None, source=None, since=None, until=None,
+               text=None, limit=50, cursor=None):
+        """
+        Lists stored results newest first, optionally filtered
+
+        Sender and image hash filters use their indexes. 'text' matches
+        within a column name or cell value, ignoring case, and never the
+        JSON around them. It reads every result in the time range, so it is
+        best combined with 'since'.
+
+        Args:
+            sender (str): Only results captured from this sender
+            image_hash (str): Only results of this image
+            model (str): Only results produced by this model
+            source (str): Only results made this way
+            since (float): Earliest creation time (Unix timestamp)
+            until (float): Latest creation time (Unix timestamp)
+            text (str): Substring to look for in a column name or cell
+            limit (int): Maximum number of results
+            cursor (str): 'next_cursor' from the previous page
+
+        Returns:
+            tuple: (list of result summaries, cursor of the next page or None)
+
+        Raises:
+            ValueError: If the cursor is malformed
+        """
+        conditions = []
+        params = []
+        for column, value in (('sender', sender), ('image_hash', image_hash), ('model', model),
+                              ('source', source)):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            conditions.append("created_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("created_at <= ?")
+            params.append(until)
+        if text:
+            text = text.casefold()
+            escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            conditions.append("cell_text LIKE ? ESCAPE '\\'")
+            params.append(f"%{escaped}%")
+        if cursor:
+            created_at, result_id = _parse_cursor(cursor)
+            conditions.append("(created_at < ? OR (created_at = ? AND id < ?))")
+            params += [created_at, created_at, result_id]
+
+        where = f"WHERE {' AND '.join(conditions)} " if conditions else ""
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {', '.join(SUMMARY_FIELDS)} FROM results {where}"
+                "ORDER BY created_at DESC, id DESC LIMIT ?",
+                params + [limit + 1]
+            ).fetchall()
+
+        results = [_summary(row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit:
+            last = results[-1]
+            next_cursor = f"{last['created_at']!r}:{last['id']}"
+        return results, next_cursor
+
+    def list(self, limit=50, cursor=None):
+        """Lists stored results newest first (search() without filters)"""
+        return self.search(limit=limit, cursor=cursor)
+
+    def _backfill_cell_text(self):
+        """Fills in the searchable text of results saved before it was stored"""
+        filled = 0
+        while True:
+            rows = self._conn.execute(
+                "SELECT id, table_data FROM results WHERE cell_text IS NULL LIMIT ?", (BACKFILL_BATCH,)
+            ).fetchall()
+            if not rows:
+                break
+            self._conn.executemany(
+                "UPDATE results SET cell_text = ? WHERE id = ?",
+                [(cell_text(json.loads(table_data)), result_id) for result_id, table_data in rows]
+            )
+            self._conn.commit()
+            filled += len(rows)
+        if filled:
+            logger.info(f"Indexed the text of {filled} stored results for search")
+
+def cell_text(table_data):
+    """
+    Returns the text search() matches: column names and cell values, one per line
+
+    The text is case-folded so a search ignores case in any script, which
+    SQLite's LIKE only does for ASCII.
+
+    Args:
+        table_data (dict): Table with 'columns' and 'rows'
+
+    Returns:
+        str: The searchable text
+    """
+    values = [str(column) for column in table_data.get('columns') or []]
+    for row in table_data.get('rows') or []:
+        cells = row.values() if isinstance(row, dict) else row
+        values.extend(str(cell) for cell in cells if cell is not None)
+    return '\n'.join(values).casefold()
+
+def _summary(row):
+    summary = dict(zip(SUMMARY_FIELDS, row))
+    summary['columns'] = json.loads(summary['columns']) if summary['columns'] else None
+    return summary
+
+def _parse_cursor(cursor):
+    created_at, _, result_id = cursor.partition(':')
+    try:
+        created_at = float(created_at)
+    except ValueError:
+        result_id = None
+    if not result_id:
+        raise ValueError(f"Invalid cursor: {cursor}")
+    return created_at, result_id
+
+def get_result_store():
+    """
+    Returns the shared result store, creating it on first use
+
+    Returns:
+        ResultStore: The store, or None if it could not be opened
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                try:
+                    _store = ResultStore(RESULTS_PATH)
+                    logger.info(f"Result store opened at {RESULTS_PATH}")
+                except Exception as e:
+                    logger.error(f"Error opening result store: {str(e)}")
+                    return None
+    return _store
+
+@timed('save_result')
+def save_result(table_data, **metadata):
+    """
+    Saves an extraction result, never failing the extraction that produced it
+
+    Args:
+        table_data (dict): Table with 'columns' and 'rows'
+        **metadata: Keyword arguments of ResultStore.save (source, sender,
+            image_hash, model, seconds, usage)
+
+    Returns:
+        str: The result id, or None if the result could not be saved
+    """
+    store = get_result_store()
+    if store is None:
+        return None
+    try:
+        return store.save(table_data, **metadata)
+    except Exception as e:
+        logger.error(f"Error saving extraction result: {str(e)}")
+        return None
+
+@reset_after_fork
+def _reset_store():
+    """Forgets the store in a forked worker so it connects to the database itself"""
+    global _store, _store_lock
+    _store = None
+    _store_lock = threading.Lock()
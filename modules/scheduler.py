@@ -0,0 +1,633 @@
+"""
+Module for capturing and extracting tables on a schedule.
+
+A schedule names a sender, a screen region and an interval. Each run
+captures the region, skips extraction if the screen has not changed since
+the previous run, and otherwise extracts the table and appends it to the
+time-series store (and saves it in the result store, like any extraction).
+
+One timer thread keeps a heap of due times and hands due runs to a small
+worker pool, so dozens of schedules cost one sleeping thread and request
+handling is never blocked. Runs are due on a fixed grid (the first run plus
+whole intervals), so slow runs never make a schedule drift. A run that comes
+due while the previous one is still going is skipped (coalesced) rather than
+queued behind it.
+
+Under a pre-fork server every worker has a scheduler, but only one, elected
+with a file lock, runs the schedules; the others share them through the
+schedules file.
+"""
+import os
+import json
+import time
+import heapq
+import uuid
+import random
+import hashlib
+import logging
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from config import SCHEDULES_PATH, SCHEDULER_WORKERS, SCHEDULE_MIN_INTERVAL
+from modules.screenshot import capture_screenshot
+from modules.senders import list_senders, default_sender
+from modules.image_processing import preprocess_image
+from modules.table_extraction import extract_table_with_backend, extract_table_from_image
+from modules.tiling import should_tile, extract_table_tiled
+from modules.timeseries import get_timeseries_store
+from modules.openai_client import track_usage
+from modules.results import save_result
+from modules.metrics import span, set_request_id, reset_request_id
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Schedules loaded at startup start within this many seconds of each other,
+# so a restart does not capture from every sender at the same instant
+STARTUP_SPREAD = 30
+
+# Seconds within which the leader picks up schedules added, removed or run in other processes
+SYNC_INTERVAL = 2
+
+REGION_KEYS = ('left', 'top', 'width', 'height')
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def run_schedule(schedule, state):
+    """
+    Captures a schedule's region and extracts its table if the screen changed
+
+    Args:
+        schedule (dict): Schedule with sender, region, scale and backend
+        state (dict): The schedule's state from earlier runs ('etag' and
+            'image_hash' are read and updated)
+
+    Returns:
+        tuple: (success, result_or_error)
+            - If successful, returns (True, dict with 'status' of 'extracted' or
+              'unchanged' and, when extracted, 'table_data', 'captured_at' and 'result_id')
+            - If failed, returns (False, error message)
+    """
+    region = schedule['region']
+    captured_at = time.time()
+    success, result = capture_screenshot(
+        region=region, scale=schedule.get('scale'), sender=schedule['sender'], etag=state.get('etag')
+    )
+    if not success:
+        return False, result
+
+    image_data, capture_info = result
+    if image_data is None:
+        # The sender reported the same pixels as last time
+        return True, {'status': 'unchanged'}
+
+    image_bytes = image_data.getvalue()
+    if capture_info.get('region') is None:
+        # Senders without region support return the whole screen
+        image_bytes = _crop_region(image_bytes, region)
+
+    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    if image_hash == state.get('image_hash'):
+        state['etag'] = capture_info.get('etag')
+        return True, {'status': 'unchanged'}
+
+    started = time.monotonic()
+    with track_usage() as usage:
+        success, table_data = extract_table_with_backend(
+            image_bytes, backend=schedule.get('backend'), remote=_extract_remote
+        )
+    if not success:
+        return False, table_data
+
+    get_timeseries_store().append(schedule['id'], captured_at, table_data)
+    result_id = save_result(
+        table_data, source='schedule', sender=schedule['sender'], image_hash=image_hash,
+        model=usage['model'], seconds=time.monotonic() - started, usage=usage
+    )
+    # Only a stored result makes the next identical capture skippable
+    state['etag'] = capture_info.get('etag')
+    state['image_hash'] = image_hash
+    return True, {
+        'status': 'extracted', 'captured_at': captured_at, 'table_data': table_data, 'result_id': result_id
+    }
+
+def _extract_remote(payload):
+    """
+    Extracts with the API, tiling tall tables and shrinking the rest first
+
+    Scheduled runs bypass the cache: a run only extracts once the screen has
+    changed, and an earlier result for a similar capture would record stale
+    numbers in the time series.
+    """
+    if should_tile(payload):
+        return extract_table_tiled(payload, use_cache=False)
+    payload, _ = preprocess_image(payload)
+    return extract_table_from_image(payload, use_cache=False)
+
+def _crop_region(image_bytes, region):
+    """Crops a full-screen capture to a region, returning PNG bytes"""
+    left, top, width, height = (region[key] for key in REGION_KEYS)
+    with Image.open(BytesIO(image_bytes)) as img:
+        cropped = img.crop((left, top, left + width, top + height))
+        output = BytesIO()
+        cropped.save(output, format='PNG')
+    return output.getvalue()
+
+def validate_schedule(data):
+    """
+    Checks and normalizes a schedule definition
+
+    Args:
+        data (dict): name, sender, region (monitor, left, top, width, height),
+            interval in seconds, and optionally scale and backend
+
+    Returns:
+        dict: The normalized schedule (without id)
+
+    Raises:
+        ValueError: If a field is missing or invalid
+    """
+    sender = data.get('sender') or default_sender()
+    if sender not in list_senders():
+        raise ValueError(f"Unknown sender: {sender}")
+
+    try:
+        interval = float(data['interval'])
+        region = {key: int(data['region'][key]) for key in REGION_KEYS}
+        region['monitor'] = int(data['region'].get('monitor', 0))
+        scale = float(data['scale']) if data.get('scale') is not None else None
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise ValueError("interval and region (left, top, width, height) are required numbers")
+
+    if interval < SCHEDULE_MIN_INTERVAL:
+        raise ValueError(f"interval must be at least {SCHEDULE_MIN_INTERVAL} seconds")
+    if region['width'] <= 0 or region['height'] <= 0:
+        raise ValueError("region width and height must be positive")
+    if scale is not None and not 0 < scale <= 1:
+        raise ValueError("scale must be greater than 0 and at most 1")
+
+    return {
+        'name': str(data.get('name') or f"{sender} {region['left']},{region['top']}"),
+        'sender': sender,
+        'region': region,
+        'scale': scale,
+        'interval': interval,
+        'backend': data.get('backend')
+    }
+
+class Scheduler:
+    """
+    Runs saved schedules on a timer thread and a bounded worker pool
+
+    Every process that serves the API has a Scheduler, but only the one
+    holding an exclusive lock on the schedules file (the leader) runs
+    schedules. The others wait for the lock, so one of them takes over if
+    the leader exits. Schedules are added and removed through the JSON file
+    in any process, and the leader picks up changes within SYNC_INTERVAL.
+    The leader publishes run state to a status file next to it, which the
+    other processes read for list(), get() and stats().
+
+    Args:
+        path (str): JSON file the schedules are saved in
+        workers (int): Number of runs that may execute at once
+        runner (callable): Runs one schedule (defaults to run_schedule)
+    """
+
+    def __init__(self, path, workers=4, runner=None):
+        self.path = path
+        self.workers = workers
+        self.runner = runner or run_schedule
+        self.status_path = f"{os.path.splitext(path)[0]}.status.json"
+        self._schedules = {}
+        self._state = {}
+        self._heap = []
+        self._condition = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._leader = False
+        self._leader_file = None
+        self._file_version = None
+        self._stopping = False
+        self._counters = {'runs': 0, 'extracted': 0, 'unchanged': 0, 'failed': 0, 'coalesced': 0}
+
+    @property
+    def is_leader(self):
+        """True if this process runs the schedules"""
+        return self._leader
+
+    def start(self):
+        """Starts the timer thread, which runs schedules once this process is elected"""
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._lead, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stops the timer thread; runs already started finish in the background"""
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+
+    def add(self, data):
+        """
+        Saves a new schedule; its first run starts within SYNC_INTERVAL
+
+        Args:
+            data (dict): Schedule definition (see validate_schedule)
+
+        Returns:
+            dict: The saved schedule with its id
+
+        Raises:
+            ValueError: If the definition is invalid
+        """
+        schedule = validate_schedule(data)
+        schedule['id'] = uuid.uuid4().hex
+        schedule['created_at'] = time.time()
+        self._edit(lambda schedules: schedules.append(schedule))
+        self._wake()
+        logger.info(f"Added schedule {schedule['id']} ({schedule['name']}) every {schedule['interval']}s")
+        return dict(schedule)
+
+    def remove(self, schedule_id):
+        """
+        Deletes a schedule; its stored tables are kept
+
+        Returns:
+            bool: True if the schedule existed
+        """
+        def change(schedules):
+            remaining = [schedule for schedule in schedules if schedule['id'] != schedule_id]
+            removed = len(remaining) != len(schedules)
+            schedules[:] = remaining
+            return removed
+
+        if not self._edit(change):
+            return False
+        self._wake()
+        logger.info(f"Removed schedule {schedule_id}")
+        return True
+
+    def run_now(self, schedule_id):
+        """
+        Starts a run outside the schedule, unless one is already running
+
+        Outside the leader, the run is requested through the schedules file
+        and starts within SYNC_INTERVAL.
+
+        Returns:
+            bool: True if a run was started or requested
+        """
+        with self._condition:
+            if self._leader:
+                self._sync()
+                if schedule_id not in self._schedules:
+                    raise KeyError(schedule_id)
+                return self._dispatch(schedule_id, time.time())
+
+        if self._read_status().get('state', {}).get(schedule_id, {}).get('running'):
+            return False
+
+        def change(schedules):
+            for schedule in schedules:
+                if schedule['id'] == schedule_id:
+                    schedule['run_requested_at'] = time.time()
+                    return True
+            return False
+
+        if not self._edit(change):
+            raise KeyError(schedule_id)
+        return True
+
+    def get(self, schedule_id):
+        """
+        Returns a schedule with its run state
+
+        Returns:
+            dict: Schedule details, or None if it does not exist
+        """
+        return next((schedule for schedule in self.list() if schedule['id'] == schedule_id), None)
+
+    def list(self):
+        """Returns every schedule with its run state"""
+        with self._condition:
+            if self._leader:
+                self._sync()
+                return [self._snapshot(schedule_id) for schedule_id in self._schedules]
+
+        states = self._read_status().get('state', {})
+        schedules = []
+        for schedule in self._load():
+            snapshot = dict(schedule)
+            snapshot.update(self._public_state(self._new_state()))
+            snapshot.update(states.get(schedule['id'], {}))
+            schedules.append(snapshot)
+        return schedules
+
+    def stats(self):
+        """Returns run counters, the pool's capacity and which process runs the schedules"""
+        with self._condition:
+            if self._leader:
+                return self._stats()
+
+        status = self._read_status()
+        stats = dict(self._counters)
+        stats.update(status.get('stats', {}))
+        stats['schedules'] = len(self._load())
+        stats['leader_pid'] = status.get('pid')
+        return stats
+
+    def _lead(self):
+        """Waits until this process is elected, then runs the timer loop"""
+        if not self._acquire_leadership():
+            return
+        with self._condition:
+            self._leader = True
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='schedule-run')
+            self._sync(startup=True)
+            self._write_status()
+        logger.info(f"Scheduler started in process {os.getpid()} with {len(self._schedules)} schedule(s)")
+        self._loop()
+
+    def _acquire_leadership(self):
+        """Blocks until this process holds the leader lock; True once it does"""
+        if fcntl is None:
+            # No file locks (Windows): only one process serves the API there
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            self._leader_file = open(f"{self.path}.leader", 'a')
+            try:
+                fcntl.flock(self._leader_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                logger.info("Schedules run in another process; this one takes over if it exits")
+                # Held until the process exits, which releases the lock
+                fcntl.flock(self._leader_file, fcntl.LOCK_EX)
+            return True
+        except OSError as e:
+            logger.error(f"Error acquiring the scheduler lock: {str(e)}")
+            return False
+
+    def _loop(self):
+        with self._condition:
+            while not self._stopping:
+                self._sync()
+                if not self._heap:
+                    self._condition.wait(SYNC_INTERVAL)
+                    continue
+
+                due, schedule_id = self._heap[0]
+                now = time.time()
+                if due > now:
+                    self._condition.wait(min(due - now, SYNC_INTERVAL))
+                    continue
+
+                heapq.heappop(self._heap)
+                schedule = self._schedules.get(schedule_id)
+                state = self._state.get(schedule_id)
+                if schedule is None or state['next_run'] != due:
+                    # Removed, or superseded by a newer entry
+                    continue
+
+                self._dispatch(schedule_id, due)
+                # Next slot on the grid after now; slots missed while asleep are coalesced
+                interval = schedule['interval']
+                missed = int((now - due) // interval)
+                self._counters['coalesced'] += missed
+                self._push(schedule_id, due + (missed + 1) * interval)
+
+    def _sync(self, startup=False):
+        """Applies changes to the schedules file made by any process (caller holds the lock)"""
+        version = self._version()
+        if version == self._file_version:
+            return
+        self._file_version = version
+
+        now = time.time()
+        saved = {schedule['id']: schedule for schedule in self._load()}
+        for schedule_id in [schedule_id for schedule_id in self._schedules if schedule_id not in saved]:
+            # Stale heap entries are skipped by the loop
+            del self._schedules[schedule_id]
+            del self._state[schedule_id]
+
+        for schedule_id, schedule in saved.items():
+            requested = schedule.get('run_requested_at') or 0
+            if schedule_id not in self._schedules:
+                self._schedules[schedule_id] = schedule
+                self._state[schedule_id] = self._new_state()
+                self._state[schedule_id]['run_requested_at'] = requested
+                # After a restart, spread the first runs; new schedules run right away
+                delay = random.uniform(0, min(schedule['interval'], STARTUP_SPREAD)) if startup else 0
+                self._push(schedule_id, now + delay)
+                continue
+
+            self._schedules[schedule_id] = schedule
+            state = self._state[schedule_id]
+            if requested > state['run_requested_at']:
+                state['run_requested_at'] = requested
+                self._dispatch(schedule_id, now)
+        self._write_status()
+
+    def _wake(self):
+        """Lets the leader in this process pick up a change to the file at once"""
+        with self._condition:
+            self._condition.notify()
+
+    def _dispatch(self, schedule_id, due):
+        """Hands a run to the pool unless the previous one is still going (caller holds the lock)"""
+        state = self._state[schedule_id]
+        if state['running']:
+            self._counters['coalesced'] += 1
+            logger.info(f"Schedule {schedule_id} still running, skipping this run")
+            return False
+
+        lag = max(0.0, time.time() - due)
+        state['running'] = True
+        state['last_lag'] = round(lag, 3)
+        state['max_lag'] = max(state['max_lag'], round(lag, 3))
+        self._executor.submit(self._run, self._schedules[schedule_id], state)
+        self._write_status()
+        return True
+
+    def _run(self, schedule, state):
+        started = time.time()
+        # Each run gets its own id in the span log, as a web request would
+        token = set_request_id(f"schedule-{schedule['id']}-{uuid.uuid4().hex[:8]}")
+        try:
+            with span('schedule_run', schedule_id=schedule['id']):
+                success, result = self.runner(schedule, state)
+        except Exception as e:
+            logger.exception(f"Schedule {schedule['id']} raised an exception")
+            success, result = False, str(e)
+        finally:
+            reset_request_id(token)
+
+        status = result['status'] if success else 'failed'
+        with self._condition:
+            state['running'] = False
+            state['last_run'] = started
+            state['last_seconds'] = round(time.time() - started, 3)
+            state['last_status'] = status
+            state['last_error'] = None if success else result
+            state['runs'] += 1
+            self._counters['runs'] += 1
+            self._counters[status] += 1
+            self._write_status()
+
+        if success:
+            logger.info(f"Schedule {schedule['id']} {status} in {state['last_seconds']}s")
+        else:
+            logger.error(f"Schedule {schedule['id']} failed: {result}")
+
+    def _push(self, schedule_id, due):
+        """Queues the next run; older heap entries for the schedule become stale"""
+        self._state[schedule_id]['next_run'] = due
+        heapq.heappush(self._heap, (due, schedule_id))
+        self._condition.notify()
+
+    def _snapshot(self, schedule_id):
+        snapshot = dict(self._schedules[schedule_id])
+        snapshot.update(self._public_state(self._state[schedule_id]))
+        return snapshot
+
+    def _stats(self):
+        """Returns the leader's counters (caller holds the lock)"""
+        stats = dict(self._counters)
+        stats['schedules'] = len(self._schedules)
+        stats['running'] = sum(1 for state in self._state.values() if state['running'])
+        stats['max_lag'] = max((state['max_lag'] for state in self._state.values()), default=0.0)
+        stats['workers'] = self.workers
+        stats['leader_pid'] = os.getpid()
+        return stats
+
+    @staticmethod
+    def _public_state(state):
+        return {key: value for key, value in state.items() if key not in ('etag', 'image_hash', 'run_requested_at')}
+
+    @staticmethod
+    def _new_state():
+        return {
+            'running': False,
+            'next_run': None,
+            'last_run': None,
+            'last_seconds': None,
+            'last_status': None,
+            'last_error': None,
+            'last_lag': None,
+            'max_lag': 0.0,
+            'runs': 0,
+            'etag': None,
+            'image_hash': None,
+            'run_requested_at': 0
+        }
+
+    def _version(self):
+        """Identifies the current schedules file; each save replaces it"""
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading schedules: {str(e)}")
+            return []
+
+    def _edit(self, change):
+        """
+        Applies change(schedules) to the saved schedules, holding the file's edit lock
+
+        Returns:
+            The value returned by change; nothing is written if it returns False
+        """
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        with open(f"{self.path}.lock", 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            schedules = self._load()
+            result = change(schedules)
+            if result is not False:
+                _write_json(self.path, schedules)
+        return result
+
+    def _read_status(self):
+        try:
+            with open(self.status_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_status(self):
+        """Publishes run state for the other processes (caller holds the lock)"""
+        _write_json(self.status_path, {
+            'pid': os.getpid(),
+            'updated_at': time.time(),
+            'stats': self._stats(),
+            'state': {schedule_id: self._public_state(state) for schedule_id, state in self._state.items()}
+        })
+
+def _write_json(path, data):
+    """Writes a JSON file atomically"""
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(temp_path, path)
+    except OSError as e:
+        logger.error(f"Error saving {path}: {str(e)}")
+
+def start_scheduler():
+    """
+    Creates the shared scheduler and starts its election
+
+    Called by the app factory, so schedules resume as soon as a server
+    process starts rather than on the first request.
+
+    Returns:
+        Scheduler: The scheduler
+    """
+    return get_scheduler()
+
+def get_scheduler():
+    """
+    Returns the shared scheduler, creating and starting it on first use
+
+    Returns:
+        Scheduler: The scheduler
+    """
+    global _scheduler
+
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                scheduler = Scheduler(SCHEDULES_PATH, workers=SCHEDULER_WORKERS)
+                scheduler.start()
+                _scheduler = scheduler
+    return _scheduler
+
+@reset_after_fork
+def _reset_scheduler():
+    """Forgets the parent's scheduler in a forked worker, whose timer threads did not survive the fork"""
+    global _scheduler, _scheduler_lock
+    if _scheduler is not None and _scheduler._leader_file is not None:
+        # The parent keeps its lock; the child's copy would outlive the parent and block every takeover
+        _scheduler._leader_file.close()
+    _scheduler = None
+    _scheduler_lock = threading.Lock()
@@ -1,52 +1,150 @@
 """
 Module for handling screenshot capture functionality.
 """
-import os
+import time
+import base64
 import requests
 from io import BytesIO
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
-from flask import send_file
+from flask import Response, send_file
+from PIL import Image
 
-from config import SENDER_URL, SCREENSHOTS_DIR
+from config import (
+    CAPTURE_MONITOR, CAPTURE_SCALE, CAPTURE_FORMAT,
+    SENDER_CONNECT_TIMEOUT, SENDER_TIMEOUT, SENDER_FANOUT_WORKERS
+)
+from modules.senders import list_senders, default_sender, get_sender_url, get_session
+from modules.blob_store import get_blob_store
+from modules.uploads import register_capture, capture_stored
+from modules.metrics import span, observe_bytes
+from modules.utils import reset_after_fork
 
 logger = logging.getLogger(__name__)
 
-def capture_screenshot():
+# File extensions for the image types a sender can return
+IMAGE_EXTENSIONS = {'image/png': 'png', 'image/webp': 'webp', 'image/jpeg': 'jpg'}
+
+# Captures are relayed to the browser in chunks of this size
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Single thread writing local copies of streamed captures
+_copy_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='screenshot-copy')
+
+# Threads capturing from several senders at once
+_fanout = ThreadPoolExecutor(max_workers=SENDER_FANOUT_WORKERS, thread_name_prefix='sender-fanout')
+
+def capture_screenshot(region=None, monitor=None, scale=None, sender=None, etag=None):
     """
-    Requests a screenshot from the sender machine
+    Requests a screenshot from a sender machine
+    
+    Args:
+        region (dict): left, top, width and height to capture (and optionally
+            the monitor they belong to); None captures the whole monitor
+        monitor (int): Monitor index, 0 for the whole desktop (defaults to CAPTURE_MONITOR)
+        scale (float): Sender-side downscale factor (defaults to CAPTURE_SCALE)
+        sender (str): Name of the sender to capture from (defaults to the first in SENDERS)
+        etag (str): ETag of the caller's last capture of the same region
     
     Returns:
         tuple: (success, response_or_error)
-            - If successful, returns (True, BytesIO object with image)
+            - If successful, returns (True, (BytesIO object with image, capture info dict));
+              the image is None if the screen is unchanged since etag
             - If failed, returns (False, error message)
     """
+    success, result = stream_screenshot(
+        region=region, monitor=monitor, scale=scale, sender=sender, etag=etag
+    )
+    if not success:
+        return False, result
+    
+    chunks, capture_info = result
+    if chunks is None:
+        return True, (None, capture_info)
     try:
+        return True, (BytesIO(b''.join(chunks)), capture_info)
+    except requests.exceptions.RequestException as e:
+        error_msg = f"Error receiving screenshot from sender: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+def stream_screenshot(region=None, monitor=None, scale=None, sender=None, etag=None):
+    """
+    Requests a screenshot from a sender machine without buffering it
+    
+    The returned iterator passes the sender's chunks through as they arrive
+    and stores a copy in the screenshots blob store on a background thread. It must be
+    consumed or closed to release the connection. When the copy is kept,
+    capture_info['id'] identifies it, so crops can later be cut from it
+    (see modules.uploads).
+    
+    When etag is given and the sender reports the screen unchanged, nothing
+    is transferred: the iterator is None and capture_info['unchanged'] is True.
+    
+    Args:
+        region (dict): left, top, width and height to capture (and optionally
+            the monitor they belong to); None captures the whole monitor
+        monitor (int): Monitor index, 0 for the whole desktop (defaults to CAPTURE_MONITOR)
+        scale (float): Sender-side downscale factor (defaults to CAPTURE_SCALE)
+        sender (str): Name of the sender to capture from (defaults to the first in SENDERS)
+        etag (str): ETag of the caller's last capture, sent as If-None-Match
+    
+    Returns:
+        tuple: (success, response_or_error)
+            - If successful, returns (True, (iterator of image bytes or None, capture info dict))
+            - If failed, returns (False, error message)
+    """
+    try:
+        sender = sender or default_sender()
         # Request screenshot from sender
-        capture_url = f"{SENDER_URL}/capture"
-        logger.info(f"Requesting screenshot from {capture_url}")
+        capture_url = f"{get_sender_url(sender)}/capture"
+        params = {
+            'monitor': CAPTURE_MONITOR if monitor is None else monitor,
+            'scale': CAPTURE_SCALE if scale is None else scale,
+            'format': CAPTURE_FORMAT
+        }
+        if region:
+            params['monitor'] = region.get('monitor', params['monitor'])
+            params.update({key: region[key] for key in ('left', 'top', 'width', 'height')})
+        logger.info(f"Requesting screenshot from {capture_url} with {params}")
         
-        response = requests.get(capture_url, timeout=10)
+        # The shared session reuses a kept-alive connection to the sender
+        with span('capture_request', sender=sender):
+            response = get_session().get(
+                capture_url, params=params, timeout=(SENDER_CONNECT_TIMEOUT, SENDER_TIMEOUT), stream=True,
+                headers={'If-None-Match': etag} if etag else None
+            )
         
-        if response.status_code == 200:
-            # Save a copy of the screenshot locally (optional)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{SCREENSHOTS_DIR}/screenshot_{timestamp}.png"
+        if response.status_code == 304:
+            response.close()
+            logger.info(f"Screen unchanged on {sender}, nothing transferred")
+            return True, (None, _capture_info(response, sender, None, unchanged=True))
+        elif response.status_code == 200:
+            mimetype = response.headers.get('Content-Type', 'image/png').split(';')[0].strip()
+            if mimetype in IMAGE_EXTENSIONS:
+                chunks = response.iter_content(STREAM_CHUNK_SIZE)
+            else:
+                # Raw frames (and old senders) must be read whole to be converted
+                content, mimetype = _decode_capture(response)
+                chunks = iter([content])
             
-            with open(filename, 'wb') as f:
-                f.write(response.content)
-            
-            logger.info(f"Screenshot saved to {filename}")
-            
-            # Return the image as BytesIO for immediate use
-            return True, BytesIO(response.content)
+            capture_info = _capture_info(response, sender, mimetype)
+            if get_blob_store('screenshots') is not None:
+                capture_info['id'] = register_capture()
+            chunks = _tee_to_store(chunks, response, IMAGE_EXTENSIONS[mimetype], capture_info.get('id'))
+            return True, (chunks, capture_info)
         else:
-            error_msg = f"Failed to capture screenshot. Status code: {response.status_code}"
+            response.close()
+            error_msg = f"Failed to capture screenshot from {sender}. Status code: {response.status_code}"
             logger.error(error_msg)
             return False, error_msg
             
+    except KeyError as e:
+        error_msg = str(e.args[0])
+        logger.error(error_msg)
+        return False, error_msg
     except requests.exceptions.RequestException as e:
-        error_msg = f"Error connecting to sender: {str(e)}"
+        error_msg = f"Error connecting to sender {sender}: {str(e)}"
         logger.error(error_msg)
         return False, error_msg
     except Exception as e:
@@ -54,14 +152,182 @@ def capture_screenshot():
         logger.error(error_msg)
         return False, error_msg
 
-def get_screenshot_response(image_data):
+def get_screenshot_response(image_data, capture_info=None):
     """
     Creates a Flask response with the screenshot image
     
     Args:
-        image_data (BytesIO): Image data
+        image_data: BytesIO with the image, an iterator of its bytes to stream,
+            or None for a 304 Not Modified response
+        capture_info (dict): Sender name, image type, monitor, region, scale
+            and ETag reported by the sender
         
     Returns:
         Response: Flask response object with the image
     """
-    return send_file(image_data, mimetype='image/png')
\ No newline at end of file
+    capture_info = capture_info or {}
+    mimetype = capture_info.get('mimetype', 'image/png')
+    if image_data is None:
+        response = Response(status=304, headers={'Cache-Control': 'no-store'})
+    elif hasattr(image_data, 'read'):
+        response = send_file(image_data, mimetype=mimetype)
+    else:
+        response = Response(image_data, mimetype=mimetype, headers={'Cache-Control': 'no-store'})
+    # The browser sends these back with its crop so the region can be remembered
+    # and the crop cut from the stored capture
+    for key in ('sender', 'monitor', 'region', 'scale', 'id'):
+        if capture_info.get(key) is not None:
+            response.headers[f'X-Capture-{key.capitalize()}'] = capture_info[key]
+    if capture_info.get('etag'):
+        response.headers['ETag'] = capture_info['etag']
+    return response
+
+def _capture_info(response, sender, mimetype, unchanged=False):
+    """Collects what a sender reports about a capture from its response headers"""
+    # Senders without region or ETag support ignore the parameters and omit these headers
+    return {
+        'sender': sender,
+        'monitor': response.headers.get('X-Capture-Monitor', '0'),
+        'region': response.headers.get('X-Capture-Region'),
+        'scale': response.headers.get('X-Capture-Scale', '1.0'),
+        'etag': response.headers.get('ETag'),
+        'unchanged': unchanged,
+        'mimetype': mimetype
+    }
+
+def capture_from_senders(names=None, region=None, scale=None):
+    """
+    Captures from several senders at once, yielding each result as it lands
+    
+    Every capture has its own connect and read timeouts, so a slow or
+    unreachable sender delays only its own result.
+    
+    Args:
+        names (list): Sender names (defaults to every configured sender)
+        region (dict): Region to capture on every sender; None captures the whole monitor
+        scale (float): Sender-side downscale factor (defaults to CAPTURE_SCALE)
+    
+    Yields:
+        dict: 'sender', 'success', 'seconds' and either 'image' (a data URL)
+            with 'capture' info, or 'error'
+    """
+    names = list(names or list_senders())
+    started = time.monotonic()
+    futures = {
+        _fanout.submit(capture_screenshot, region=region, scale=scale, sender=name): name
+        for name in names
+    }
+    logger.info(f"Capturing from {len(names)} sender(s)")
+    
+    for future in as_completed(futures):
+        name = futures[future]
+        result = {'sender': name, 'seconds': round(time.monotonic() - started, 3)}
+        success, capture = future.result()
+        result['success'] = success
+        if success:
+            image_data, capture_info = capture
+            encoded = base64.b64encode(image_data.getvalue()).decode('ascii')
+            result['image'] = f"data:{capture_info['mimetype']};base64,{encoded}"
+            result['capture'] = capture_info
+        else:
+            result['error'] = capture
+        yield result
+
+def _decode_capture(response):
+    """
+    Returns a sender response's image bytes and type
+    
+    Raw RGB frames are encoded as PNG here, since browsers can't display them.
+    
+    Returns:
+        tuple: (image bytes, MIME type)
+    """
+    mimetype = response.headers.get('Content-Type', 'image/png').split(';')[0].strip()
+    if mimetype in IMAGE_EXTENSIONS:
+        return response.content, mimetype
+    
+    if mimetype == 'application/octet-stream' and 'X-Image-Size' in response.headers:
+        width, height = (int(value) for value in response.headers['X-Image-Size'].split(','))
+        image = Image.frombytes('RGB', (width, height), response.content)
+        output = BytesIO()
+        image.save(output, format='PNG', compress_level=1)
+        return output.getvalue(), 'image/png'
+    
+    # Older senders always returned PNG
+    return response.content, 'image/png'
+
+class _BackgroundBlobCopy:
+    """
+    Writes a stream's chunks to the screenshots blob store without blocking the stream
+    
+    All copies share one writer thread, so each blob's writes stay in order.
+    A capture id, if given, is told where the blob was stored (or that it
+    was not).
+    """
+    
+    def __init__(self, extension, capture_id=None):
+        self.extension = extension
+        self.capture_id = capture_id
+        self._writer = None
+        self._failed = False
+        _copy_writer.submit(self._run, self._open)
+    
+    def write(self, chunk):
+        _copy_writer.submit(self._run, self._write, chunk)
+    
+    def close(self, keep=True):
+        """Stores the blob, or discards it if the stream did not complete"""
+        _copy_writer.submit(self._run, self._close, keep)
+    
+    def _open(self):
+        self._writer = get_blob_store('screenshots').writer(self.extension)
+    
+    def _write(self, chunk):
+        if self._writer and not self._failed:
+            self._writer.write(chunk)
+    
+    def _close(self, keep):
+        path = None
+        try:
+            if not self._writer:
+                return
+            if keep and not self._failed:
+                path = self._writer.commit()
+                logger.info(f"Screenshot saved to {path}")
+            else:
+                self._writer.abort()
+        finally:
+            if self.capture_id:
+                capture_stored(self.capture_id, path)
+    
+    def _run(self, func, *args):
+        try:
+            func(*args)
+        except Exception as e:
+            if not self._failed:
+                logger.error(f"Error saving screenshot copy: {str(e)}")
+            self._failed = True
+
+def _tee_to_store(chunks, response, extension, capture_id=None):
+    """Yields chunks while copying them to the blob store, closing the sender response at the end"""
+    copy = _BackgroundBlobCopy(extension, capture_id)
+    complete = False
+    size = 0
+    try:
+        for chunk in chunks:
+            copy.write(chunk)
+            size += len(chunk)
+            yield chunk
+        complete = True
+    finally:
+        response.close()
+        copy.close(keep=complete)
+        if complete:
+            observe_bytes('capture', size)
+
+@reset_after_fork
+def _reset_executors():
+    """Gives a forked worker its own thread pools; the parent's threads are not copied"""
+    global _copy_writer, _fanout
+    _copy_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='screenshot-copy')
+    _fanout = ThreadPoolExecutor(max_workers=SENDER_FANOUT_WORKERS, thread_name_prefix='sender-fanout')
@@ -0,0 +1,83 @@
+"""
+Module for the registry of sender machines and the HTTP session shared by all of them.
+
+Senders are configured by name in SENDERS. Every request to a sender goes
+through one requests.Session whose connection pool keeps a few connections
+to each sender alive, so repeat captures skip the TCP handshake.
+"""
+import logging
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import SENDERS, SENDER_POOL_SIZE
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+def list_senders():
+    """
+    Returns every configured sender
+
+    Returns:
+        dict: Sender name -> base URL, the default sender first
+    """
+    return dict(SENDERS)
+
+def default_sender():
+    """Returns the name of the default (first configured) sender"""
+    return next(iter(SENDERS))
+
+def get_sender_url(name=None):
+    """
+    Returns a sender's base URL
+
+    Args:
+        name (str): Sender name (defaults to the first configured sender)
+
+    Returns:
+        str: Base URL such as http://192.168.1.100:5000
+
+    Raises:
+        KeyError: If no sender has that name
+    """
+    name = name or default_sender()
+    if name not in SENDERS:
+        raise KeyError(f"Unknown sender: {name}")
+    return SENDERS[name]
+
+def get_session():
+    """
+    Returns the HTTP session shared by all sender requests, creating it on first use
+
+    Returns:
+        requests.Session: Session with a keep-alive pool per sender
+    """
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                # One pool per sender host, each keeping SENDER_POOL_SIZE connections alive
+                adapter = HTTPAdapter(
+                    pool_connections=max(len(SENDERS), 1),
+                    pool_maxsize=SENDER_POOL_SIZE,
+                    max_retries=0
+                )
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                logger.info(f"Created sender session for {len(SENDERS)} sender(s)")
+                _session = session
+    return _session
+
+@reset_after_fork
+def _reset_session():
+    """Drops the pooled session in a forked worker so it opens its own connections"""
+    global _session, _session_lock
+    _session = None
+    _session_lock = threading.Lock()
@@ -0,0 +1,137 @@
+"""
+Module for parsing table JSON incrementally as it streams from the model.
+
+The model's response is a JSON object with a 'columns' array and a 'rows'
+array. Rather than waiting for the whole document, the parser scans each
+chunk once, tracking nesting and string state, and reports the columns as
+soon as their array closes and each row as soon as its object closes. Rows
+given as value lists before the columns are known are held back until then.
+"""
+import json
+
+class TableStreamParser:
+    """
+    Incremental parser emitting columns and rows from a partial JSON document
+
+    Usage:
+        parser = TableStreamParser()
+        for chunk in chunks:
+            for event in parser.feed(chunk):
+                ...  # ('columns', [...]) or ('row', {...})
+        text = parser.text  # the complete document
+    """
+
+    def __init__(self):
+        self.columns = None
+        self._buffer = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key_chars = None
+        self._last_string = None
+        self._key = None
+        self._array_key = None
+        self._capture = None
+        self._pending = []
+
+    @property
+    def text(self):
+        """Everything fed so far"""
+        return ''.join(self._buffer)
+
+    def feed(self, chunk):
+        """
+        Consumes the next piece of the response
+
+        Args:
+            chunk (str): Next text fragment
+
+        Returns:
+            list: Events completed by this chunk, as ('columns', list) or ('row', dict)
+        """
+        events = []
+        self._buffer.append(chunk)
+
+        for char in chunk:
+            # Characters of the columns array or the current row are collected as they pass
+            if self._capture is not None:
+                self._capture.append(char)
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                    if self._key_chars is not None:
+                        self._key_chars.append(char)
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._key_chars is not None:
+                        self._last_string = ''.join(self._key_chars)
+                        self._key_chars = None
+                elif self._key_chars is not None:
+                    self._key_chars.append(char)
+                continue
+
+            if char == '"':
+                self._in_string = True
+                if self._depth == 1:
+                    self._key_chars = []
+            elif char == ':' and self._depth == 1:
+                self._key = self._last_string
+            elif char in '{[':
+                self._depth += 1
+                if self._depth == 2 and char == '[' and self._key in ('columns', 'rows'):
+                    self._array_key = self._key
+                    if self._array_key == 'columns':
+                        self._capture = [char]
+                elif self._depth == 3 and self._array_key == 'rows':
+                    self._capture = [char]
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 2 and self._array_key == 'rows' and self._capture is not None:
+                    event = self._parse_row(''.join(self._capture))
+                    if event:
+                        events.append(event)
+                    self._capture = None
+                elif self._depth == 1 and self._array_key is not None:
+                    if self._array_key == 'columns':
+                        event = self._columns_event(''.join(self._capture))
+                        if event:
+                            events.append(event)
+                            events.extend(self._row_event(row) for row in self._pending)
+                            self._pending = []
+                        self._capture = None
+                    self._array_key = None
+
+        return events
+
+    def _columns_event(self, fragment):
+        try:
+            columns = json.loads(fragment)
+        except ValueError:
+            return None
+        if not isinstance(columns, list):
+            return None
+        self.columns = columns
+        return ('columns', columns)
+
+    def _parse_row(self, fragment):
+        try:
+            row = json.loads(fragment)
+        except ValueError:
+            return None
+        return self._row_event(row)
+
+    def _row_event(self, row):
+        # Rows given as value lists are keyed by the columns, once they are known
+        if isinstance(row, list):
+            if self.columns is None:
+                self._pending.append(row)
+                return None
+            row = dict(zip(self.columns, row))
+        if not isinstance(row, dict):
+            return None
+        for column in self.columns or ():
+            row.setdefault(column, None)
+        return ('row', row)
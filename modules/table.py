@@ -0,0 +1,256 @@
+"""
+Module for the columnar table representation used by exporters and stores.
+
+Extraction results travel as {'columns': [...], 'rows': [{column: value}]},
+which repeats every column name in every row. ColumnarTable holds the same
+table as one list of values per column, built in a single pass, together
+with a schema of inferred column types (numeric, percent, currency, date or
+text) so that typed formats such as Parquet and XLSX get real numbers and
+dates instead of strings.
+"""
+import re
+import logging
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+DTYPES = ('numeric', 'percent', 'currency', 'date', 'text')
+
+# Cell values read as empty when inferring and converting types
+EMPTY_VALUES = frozenset(('', '-', '–', '—', 'n/a', 'na', 'null', 'none'))
+
+# 1234, -1,234.5, 1.5e3; leading zeros ('007') mark codes, which stay text
+NUMBER_PATTERN = re.compile(r'^[+-]?((0|[1-9]\d{0,2}(,\d{3})+|[1-9]\d*)(\.\d+)?|\.\d+)([eE][+-]?\d+)?$')
+CURRENCY_SYMBOLS = '$€£¥₹'
+
+# Tried in order; a column is a date column only if every value parses with the same format
+DATE_FORMATS = (
+    '%Y-%m-%d', '%Y/%m/%d', '%m/%d/%Y', '%d.%m.%Y', '%d %b %Y', '%b %d, %Y', '%d %B %Y', '%B %d, %Y',
+    '%Y-%m-%d %H:%M', '%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'
+)
+
+def is_empty(value):
+    """Returns True if a cell holds no value"""
+    return value is None or (isinstance(value, str) and value.strip().lower() in EMPTY_VALUES)
+
+def parse_number(value):
+    """
+    Parses a plain number such as '1,234.5' or '(12)'
+
+    Returns:
+        float: The number, or None if the value is not a plain number
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip().replace(' ', '')
+    negative = text.startswith('(') and text.endswith(')')
+    if negative:
+        text = text[1:-1]
+    match = NUMBER_PATTERN.match(text)
+    if not match:
+        return None
+    number = float(text.replace(',', ''))
+    return -number if negative else number
+
+def parse_percent(value):
+    """Parses '12.5%' as 0.125, or returns None"""
+    text = str(value).strip()
+    if not text.endswith('%'):
+        return None
+    number = parse_number(text[:-1])
+    return None if number is None else number / 100
+
+def parse_currency(value):
+    """Parses '$1,234.50', '-€12' or '12 £' as a number, or returns None"""
+    text = str(value).strip()
+    sign = ''
+    if text.startswith(('+', '-')):
+        sign, text = text[0], text[1:].strip()
+    if text and text[0] in CURRENCY_SYMBOLS:
+        text = text[1:]
+    elif text and text[-1] in CURRENCY_SYMBOLS:
+        text = text[:-1]
+    else:
+        return None
+    return parse_number(sign + text.strip())
+
+def date_format(value):
+    """Returns the first DATE_FORMATS entry that parses value, or None"""
+    text = str(value).strip()
+    for fmt in DATE_FORMATS:
+        try:
+            datetime.strptime(text, fmt)
+            return fmt
+        except ValueError:
+            continue
+    return None
+
+def infer_dtype(values):
+    """
+    Infers a column's type from its values, ignoring empty cells
+
+    Args:
+        values (list): The column's cell values
+
+    Returns:
+        tuple: (dtype, date format or None), dtype being one of DTYPES
+    """
+    present = [value for value in values if not is_empty(value)]
+    if not present:
+        return 'text', None
+
+    for dtype, parse in (('numeric', parse_number), ('percent', parse_percent), ('currency', parse_currency)):
+        if all(parse(value) is not None for value in present):
+            return dtype, None
+
+    fmt = date_format(present[0])
+    if fmt and all(_parses(value, fmt) for value in present[1:]):
+        return 'date', fmt
+    return 'text', None
+
+def _parses(value, fmt):
+    try:
+        datetime.strptime(str(value).strip(), fmt)
+        return True
+    except ValueError:
+        return False
+
+class ColumnarTable:
+    """
+    A table stored as one list of values per column
+
+    Args:
+        columns (list): Column names in order
+        arrays (list): One list of cell values per column, all the same length
+    """
+
+    __slots__ = ('columns', 'arrays', '_schema')
+
+    def __init__(self, columns, arrays):
+        if len(columns) != len(arrays):
+            raise ValueError("Every column needs exactly one array of values")
+        self.columns = list(columns)
+        self.arrays = arrays
+        self._schema = None
+
+    @classmethod
+    def from_table_data(cls, table_data):
+        """
+        Builds a columnar table from row-oriented table data
+
+        Args:
+            table_data (dict): Table with 'columns' and 'rows' (dicts keyed by column)
+
+        Returns:
+            ColumnarTable: The same table, column by column
+        """
+        columns = list(table_data['columns'])
+        arrays = [[] for _ in columns]
+        appends = [array.append for array in arrays]
+        for row in table_data['rows']:
+            get = row.get
+            for column, append in zip(columns, appends):
+                append(get(column))
+        return cls(columns, arrays)
+
+    @classmethod
+    def concat(cls, tables):
+        """
+        Stacks tables with the same columns (later tables are matched by position)
+
+        Args:
+            tables (list): ColumnarTable objects, top to bottom
+
+        Returns:
+            ColumnarTable: One table holding every row
+        """
+        columns = list(tables[0].columns)
+        arrays = [[] for _ in columns]
+        for table in tables:
+            for index, array in enumerate(arrays):
+                if index < len(table.arrays):
+                    array.extend(table.arrays[index])
+                else:
+                    array.extend([None] * table.num_rows)
+        return cls(columns, arrays)
+
+    @property
+    def num_rows(self):
+        return len(self.arrays[0]) if self.arrays else 0
+
+    @property
+    def schema(self):
+        """
+        The inferred type of each column, computed on first use
+
+        Returns:
+            list: Dicts with 'name', 'dtype' and, for date columns, 'format'
+        """
+        if self._schema is None:
+            schema = []
+            for column, values in zip(self.columns, self.arrays):
+                dtype, fmt = infer_dtype(values)
+                field = {'name': column, 'dtype': dtype}
+                if fmt:
+                    field['format'] = fmt
+                schema.append(field)
+            self._schema = schema
+        return self._schema
+
+    def column(self, name):
+        """Returns a column's values by name"""
+        return self.arrays[self.columns.index(name)]
+
+    def typed_column(self, index):
+        """
+        Returns a column's values converted to its inferred type
+
+        Numeric, percent and currency columns become floats (ints where every
+        value is whole), date columns dates (or datetimes if they carry a
+        time), and empty cells None.
+
+        Args:
+            index (int): Column position
+
+        Returns:
+            list: Converted values
+        """
+        field = self.schema[index]
+        values = self.arrays[index]
+        dtype = field['dtype']
+        if dtype == 'text':
+            return [None if value is None else str(value) for value in values]
+        if dtype == 'date':
+            has_time = '%H' in field['format']
+            converted = []
+            for value in values:
+                if is_empty(value):
+                    converted.append(None)
+                    continue
+                parsed = datetime.strptime(str(value).strip(), field['format'])
+                converted.append(parsed if has_time else parsed.date())
+            return converted
+
+        parse = {'numeric': parse_number, 'percent': parse_percent, 'currency': parse_currency}[dtype]
+        converted = [None if is_empty(value) else parse(value) for value in values]
+        if dtype == 'numeric' and all(value is None or value.is_integer() for value in converted):
+            return [None if value is None else int(value) for value in converted]
+        return converted
+
+    def iter_rows(self):
+        """Yields each row as a tuple of values in column order"""
+        return zip(*self.arrays) if self.arrays else iter(())
+
+    def to_table_data(self):
+        """
+        Converts back to row-oriented table data
+
+        Returns:
+            dict: Table with 'columns' and 'rows'
+        """
+        return {
+            'columns': list(self.columns),
+            'rows': [dict(zip(self.columns, row)) for row in self.iter_rows()]
+        }
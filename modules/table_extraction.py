@@ -1,131 +1,197 @@
 """
 Module for extracting table data from images using OpenAI's Vision API.
+
+extract_table_with_backend() and stream_table_with_backend() route each image
+to a backend: the API, the local grid/OCR engine in modules.local_extraction,
+or the local engine first with the API as a fallback when its result is not
+confident enough.
 """
 import os
-import base64
 import json
+import math
 import logging
+from io import BytesIO
 
-from config import OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MAX_TOKENS
+from config import (
+    OPENAI_API_KEY, OPENAI_MODEL, OPENAI_MAX_TOKENS, EXTRACTION_BACKEND, LOCAL_MIN_CONFIDENCE
+)
+from modules.cache import get_extraction_cache, make_cache_key
+from modules.near_duplicate import get_near_duplicate_index, fingerprint_image
+from modules.image_processing import load_image_payload, get_image_dimensions
+from modules.local_extraction import get_local_engine
+from modules.openai_client import get_openai_client, response_content, record_model
+from modules.stream_parser import TableStreamParser
+from modules.metrics import span, timed, observe_bytes, CACHE_LOOKUPS
+from modules.profiling import profile_checkpoint
 
 logger = logging.getLogger(__name__)
 
-# Declare global variables
-global client, openai_module
+# Prompts sent with every extraction request (also part of the cache key)
+SYSTEM_PROMPT = (
+    "You are a data extraction assistant specialized in extracting tabular data from images. "
+    "Extract all data into a structured format with columns and rows."
+)
+USER_PROMPT = (
+    "Extract the table data from this image. Identify the column headers first, "
+    "then extract each row of data. Return the data as a JSON object with a 'columns' array "
+    "listing all column names, and a 'rows' array of objects where each object has keys "
+    "matching the column names and values from the table cells."
+)
 
-# Initialize OpenAI client with safeguards for version compatibility
-client = None
-openai_module = None
+EXTRACTION_BACKENDS = ('openai', 'local', 'auto')
 
-try:
-    # Try modern OpenAI client
-    from openai import OpenAI
-    try:
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        logger.info("Using modern OpenAI client")
-    except Exception as e:
-        # If there's an error, log it
-        logger.warning(f"Error initializing modern OpenAI client: {str(e)}")
-        client = None
-except ImportError:
-    logger.warning("Modern OpenAI client not available")
-
-# If modern client failed, try legacy approach
-if client is None:
-    try:
-        import openai as openai_module
-        openai_module.api_key = OPENAI_API_KEY
-        logger.info("Using legacy OpenAI module")
-    except ImportError:
-        logger.error("Neither modern nor legacy OpenAI client could be initialized")
-        # We'll handle this case in the extraction function
+# Cache namespace of local engine outcomes (the model and prompt parts of their cache key)
+LOCAL_CACHE_MODEL = 'local'
+LOCAL_CACHE_PROMPT = 'grid+ocr'
 
-def extract_table_from_image(image_path):
+def extract_table_with_backend(image, use_cache=True, backend=None, remote=None):
     """
-    Extracts table data from an image using OpenAI's Vision API
+    Extracts table data with the configured backend
+    
+    'openai' sends every image to the API, 'local' uses only the local engine,
+    and 'auto' tries the local engine first and falls back to the API when no
+    ruled grid is found or the result's confidence is below LOCAL_MIN_CONFIDENCE.
+    The local engine's outcome is cached too, so a repeat of an image the
+    engine declined goes straight to the API's cached result.
     
     Args:
-        image_path (str): Path to the image file
+        image: ImagePayload, encoded image bytes (bytes or memoryview) or path to an image file
+        use_cache (bool): Whether API extractions consult and populate the extraction cache
+        backend (str): 'openai', 'local' or 'auto' (defaults to EXTRACTION_BACKEND)
+        remote (callable): API extraction taking the ImagePayload, for callers that
+            tile or preprocess first (defaults to extract_table_from_image)
         
     Returns:
         tuple: (success, table_data_or_error)
             - If successful, returns (True, table data dict)
             - If failed, returns (False, error message)
     """
-    global client, openai_module
+    backend = (backend or EXTRACTION_BACKEND).lower()
+    if backend not in EXTRACTION_BACKENDS:
+        return False, f"Unknown extraction backend: {backend}"
+    
+    if isinstance(image, str) and not os.path.exists(image):
+        return False, f"Image file not found: {image}"
+    
+    payload = load_image_payload(image)
+    if backend != 'openai':
+        local = _extract_locally(payload, backend, use_cache)
+        if local is not None:
+            return local
+    
+    if remote is not None:
+        return remote(payload)
+    return extract_table_from_image(payload, use_cache=use_cache)
+
+def stream_table_with_backend(image, use_cache=True, backend=None, remote=None):
+    """
+    Streaming counterpart of extract_table_with_backend
+    
+    Local results are complete at once and are replayed as events; API
+    extractions stream as in stream_table_from_image.
+    
+    Args:
+        image: ImagePayload, encoded image bytes (bytes or memoryview) or path to an image file
+        use_cache (bool): Whether API extractions consult and populate the extraction cache
+        backend (str): 'openai', 'local' or 'auto' (defaults to EXTRACTION_BACKEND)
+        remote (callable): Takes the ImagePayload and yields API extraction events
+            (defaults to stream_table_from_image)
+        
+    Yields:
+        dict: Events as described in stream_table_from_image
+    """
+    backend = (backend or EXTRACTION_BACKEND).lower()
+    if backend not in EXTRACTION_BACKENDS:
+        yield {'type': 'error', 'error': f"Unknown extraction backend: {backend}"}
+        return
+    
+    if isinstance(image, str) and not os.path.exists(image):
+        yield {'type': 'error', 'error': f"Image file not found: {image}"}
+        return
+    
+    payload = load_image_payload(image)
+    if backend != 'openai':
+        local = _extract_locally(payload, backend, use_cache)
+        if local is not None:
+            success, result = local
+            if success:
+                yield from table_events(result)
+            else:
+                yield {'type': 'error', 'error': result}
+            return
+    
+    if remote is not None:
+        yield from remote(payload)
+    else:
+        yield from stream_table_from_image(payload, use_cache=use_cache)
+
+def extract_table_from_image(image, use_cache=True, near_duplicates=True):
+    """
+    Extracts table data from an image using OpenAI's Vision API
     
+    Args:
+        image: ImagePayload, encoded image bytes (bytes or memoryview) or path to an image file
+        use_cache (bool): Whether to consult and populate the extraction cache
+        near_duplicates (bool): Whether a near-duplicate of an earlier image may answer
+            from that image's result; False limits the lookup to the exact cache
+        
+    Returns:
+        tuple: (success, table_data_or_error)
+            - If successful, returns (True, table data dict)
+            - If failed, returns (False, error message)
+    """
     try:
         # Validate inputs
         if not OPENAI_API_KEY:
             return False, "OpenAI API key is not configured. Please set OPENAI_API_KEY in config."
             
-        if not os.path.exists(image_path):
-            return False, f"Image file not found: {image_path}"
-        
-        # Read image file
-        with open(image_path, "rb") as image_file:
-            # Get base64 encoded image
-            image_data = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        # Create the prompt
-        prompt = [
-            {"role": "system", "content": (
-                "You are a data extraction assistant specialized in extracting tabular data from images. "
-                "Extract all data into a structured format with columns and rows."
-            )},
-            {"role": "user", "content": [
-                {"type": "text", "text": (
-                    "Extract the table data from this image. Identify the column headers first, "
-                    "then extract each row of data. Return the data as a JSON object with a 'columns' array "
-                    "listing all column names, and a 'rows' array of objects where each object has keys "
-                    "matching the column names and values from the table cells."
-                )},
-                {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{image_data}"}}
-            ]}
-        ]
+        if isinstance(image, str) and not os.path.exists(image):
+            return False, f"Image file not found: {image}"
+        
+        # Work on the image in memory; PNG/JPEG bytes are forwarded unchanged
+        payload = load_image_payload(image)
+        
+        with span('cache_lookup'):
+            cached, cache_state = _lookup_cached_result(payload, use_cache, near_duplicates)
+        if cached is not None:
+            record_model(OPENAI_MODEL)
+            return True, cached
         
         logger.info("Sending request to OpenAI API for table extraction")
         
+        api = get_openai_client()
+        if api is None:
+            return False, "No OpenAI client available. Please check your installation."
+        
+        messages = _build_prompt(payload)
+        # The image bytes, their base64 text and the prompt are all alive here
+        profile_checkpoint('prompt_built')
         content = None
-        # Try using the appropriate client method
-        if client:
-            # Modern client method
-            try:
-                response = client.chat.completions.create(
+        try:
+            with span('openai_request', model=OPENAI_MODEL):
+                response = api.chat_completion(
                     model=OPENAI_MODEL,
-                    messages=prompt,
+                    messages=messages,
                     max_tokens=OPENAI_MAX_TOKENS,
-                    response_format={"type": "json_object"}
+                    response_format={"type": "json_object"},
+                    estimated_tokens=OPENAI_MAX_TOKENS + estimate_image_tokens(payload)
                 )
-                content = response.choices[0].message.content
-            except Exception as e:
-                logger.error(f"Error with modern OpenAI client: {str(e)}")
-                # Fall back to legacy approach if modern fails
-                client = None
-        
-        # If modern client failed or wasn't available, try legacy
-        if client is None:
-            if openai_module:
-                try:
-                    response = openai_module.ChatCompletion.create(
-                        model=OPENAI_MODEL,
-                        messages=prompt,
-                        max_tokens=OPENAI_MAX_TOKENS,
-                        response_format={"type": "json_object"}
-                    )
-                    content = response['choices'][0]['message']['content']
-                except Exception as e:
-                    return False, f"Error with legacy OpenAI client: {str(e)}"
-            else:
-                return False, "No OpenAI client available. Please check your installation."
+            content = response_content(response)
+        except Exception as e:
+            error_msg = f"Error calling OpenAI API: {str(e)}"
+            logger.error(error_msg)
+            return False, error_msg
         
         # Parse the response as JSON
         if content:
-            table_data = json.loads(content)
+            with span('parse_json', bytes=len(content)):
+                table_data = json.loads(content)
             logger.info("Received table data from OpenAI API")
             
             # Validate and normalize the response structure
             validated_data = _validate_and_normalize_table_data(table_data)
+            with span('cache_store'):
+                _store_result(cache_state, validated_data)
             
             return True, validated_data
         else:
@@ -141,6 +207,216 @@ def extract_table_from_image(image_path):
         logger.error(error_msg)
         return False, error_msg
 
+def stream_table_from_image(image, use_cache=True, near_duplicates=True):
+    """
+    Extracts table data from an image, yielding columns and rows as the model produces them
+    
+    Args:
+        image: ImagePayload, encoded image bytes (bytes or memoryview) or path to an image file
+        use_cache (bool): Whether to consult and populate the extraction cache
+        near_duplicates (bool): Whether a near-duplicate of an earlier image may answer
+            from that image's result; False limits the lookup to the exact cache
+        
+    Yields:
+        dict: Events, each with a 'type' of:
+            - 'columns': {'columns': [...]} once the header is known
+            - 'row': {'row': {...}} for each completed row
+            - 'done': {'table_data': {...}} with the complete, normalized table
+            - 'error': {'error': message}; no further events follow
+    """
+    try:
+        if not OPENAI_API_KEY:
+            yield {'type': 'error', 'error': "OpenAI API key is not configured. Please set OPENAI_API_KEY in config."}
+            return
+        
+        if isinstance(image, str) and not os.path.exists(image):
+            yield {'type': 'error', 'error': f"Image file not found: {image}"}
+            return
+        
+        payload = load_image_payload(image)
+        
+        with span('cache_lookup'):
+            cached, cache_state = _lookup_cached_result(payload, use_cache, near_duplicates)
+        if cached is not None:
+            record_model(OPENAI_MODEL)
+            yield from table_events(cached)
+            return
+        
+        api = get_openai_client()
+        if api is None:
+            yield {'type': 'error', 'error': "No OpenAI client available. Please check your installation."}
+            return
+        
+        logger.info("Streaming request to OpenAI API for table extraction")
+        
+        messages = _build_prompt(payload)
+        profile_checkpoint('prompt_built')
+        parser = TableStreamParser()
+        with span('openai_stream', model=OPENAI_MODEL):
+            for text in api.chat_completion_stream(
+                model=OPENAI_MODEL,
+                messages=messages,
+                max_tokens=OPENAI_MAX_TOKENS,
+                response_format={"type": "json_object"},
+                estimated_tokens=OPENAI_MAX_TOKENS + estimate_image_tokens(payload)
+            ):
+                for kind, value in parser.feed(text):
+                    yield {'type': kind, kind: value}
+        
+        # The full document is still validated, covering shapes the parser can't stream
+        content = parser.text
+        if not content:
+            yield {'type': 'error', 'error': "No content received from OpenAI API"}
+            return
+        
+        try:
+            with span('parse_json', bytes=len(content)):
+                table_data = json.loads(content)
+            validated_data = _validate_and_normalize_table_data(table_data)
+        except ValueError as e:
+            error_msg = f"Error parsing JSON response from OpenAI: {str(e)}\nResponse content: {content}"
+            logger.error(error_msg)
+            yield {'type': 'error', 'error': error_msg}
+            return
+        
+        with span('cache_store'):
+            _store_result(cache_state, validated_data)
+        logger.info("Received streamed table data from OpenAI API")
+        yield {'type': 'done', 'table_data': validated_data}
+        
+    except Exception as e:
+        error_msg = f"Error extracting table from image: {str(e)}"
+        logger.error(error_msg)
+        yield {'type': 'error', 'error': error_msg}
+
+def table_events(table_data):
+    """
+    Replays complete table data as the event sequence of stream_table_from_image
+    
+    Args:
+        table_data (dict): Table data with 'columns' and 'rows'
+        
+    Yields:
+        dict: 'columns', one 'row' per row, then 'done'
+    """
+    yield {'type': 'columns', 'columns': table_data['columns']}
+    for row in table_data['rows']:
+        yield {'type': 'row', 'row': row}
+    yield {'type': 'done', 'table_data': table_data}
+
+def _extract_locally(payload, backend, use_cache=True):
+    """
+    Runs the local engine for the 'local' and 'auto' backends
+    
+    Returns:
+        tuple: (success, table_data_or_error), or None when the API should extract the image
+    """
+    engine = get_local_engine()
+    if engine is None:
+        if backend == 'local':
+            return False, "Local extraction engine is not available. Please install Tesseract and pytesseract."
+        return None
+    
+    success, result = _local_outcome(engine, payload, use_cache)
+    if not success:
+        if backend == 'local':
+            return False, result
+        logger.info(f"Local engine declined ({result}), using OpenAI API")
+        return None
+    
+    if backend == 'auto' and result['confidence'] < LOCAL_MIN_CONFIDENCE:
+        logger.info(
+            f"Local result confidence {result['confidence']} below {LOCAL_MIN_CONFIDENCE}, using OpenAI API"
+        )
+        return None
+    
+    logger.info(f"Extracted table locally with confidence {result['confidence']}")
+    record_model('local')
+    return True, result['table_data']
+
+def _local_outcome(engine, payload, use_cache):
+    """
+    Returns the local engine's (success, result_or_error) for an image, cached by its bytes
+    
+    Failures are cached as well: a declined image is declined again, and
+    caching that skips the grid and OCR passes on every repeat.
+    """
+    cache = get_extraction_cache() if use_cache else None
+    key = make_cache_key(payload.data, LOCAL_CACHE_MODEL, LOCAL_CACHE_PROMPT, 0) if cache else None
+    if cache:
+        cached = cache.get(key)
+        if cached is not None:
+            return cached['success'], cached['result']
+    
+    with span('local_extract'):
+        success, result = engine.extract(payload)
+    if cache:
+        cache.set(key, {'success': success, 'result': result})
+    return success, result
+
+@timed('encode_prompt')
+def _build_prompt(payload):
+    """Builds the chat messages asking the model to extract the table in an image"""
+    observe_bytes('api_image', len(payload.data))
+    return [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": [
+            {"type": "text", "text": USER_PROMPT},
+            {"type": "image_url", "image_url": {"url": payload.to_data_url()}}
+        ]}
+    ]
+
+def _lookup_cached_result(payload, use_cache, near_duplicates=True):
+    """
+    Looks for an earlier result for the same or a near-duplicate image
+    
+    Returns:
+        tuple: (table_data or None, cache state to pass to _store_result)
+    """
+    state = {'cache': None, 'cache_key': None, 'near_index': None, 'namespace': None, 'fingerprint': None}
+    if not use_cache:
+        CACHE_LOOKUPS.inc('bypass')
+        return None, state
+    
+    fingerprint = SYSTEM_PROMPT + USER_PROMPT
+    
+    # Serve repeat extractions of identical content from the cache
+    cache = get_extraction_cache()
+    if cache:
+        state['cache'] = cache
+        state['cache_key'] = make_cache_key(payload.data, OPENAI_MODEL, fingerprint, OPENAI_MAX_TOKENS)
+        cached = cache.get(state['cache_key'])
+        if cached is not None:
+            logger.info(f"Extraction cache hit for {state['cache_key'][:12]}")
+            CACHE_LOOKUPS.inc('hit')
+            return cached, state
+    
+    # Fall back to a perceptual match against earlier, slightly different crops
+    near_index = get_near_duplicate_index() if near_duplicates else None
+    if near_index:
+        state['near_index'] = near_index
+        state['fingerprint'] = fingerprint_image(payload.data)
+        state['namespace'] = make_cache_key(b'', OPENAI_MODEL, fingerprint, OPENAI_MAX_TOKENS)
+        if state['fingerprint'] is not None:
+            match = near_index.lookup(state['namespace'], state['fingerprint'])
+            if match is not None:
+                # Not copied into the exact cache: this image's bytes were never extracted
+                table_data, distance = match
+                logger.info(f"Near-duplicate match at Hamming distance {distance}")
+                CACHE_LOOKUPS.inc('near_hit')
+                return table_data, state
+    
+    CACHE_LOOKUPS.inc('miss')
+    return None, state
+
+def _store_result(state, table_data):
+    """Records a fresh extraction in the cache and the near-duplicate index"""
+    if state['cache']:
+        state['cache'].set(state['cache_key'], table_data)
+    if state['near_index'] and state['fingerprint'] is not None:
+        state['near_index'].add(state['namespace'], state['fingerprint'], table_data)
+
+@timed('validate')
 def _validate_and_normalize_table_data(table_data):
     """
     Validates and normalizes table data structure
@@ -207,4 +483,28 @@ def _validate_rows_match_columns(table_data):
             if column not in row:
                 row[column] = None
                 
-    return table_data
\ No newline at end of file
+    return table_data
+
+def estimate_image_tokens(payload):
+    """
+    Estimates the prompt tokens an image costs at high detail
+    
+    The model fits the image within 2048x2048, scales the short side to 768
+    and charges 170 tokens per 512px tile plus a fixed 85.
+    
+    Args:
+        payload (ImagePayload): Image to estimate
+        
+    Returns:
+        int: Estimated prompt tokens
+    """
+    dimensions = get_image_dimensions(BytesIO(payload.data))
+    if not dimensions:
+        return 1105  # a typical 2x2-tile image
+    width, height = dimensions
+    scale = min(1.0, 2048 / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, 768 / min(width, height))
+    width, height = width * scale, height * scale
+    tiles = math.ceil(width / 512) * math.ceil(height / 512)
+    return 85 + 170 * tiles
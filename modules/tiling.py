@@ -0,0 +1,279 @@
+"""
+Module for extracting very tall tables in overlapping horizontal bands.
+
+Long scrolling tables exceed both the resolution the vision model looks at
+and the response token limit. Tall images are cut into bands, preferably
+along blank gutters between rows, and each band is extracted concurrently
+with the table header pasted on top. The band results are then merged into
+one table with the rows repeated in overlapping regions removed; the rows
+each overlap holds are counted from the image, so a run of genuinely
+identical rows is never taken for repeats beyond that count.
+"""
+import logging
+import contextvars
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageFilter
+
+from config import (
+    TILING_ENABLED, TILE_TRIGGER_ASPECT, TILE_BAND_HEIGHT, TILE_OVERLAP,
+    TILE_MAX_CONCURRENCY
+)
+from modules.image_processing import ImagePayload, preprocess_image
+from modules.table_extraction import extract_table_from_image, _validate_and_normalize_table_data
+from modules.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Fraction of the band height searched either side of an ideal cut for a gutter
+GUTTER_SEARCH_FRACTION = 0.2
+
+# Most rows a band overlap can plausibly repeat, when they could not be counted
+MAX_OVERLAP_ROWS = 10
+
+# Fraction of the way from the quietest to the busiest row below which a row is a gutter
+GUTTER_LEVEL = 0.05
+
+def should_tile(payload):
+    """
+    Decides whether an image is tall enough to need tiled extraction
+
+    Args:
+        payload (ImagePayload): Image to check
+
+    Returns:
+        bool: True if the image should be extracted in bands
+    """
+    if not TILING_ENABLED:
+        return False
+
+    try:
+        with Image.open(BytesIO(payload.data)) as img:
+            width, height = img.size
+    except Exception as e:
+        logger.error(f"Error reading image size for tiling: {str(e)}")
+        return False
+
+    return height > TILE_BAND_HEIGHT + TILE_OVERLAP and height / width >= TILE_TRIGGER_ASPECT
+
+@timed('split_bands')
+def split_into_bands(payload, band_height=None, overlap=None):
+    """
+    Splits a tall image into overlapping bands cut along row gutters
+
+    Every band after the first gets the table header strip pasted above it
+    so the model sees the same column names in each band. Each overlap starts
+    at a gutter, and the rows it holds are counted so that merging drops no
+    more than that many.
+
+    Args:
+        payload (ImagePayload): Image to split
+        band_height (int): Target height of each band in pixels
+        overlap (int): Pixels each band repeats from the previous one
+
+    Returns:
+        tuple: (bands, overlap_rows)
+            - bands: ImagePayload objects, one per band, top to bottom
+            - overlap_rows: Rows each band repeats from the previous one (0 for the first)
+    """
+    band_height = band_height or TILE_BAND_HEIGHT
+    overlap = TILE_OVERLAP if overlap is None else overlap
+
+    with Image.open(BytesIO(payload.data)) as img:
+        img.load()
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+
+    energy = _row_energy(img)
+    cuts = _choose_cuts(energy, band_height)
+    header_height = _detect_header_height(energy, cuts[1] if len(cuts) > 1 else img.height)
+    header = img.crop((0, 0, img.width, header_height)) if header_height else None
+
+    bands = []
+    overlap_rows = []
+    for index, (top, bottom) in enumerate(zip(cuts, cuts[1:])):
+        start, rows = _band_start(energy, top, overlap) if index else (0, 0)
+        overlap_rows.append(rows)
+        band = img.crop((0, start, img.width, bottom))
+        if index and header is not None:
+            stacked = Image.new(img.mode, (img.width, header.height + band.height), 'white')
+            stacked.paste(header, (0, 0))
+            stacked.paste(band, (0, header.height))
+            band = stacked
+
+        # Bands are re-encoded by preprocessing, so favour speed here
+        output = BytesIO()
+        band.save(output, format='PNG', compress_level=1)
+        bands.append(ImagePayload(output.getvalue(), 'image/png'))
+
+    logger.info(f"Split {img.width}x{img.height} image into {len(bands)} bands at rows {cuts[1:-1]}")
+    return bands, overlap_rows
+
+@timed('merge_bands')
+def merge_band_tables(tables, overlap_rows=None):
+    """
+    Merges per-band table data into a single table
+
+    Columns come from the first band; later bands are mapped onto them by
+    position. Header rows repeated in a band and rows duplicated by the band
+    overlap are dropped.
+
+    Args:
+        tables (list): Table data dicts with 'columns' and 'rows', top to bottom
+        overlap_rows (list): Most rows each band can repeat from the previous one
+            (None entries, or no list, allow up to MAX_OVERLAP_ROWS)
+
+    Returns:
+        dict: Merged table data with 'columns' and 'rows'
+    """
+    columns = list(tables[0]['columns'])
+    header_key = _row_key(columns)
+    merged = []
+
+    for index, table in enumerate(tables):
+        limit = overlap_rows[index] if overlap_rows else None
+        limit = MAX_OVERLAP_ROWS if limit is None else min(limit, MAX_OVERLAP_ROWS)
+        band_columns = table['columns']
+        band_rows = []
+        for row in table['rows']:
+            values = [row.get(column) for column in band_columns]
+            values = (values + [None] * len(columns))[:len(columns)]
+            if _row_key(values) == header_key:
+                continue
+            band_rows.append(dict(zip(columns, values)))
+
+        # Drop the longest run at the start of this band that repeats the end of the last one
+        overlap = 0
+        for size in range(min(len(merged), len(band_rows), limit), 0, -1):
+            tail = [_row_key(row.values()) for row in merged[-size:]]
+            head = [_row_key(row.values()) for row in band_rows[:size]]
+            if tail == head:
+                overlap = size
+                break
+        merged.extend(band_rows[overlap:])
+
+    return {'columns': columns, 'rows': merged}
+
+def extract_table_tiled(payload, use_cache=True, band_height=None, overlap=None):
+    """
+    Extracts a tall table by extracting its bands concurrently and merging them
+
+    Args:
+        payload (ImagePayload): Full-resolution image of the table
+        use_cache (bool): Whether band extractions may use the extraction cache; bands
+            only use exact matches, as neighbouring bands of a regular table look alike
+        band_height (int): Target height of each band in pixels
+        overlap (int): Pixels each band repeats from the previous one
+
+    Returns:
+        tuple: (success, table_data_or_error)
+            - If successful, returns (True, merged table data dict)
+            - If failed, returns (False, error message)
+    """
+    try:
+        bands, overlap_rows = split_into_bands(payload, band_height, overlap)
+
+        def extract_band(band):
+            band, _ = preprocess_image(band)
+            return extract_table_from_image(band, use_cache=use_cache, near_duplicates=False)
+
+        # Wall-clock time tracks the slowest band rather than the sum of all bands;
+        # each band runs in a copy of this context so its API usage is tracked with the caller's
+        context = contextvars.copy_context()
+        with ThreadPoolExecutor(max_workers=min(TILE_MAX_CONCURRENCY, len(bands))) as executor:
+            futures = [executor.submit(context.copy().run, extract_band, band) for band in bands]
+            results = [future.result() for future in futures]
+
+        failures = [result for success, result in results if not success]
+        if failures:
+            return False, f"Failed to extract {len(failures)} of {len(bands)} bands: {failures[0]}"
+
+        kept = [index for index, (_, result) in enumerate(results) if result.get('columns')]
+        if not kept:
+            return False, "No table data found in any band"
+
+        # A band only repeats rows of the band just above it, so none after a skipped band
+        tables = [results[index][1] for index in kept]
+        limits = [
+            overlap_rows[index] if position and kept[position - 1] == index - 1 else 0
+            for position, index in enumerate(kept)
+        ]
+        merged = _validate_and_normalize_table_data(merge_band_tables(tables, limits))
+        logger.info(f"Merged {len(bands)} bands into {len(merged['rows'])} rows")
+        return True, merged
+
+    except Exception as e:
+        error_msg = f"Error during tiled extraction: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+def _row_energy(img):
+    """Returns the mean horizontal gradient of each pixel row (text is high, gutters near zero)"""
+    gray = img.convert('L')
+    rows = []
+    # Kernels clip negative responses, so rising and falling edges are filtered separately
+    for weights in ([0, 0, 0, -1, 0, 1, 0, 0, 0], [0, 0, 0, 1, 0, -1, 0, 0, 0]):
+        edges = gray.filter(ImageFilter.Kernel((3, 3), weights, 1))
+        # The filter leaves the outermost pixels unfiltered, so drop them
+        edges = edges.crop((1, 1, gray.width - 1, gray.height - 1)).convert('F')
+        # Averaging each row down to a single pixel computes the row means in C
+        rows.append(edges.resize((1, edges.height), Image.BOX).getdata())
+    return [0.0] + [rising + falling for rising, falling in zip(*rows)] + [0.0]
+
+def _choose_cuts(energy, band_height):
+    """Picks band boundaries near multiples of band_height, snapped to the quietest row"""
+    height = len(energy)
+    window = max(1, int(band_height * GUTTER_SEARCH_FRACTION))
+    cuts = [0]
+    while height - cuts[-1] > band_height + window:
+        ideal = cuts[-1] + band_height
+        low, high = ideal - window, min(ideal + window, height - 1)
+        # Prefer the quietest row, and among equals the one closest to the ideal cut
+        cut = min(range(low, high + 1), key=lambda y: (energy[y], abs(y - ideal)))
+        cuts.append(cut)
+    cuts.append(height)
+    return cuts
+
+def _band_start(energy, top, overlap):
+    """
+    Picks where a band starting at cut `top` begins, and counts the rows it repeats
+
+    The band starts at the first gutter within `overlap` pixels above the cut,
+    so it repeats only whole rows. Rows are runs of busy pixel rows between
+    gutters; a row cut by the band's top edge counts as one.
+
+    Returns:
+        tuple: (first pixel row of the band, rows between it and the cut)
+    """
+    low = max(top - overlap, 0)
+    window = energy[low:top]
+    if not window:
+        return top, 0
+    quiet = min(window) + (max(energy) - min(window)) * GUTTER_LEVEL
+    start = next(y for y in range(low, top) if energy[y] <= quiet)
+
+    rows = 0
+    previous_quiet = True
+    for value in energy[start:top]:
+        busy = value > quiet
+        if busy and previous_quiet:
+            rows += 1
+        previous_quiet = not busy
+    return start, rows
+
+def _detect_header_height(energy, limit):
+    """Returns the height of the first block of content (the header) ending at a gutter"""
+    if not energy:
+        return 0
+    threshold = max(energy) * 0.05
+    y = 0
+    while y < limit and energy[y] <= threshold:
+        y += 1
+    while y < limit and energy[y] > threshold:
+        y += 1
+    # No gutter before the first cut means no distinct header strip
+    return y if y < limit // 2 else 0
+
+def _row_key(values):
+    return tuple('' if value is None else str(value).strip().lower() for value in values)
@@ -0,0 +1,167 @@
+"""
+Module for storing the tables extracted by scheduled captures as time series.
+
+Each extracted table is stored column by column: one record per column per
+capture, holding that column's values as a JSON array. Reading one column's
+history (say, a price over a week) is then a single index range scan that
+never touches the other columns, and the column name is stored once per
+capture instead of once per cell.
+"""
+import os
+import json
+import sqlite3
+import logging
+import threading
+
+from config import TIMESERIES_PATH
+from modules.table import ColumnarTable
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+_store = None
+_store_lock = threading.Lock()
+
+class TimeSeriesStore:
+    """
+    Append-only store of extracted tables keyed by schedule and capture time
+
+    Args:
+        path (str): SQLite database file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # Readers (API requests) never wait for the scheduler's writes
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS samples ("
+            "schedule_id TEXT NOT NULL, "
+            "captured_at REAL NOT NULL, "
+            "position INTEGER NOT NULL, "
+            "column_name TEXT NOT NULL, "
+            "column_values TEXT NOT NULL, "
+            "PRIMARY KEY (schedule_id, column_name, captured_at))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_samples_captured_at ON samples (schedule_id, captured_at)"
+        )
+        self._conn.commit()
+
+    def append(self, schedule_id, captured_at, table_data):
+        """
+        Stores one extracted table
+
+        Args:
+            schedule_id (str): Schedule that captured the table
+            captured_at (float): Capture time as a Unix timestamp
+            table_data (dict): Table with 'columns' and 'rows'
+        """
+        table = ColumnarTable.from_table_data(table_data)
+        records = [
+            (schedule_id, captured_at, position, column, json.dumps(values))
+            for position, (column, values) in enumerate(zip(table.columns, table.arrays))
+        ]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO samples "
+                "(schedule_id, captured_at, position, column_name, column_values) VALUES (?, ?, ?, ?, ?)",
+                records
+            )
+            self._conn.commit()
+
+    def query(self, schedule_id, columns=None, since=None, until=None, limit=100):
+        """
+        Returns a schedule's stored tables, newest first
+
+        Args:
+            schedule_id (str): Schedule to read
+            columns (list): Column names to return (defaults to all)
+            since (float): Earliest capture time to include
+            until (float): Latest capture time to include
+            limit (int): Maximum number of captures to return
+
+        Returns:
+            list: Dicts with 'captured_at' and 'columns' (column name -> list of values)
+        """
+        conditions = ["schedule_id = ?"]
+        params = [schedule_id]
+        if since is not None:
+            conditions.append("captured_at >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("captured_at <= ?")
+            params.append(until)
+        where = " AND ".join(conditions)
+
+        with self._lock:
+            times = [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT captured_at FROM samples WHERE {where} "
+                "ORDER BY captured_at DESC LIMIT ?",
+                params + [limit]
+            )]
+            if not times:
+                return []
+
+            sql = (
+                "SELECT captured_at, column_name, column_values FROM samples "
+                "WHERE schedule_id = ? AND captured_at BETWEEN ? AND ?"
+            )
+            sample_params = [schedule_id, times[-1], times[0]]
+            if columns:
+                sql += f" AND column_name IN ({', '.join('?' * len(columns))})"
+                sample_params += list(columns)
+            rows = self._conn.execute(sql + " ORDER BY captured_at DESC, position", sample_params).fetchall()
+
+        samples = {captured_at: {'captured_at': captured_at, 'columns': {}} for captured_at in times}
+        for captured_at, column, values in rows:
+            samples[captured_at]['columns'][column] = json.loads(values)
+        return [samples[captured_at] for captured_at in times]
+
+    def delete(self, schedule_id):
+        """
+        Removes every table stored for a schedule
+
+        Args:
+            schedule_id (str): Schedule to clear
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM samples WHERE schedule_id = ?", (schedule_id,))
+            self._conn.commit()
+
+    def count(self, schedule_id):
+        """Returns how many captures are stored for a schedule"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(DISTINCT captured_at) FROM samples WHERE schedule_id = ?", (schedule_id,)
+            ).fetchone()[0]
+
+def get_timeseries_store():
+    """
+    Returns the shared time-series store, creating it on first use
+
+    Returns:
+        TimeSeriesStore: The store
+    """
+    global _store
+
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = TimeSeriesStore(TIMESERIES_PATH)
+                logger.info(f"Time-series store opened at {TIMESERIES_PATH}")
+    return _store
+
+@reset_after_fork
+def _reset_store():
+    """Forgets the store in a forked worker; SQLite connections must not cross a fork"""
+    global _store, _store_lock
+    _store = None
+    _store_lock = threading.Lock()
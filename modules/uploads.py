@@ -0,0 +1,212 @@
+"""
+Module for images uploaded once and referenced by handle afterwards.
+
+An image is uploaded as raw bytes (or cut by the server from a capture it
+already holds) and stored in the 'uploads' blob store. Its handle, the
+image_id, is the SHA-256 of the stored bytes, so the same crop uploaded
+twice gets the same handle. Extraction, saving and download then take the
+image_id instead of a base64 copy of the image in every JSON body.
+
+Captures streamed to the browser are given a capture id before their bytes
+are sent. Once the background copy of the capture is stored, a crop
+rectangle is enough to cut the image here without the browser uploading it.
+Capture ids are kept in memory, so they are only known to the process that
+served the capture. Callers fall back to uploading the crop when one is not.
+"""
+import os
+import re
+import uuid
+import logging
+import threading
+from io import BytesIO
+from collections import OrderedDict
+
+from PIL import Image
+
+from config import UPLOAD_MAX_MB, CAPTURE_STORE_WAIT
+from modules.blob_store import get_blob_store
+from modules.image_processing import ImagePayload, sniff_image_type, load_image_payload
+from modules.metrics import span, observe_bytes
+from modules.utils import reset_after_fork
+
+logger = logging.getLogger(__name__)
+
+# Largest upload accepted, in bytes
+MAX_UPLOAD_BYTES = int(UPLOAD_MAX_MB * 1024 * 1024)
+
+# Captures whose stored copy can be looked up by capture id, most recent last
+MAX_CAPTURES = 64
+
+IMAGE_ID_PATTERN = re.compile(r'[0-9a-f]{64}')
+
+_captures = OrderedDict()
+_captures_lock = threading.Lock()
+
+class _Capture:
+    """Where a capture's background copy was stored, once it is"""
+
+    __slots__ = ('stored', 'path')
+
+    def __init__(self):
+        self.stored = threading.Event()
+        self.path = None
+
+def register_capture():
+    """
+    Assigns an id to a capture that is about to be stored
+
+    Returns:
+        str: The capture id, to pass to capture_stored() once the copy is written
+    """
+    capture_id = uuid.uuid4().hex
+    with _captures_lock:
+        _captures[capture_id] = _Capture()
+        while len(_captures) > MAX_CAPTURES:
+            _captures.popitem(last=False)
+    return capture_id
+
+def capture_stored(capture_id, path):
+    """
+    Records where a capture was stored
+
+    Args:
+        capture_id (str): Id from register_capture()
+        path (str): Path of the stored capture, or None if it could not be stored
+    """
+    with _captures_lock:
+        capture = _captures.get(capture_id)
+    if capture is not None:
+        capture.path = path
+        capture.stored.set()
+
+def store_upload(data):
+    """
+    Stores uploaded image bytes in the uploads blob store
+
+    PNG and JPEG are stored as they are; other formats Pillow can read are
+    converted to PNG first.
+
+    Args:
+        data (bytes): Encoded image data
+
+    Returns:
+        tuple: (success, image_id_or_error)
+    """
+    if not data:
+        return False, "No image data provided"
+    if len(data) > MAX_UPLOAD_BYTES:
+        return False, f"Image is larger than {UPLOAD_MAX_MB:g} MB"
+
+    store = get_blob_store('uploads')
+    if store is None:
+        return False, "Image uploads are disabled (UPLOADS_DIR is empty)"
+
+    try:
+        observe_bytes('upload', len(data))
+        payload = load_image_payload(bytes(data))
+        with span('save_image', store='uploads', bytes=len(payload.data)):
+            path = store.put(payload.data, _extension(payload))
+        return True, _image_id(path)
+    except Exception as e:
+        error_msg = f"Error storing uploaded image: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+def crop_capture(capture_id, crop):
+    """
+    Cuts a crop out of a stored capture and stores it as an upload
+
+    Args:
+        capture_id (str): Id the capture was served with (X-Capture-Id)
+        crop (dict): Rectangle in the capture's pixels, as reported by
+            Cropper.js getData(): x, y, width and height, and optionally
+            rotate, scaleX and scaleY
+
+    Returns:
+        tuple: (success, image_id_or_error)
+    """
+    with _captures_lock:
+        capture = _captures.get(capture_id)
+    if capture is None:
+        return False, f"Unknown capture: {capture_id}"
+    # The capture's last bytes may still be on their way to the store
+    if not capture.stored.wait(CAPTURE_STORE_WAIT) or capture.path is None:
+        return False, f"Capture {capture_id} was not stored"
+
+    try:
+        if float(crop.get('rotate') or 0) != 0 or float(crop.get('scaleX', 1)) != 1 \
+                or float(crop.get('scaleY', 1)) != 1:
+            return False, "Rotated or flipped crops can't be cut from the capture"
+        left, top = round(float(crop['x'])), round(float(crop['y']))
+        width, height = round(float(crop['width'])), round(float(crop['height']))
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return False, "Crop needs numeric x, y, width and height"
+
+    try:
+        with span('crop_capture'):
+            with Image.open(capture.path) as img:
+                box = (max(0, left), max(0, top), min(img.width, left + width), min(img.height, top + height))
+                if box[2] <= box[0] or box[3] <= box[1]:
+                    return False, "Crop lies outside the capture"
+                output = BytesIO()
+                # Preprocessing re-encodes compactly for the API, so this favours speed
+                img.crop(box).save(output, format='PNG', compress_level=1)
+        return store_upload(output.getvalue())
+    except Exception as e:
+        error_msg = f"Error cropping capture {capture_id}: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+
+def upload_path(image_id):
+    """
+    Returns the path of an uploaded image
+
+    Args:
+        image_id (str): Handle returned when the image was stored
+
+    Returns:
+        str: The path, or None if there is no such upload
+    """
+    store = get_blob_store('uploads')
+    if store is None or not IMAGE_ID_PATTERN.fullmatch(str(image_id)):
+        return None
+    return store.find(image_id)
+
+def load_upload(image_id):
+    """
+    Reads an uploaded image for extraction or saving
+
+    Args:
+        image_id (str): Handle returned when the image was stored
+
+    Returns:
+        tuple: (success, payload_or_error)
+            - If successful, returns (True, ImagePayload)
+            - If failed, returns (False, error message)
+    """
+    path = upload_path(image_id)
+    if path is None:
+        return False, f"Unknown image_id: {image_id}"
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        error_msg = f"Error reading uploaded image {image_id}: {str(e)}"
+        logger.error(error_msg)
+        return False, error_msg
+    observe_bytes('image', len(data))
+    return True, ImagePayload(data, sniff_image_type(data) or 'image/png')
+
+def _image_id(path):
+    """Returns the handle of a stored upload: its file name without the extension"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+def _extension(payload):
+    return 'jpg' if payload.mime_type == 'image/jpeg' else 'png'
+
+@reset_after_fork
+def _reset_captures():
+    """Forgets the parent's captures in a forked worker, which never served them"""
+    global _captures_lock
+    _captures.clear()
+    _captures_lock = threading.Lock()
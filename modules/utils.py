@@ -1,12 +1,14 @@
 """
 Utility functions for the Screenshot to Table application.
 """
-import csv
+import os
 import json
-import io
 import logging
 from datetime import datetime
 
+from modules.table import ColumnarTable
+from modules.exporters import iter_csv_text
+
 logger = logging.getLogger(__name__)
 
 def format_timestamp():
@@ -26,16 +28,7 @@ def convert_to_csv(table_data):
     if not table_data or 'columns' not in table_data or 'rows' not in table_data:
         return ''
     
-    output = io.StringIO()
-    writer = csv.DictWriter(output, fieldnames=table_data['columns'])
-    
-    # Write header
-    writer.writeheader()
-    
-    # Write rows
-    writer.writerows(table_data['rows'])
-    
-    return output.getvalue()
+    return ''.join(iter_csv_text(ColumnarTable.from_table_data(table_data)))
 
 def convert_to_html_table(table_data):
     """
@@ -50,20 +43,20 @@ def convert_to_html_table(table_data):
     if not table_data or 'columns' not in table_data or 'rows' not in table_data:
         return '<p>No valid table data found</p>'
     
+    table = ColumnarTable.from_table_data(table_data)
     html = ['<table border="1" cellpadding="5" cellspacing="0">']
     
     # Header row
     html.append('<thead><tr>')
-    for column in table_data['columns']:
+    for column in table.columns:
         html.append(f'<th>{escape_html(column)}</th>')
     html.append('</tr></thead>')
     
     # Data rows
     html.append('<tbody>')
-    for row in table_data['rows']:
+    for row in table.iter_rows():
         html.append('<tr>')
-        for column in table_data['columns']:
-            cell_value = row.get(column, '')
+        for cell_value in row:
             html.append(f'<td>{escape_html(cell_value)}</td>')
         html.append('</tr>')
     html.append('</tbody>')
@@ -91,6 +84,25 @@ def escape_html(unsafe):
         .replace('"', '&quot;')
         .replace("'", '&#039;'))
 
+def reset_after_fork(reset):
+    """
+    Registers a function that drops a module's shared objects in forked children
+    
+    A pre-fork server may fork its workers after the parent has created
+    clients, connections, thread pools or held locks. Each child must create
+    its own rather than use copies that belong to the parent. Can be used as
+    a decorator; does nothing on platforms without fork.
+    
+    Args:
+        reset (callable): Function taking no arguments
+        
+    Returns:
+        callable: reset, unchanged
+    """
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=reset)
+    return reset
+
 def setup_logger():
     """
     Sets up the logger configuration
@@ -5,11 +5,18 @@
 // Global variables
 let cropper;
 let tableData = null;
+let resultId = null;
+let captureInfo = null;
+let cropData = null;
+// Resolves to the image_id of the current crop once the server holds it
+let imageUpload = null;
 
 // DOM Elements
 const captureBtn = document.getElementById('capture-btn');
+const captureFullBtn = document.getElementById('capture-full-btn');
 const cropBtn = document.getElementById('crop-btn');
 const extractTableBtn = document.getElementById('extract-table-btn');
+const scheduleBtn = document.getElementById('schedule-btn');
 const resetBtn = document.getElementById('reset-btn');
 const imageContainer = document.getElementById('image-container');
 const resultContainer = document.getElementById('result-container');
@@ -108,6 +115,35 @@ function renderTable(data) {
   tableOutput.innerHTML = html;
 }
 
+/**
+ * Start a table with just its header, for rows arriving one at a time
+ */
+function startTable(columns) {
+  let html = '<table><thead><tr>';
+  columns.forEach(column => {
+    html += `<th>${escapeHtml(column)}</th>`;
+  });
+  html += '</tr></thead><tbody></tbody></table>';
+  
+  document.getElementById('table-output').innerHTML = html;
+}
+
+/**
+ * Append one row to a table started with startTable()
+ */
+function appendTableRow(columns, row) {
+  const tbody = document.querySelector('#table-output tbody');
+  if (!tbody) return;
+  
+  let html = '<tr>';
+  columns.forEach(column => {
+    html += `<td>${escapeHtml(row[column] || '')}</td>`;
+  });
+  html += '</tr>';
+  
+  tbody.insertAdjacentHTML('beforeend', html);
+}
+
 /**
  * Convert table data to CSV
  */
@@ -137,19 +173,50 @@ function convertToCSV(data) {
 
 /**
  * Handle screenshot capture
+ *
+ * Repeat captures return only the region around the last crop unless
+ * full is true.
  */
-function captureScreenshot() {
+function captureScreenshot(full) {
   captureBtn.disabled = true;
   captureBtn.textContent = 'Capturing...';
   
-  fetch('/request-screenshot')
+  let url = full === true ? '/request-screenshot?full=1' : '/request-screenshot';
+  if (full === true && captureInfo && captureInfo.sender) {
+    // Stay on the sender being viewed
+    url += `&sender=${encodeURIComponent(captureInfo.sender)}`;
+  }
+  
+  // An unchanged screen comes back as 304 with no image
+  const headers = captureInfo && captureInfo.etag ? {'If-None-Match': captureInfo.etag} : {};
+  
+  fetch(url, {headers: headers})
     .then(response => {
+      if (response.status === 304) {
+        return null;
+      }
       if (!response.ok) {
         throw new Error(`Failed to capture screenshot: ${response.status}`);
       }
+      // Where the image sits on the sender's screen, sent back with the crop
+      captureInfo = {
+        sender: response.headers.get('X-Capture-Sender'),
+        monitor: response.headers.get('X-Capture-Monitor'),
+        region: response.headers.get('X-Capture-Region'),
+        scale: response.headers.get('X-Capture-Scale'),
+        id: response.headers.get('X-Capture-Id'),
+        etag: response.headers.get('ETag')
+      };
       return response.blob();
     })
     .then(blob => {
+      if (blob === null) {
+        // Keep the current screenshot, crop and extracted table
+        captureBtn.textContent = 'Capture New Screenshot';
+        captureBtn.disabled = false;
+        showStatus('Screen unchanged since the last capture', 'info');
+        return;
+      }
       preview.src = URL.createObjectURL(blob);
       imageContainer.classList.remove('hidden');
       cropBtn.classList.remove('hidden');
@@ -197,21 +264,27 @@ function cropSelection() {
     maxHeight: 4096
   });
   
-  if (canvas) {
-    croppedResult.src = canvas.toDataURL('image/png');
+  if (!canvas) return;
+  
+  cropData = cropper.getData(true);
+  const crop = cropData;
+  const capture = captureInfo;
+  
+  // Encoded once, as binary; the same blob is shown and, if needed, uploaded
+  const encoded = new Promise(resolve => canvas.toBlob(resolve, 'image/png'));
+  encoded.then(blob => {
+    if (croppedResult.src.startsWith('blob:')) {
+      URL.revokeObjectURL(croppedResult.src);
+    }
+    croppedResult.src = URL.createObjectURL(blob);
     resultContainer.classList.remove('hidden');
     extractTableBtn.classList.remove('hidden');
-    
-    // Send cropped data to server
-    fetch('/save-cropped', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json'
-      },
-      body: JSON.stringify({
-        image: canvas.toDataURL('image/png')
-      })
-    })
+    scheduleBtn.classList.remove('hidden');
+  });
+  
+  imageUpload = uploadCrop(crop, capture, encoded);
+  imageUpload
+    .then(imageId => postJson('/save-cropped', { image_id: imageId, crop: crop, capture: capture }))
     .then(response => response.json())
     .then(data => {
       if (data.success) {
@@ -223,14 +296,96 @@ function cropSelection() {
     .catch(error => {
       showStatus('Error processing cropped image: ' + error.message, 'error');
     });
+}
+
+/**
+ * Give the server the crop once, returning a promise of its image_id
+ *
+ * The server cuts the crop from the capture it already stored when it can,
+ * so only the rectangle is sent; otherwise the encoded crop is uploaded as
+ * raw bytes.
+ */
+function uploadCrop(crop, capture, encoded) {
+  const fromCapture = capture && capture.id
+    ? postJson('/images', { capture_id: capture.id, crop: crop })
+        .then(response => response.ok ? response.json() : null)
+        .catch(() => null)
+    : Promise.resolve(null);
+  
+  return fromCapture.then(data => {
+    if (data && data.success) {
+      return data.image_id;
+    }
+    return encoded
+      .then(blob => fetch('/images', {
+        method: 'POST',
+        headers: { 'Content-Type': blob.type || 'image/png' },
+        body: blob
+      }))
+      .then(response => response.json())
+      .then(uploaded => {
+        if (!uploaded.success) {
+          throw new Error(uploaded.error);
+        }
+        return uploaded.image_id;
+      });
+  });
+}
+
+/**
+ * POST a JSON body
+ */
+function postJson(url, body) {
+  return fetch(url, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    body: JSON.stringify(body)
+  });
+}
+
+/**
+ * Save the current crop as a schedule that captures and extracts it every few minutes
+ */
+function scheduleExtraction() {
+  if (!cropData || !captureInfo) {
+    showStatus('Crop a table first', 'error');
+    return;
   }
+  
+  const minutes = parseFloat(prompt('Capture and extract this table every how many minutes?', '5'));
+  if (!minutes || minutes <= 0) return;
+  
+  fetch('/schedules', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json'
+    },
+    body: JSON.stringify({
+      crop: cropData,
+      capture: captureInfo,
+      interval: minutes * 60
+    })
+  })
+  .then(response => response.json())
+  .then(data => {
+    if (data.success) {
+      showStatus(`Scheduled every ${minutes} minutes. Results: /schedules/${data.schedule.id}/series`, 'success');
+    } else {
+      showStatus('Error creating schedule: ' + data.error, 'error');
+    }
+  })
+  .catch(error => {
+    showStatus('Error creating schedule: ' + error.message, 'error');
+  });
 }
 
 /**
  * Handle table extraction
  */
 function extractTable() {
-  if (!croppedResult.src) {
+  if (!imageUpload) {
     showStatus('No cropped image available', 'error');
     return;
   }
@@ -240,40 +395,118 @@ function extractTable() {
   extractTableBtn.disabled = true;
   tableContainer.classList.add('hidden');
   
-  // Send the cropped image for table extraction
-  fetch('/extract-table', {
-    method: 'POST',
-    headers: {
-      'Content-Type': 'application/json'
-    },
-    body: JSON.stringify({
-      image: croppedResult.src
+  // The crop is referred to by its image_id, so it is never sent again
+  imageUpload
+    .then(imageId => {
+      // Stream rows as they are produced where the browser supports it
+      if (window.ReadableStream && window.TextDecoder) {
+        extractTableStreaming(imageId);
+      } else {
+        extractTableJob(imageId);
+      }
     })
+    .catch(error => {
+      loadingContainer.classList.add('hidden');
+      extractTableBtn.disabled = false;
+      showStatus('Error uploading cropped image: ' + error.message, 'error');
+    });
+}
+
+/**
+ * Extract the table over a streamed response, showing rows as they arrive
+ */
+function extractTableStreaming(imageId) {
+  let columns = null;
+  let result = null;
+  let savedId = null;
+  let streamError = null;
+  
+  postJson('/extract-table?stream=1', {
+    image_id: imageId,
+    sender: captureInfo ? captureInfo.sender : null
   })
-  .then(response => response.json())
-  .then(data => {
-    loadingContainer.classList.add('hidden');
-    extractTableBtn.disabled = false;
+  .then(response => {
+    if (!response.ok || !response.body) {
+      throw new Error(`Failed to extract table: ${response.status}`);
+    }
     
-    if (data.success) {
-      tableData = data.table_data;
-      
-      // Render HTML table
-      renderTable(tableData);
+    return readNdjson(response.body, event => {
+      if (event.type === 'columns' || (event.type === 'row' && !columns)) {
+        columns = event.columns || Object.keys(event.row);
+        startTable(columns);
+        loadingContainer.classList.add('hidden');
+        tableContainer.classList.remove('hidden');
+      }
       
-      // Render JSON view
-      document.getElementById('json-output').textContent = JSON.stringify(tableData, null, 2);
+      if (event.type === 'row') {
+        appendTableRow(columns, event.row);
+      } else if (event.type === 'done') {
+        result = event.table_data;
+        savedId = event.result_id;
+      } else if (event.type === 'error') {
+        streamError = event.error;
+      }
+    });
+  })
+  .then(() => {
+    if (result) {
+      showExtractionResult({ success: true, table_data: result, result_id: savedId });
+    } else {
+      showExtractionResult({ success: false, error: streamError || 'Incomplete response from server' });
+    }
+  })
+  .catch(error => {
+    loadingContainer.classList.add('hidden');
+    extractTableBtn.disabled = false;
+    showStatus('Error during table extraction: ' + error.message, 'error');
+  });
+}
+
+/**
+ * Read a newline-delimited JSON stream, calling onEvent for each line
+ */
+function readNdjson(body, onEvent) {
+  const reader = body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  
+  function pump() {
+    return reader.read().then(({ done, value }) => {
+      buffer += decoder.decode(value || new Uint8Array(), { stream: !done });
       
-      // Render CSV view
-      document.getElementById('csv-output').textContent = convertToCSV(tableData);
+      const lines = buffer.split('\n');
+      buffer = lines.pop();
+      lines.filter(line => line.trim()).forEach(line => onEvent(JSON.parse(line)));
       
-      // Show table container
-      tableContainer.classList.remove('hidden');
-      showStatus('Table extracted successfully!', 'success');
-    } else {
-      showStatus('Failed to extract table: ' + data.error, 'error');
+      if (done) {
+        if (buffer.trim()) {
+          onEvent(JSON.parse(buffer));
+        }
+        return;
+      }
+      return pump();
+    });
+  }
+  
+  return pump();
+}
+
+/**
+ * Extract the table as a background job, polling until it finishes
+ */
+function extractTableJob(imageId) {
+  postJson('/jobs/extract-table', {
+    image_id: imageId,
+    sender: captureInfo ? captureInfo.sender : null
+  })
+  .then(response => response.json())
+  .then(data => {
+    if (!data.success) {
+      throw new Error(data.error);
     }
+    return pollJob(data.status_url);
   })
+  .then(showExtractionResult)
   .catch(error => {
     loadingContainer.classList.add('hidden');
     extractTableBtn.disabled = false;
@@ -281,6 +514,56 @@ function extractTable() {
   });
 }
 
+/**
+ * Show a finished extraction in the table, JSON and CSV views
+ */
+function showExtractionResult(data) {
+  loadingContainer.classList.add('hidden');
+  extractTableBtn.disabled = false;
+  
+  if (data.success) {
+    tableData = data.table_data;
+    // Downloads are served from the saved result when the server kept one
+    resultId = data.result_id || null;
+    
+    // Render HTML table
+    renderTable(tableData);
+    
+    // Render JSON view
+    document.getElementById('json-output').textContent = JSON.stringify(tableData, null, 2);
+    
+    // Render CSV view
+    document.getElementById('csv-output').textContent = convertToCSV(tableData);
+    
+    // Show table container
+    tableContainer.classList.remove('hidden');
+    showStatus('Table extracted successfully!', 'success');
+  } else {
+    showStatus('Failed to extract table: ' + data.error, 'error');
+  }
+}
+
+/**
+ * Poll a background job until it finishes
+ */
+function pollJob(statusUrl, intervalMs = 1000) {
+  return new Promise((resolve, reject) => {
+    function check() {
+      fetch(statusUrl)
+        .then(response => response.json())
+        .then(data => {
+          if (data.status === 'queued' || data.status === 'running') {
+            setTimeout(check, intervalMs);
+          } else {
+            resolve(data);
+          }
+        })
+        .catch(reject);
+    }
+    check();
+  });
+}
+
 /**
  * Reset the application state
  */
@@ -295,24 +578,48 @@ function resetApplication() {
   resultContainer.classList.add('hidden');
   cropBtn.classList.add('hidden');
   extractTableBtn.classList.add('hidden');
+  scheduleBtn.classList.add('hidden');
   resetBtn.classList.add('hidden');
   tableContainer.classList.add('hidden');
   statusContainer.classList.add('hidden');
   
   preview.src = '';
+  if (croppedResult.src.startsWith('blob:')) {
+    URL.revokeObjectURL(croppedResult.src);
+  }
   croppedResult.src = '';
   tableData = null;
+  resultId = null;
+  captureInfo = null;
+  cropData = null;
+  imageUpload = null;
   
   document.getElementById('table-output').innerHTML = '';
   document.getElementById('json-output').textContent = '';
   document.getElementById('csv-output').textContent = '';
 }
 
+/**
+ * Download the saved result in a format; the server streams the file straight to disk
+ */
+function downloadResult(format) {
+  const a = document.createElement('a');
+  a.style.display = 'none';
+  a.href = `/results/${encodeURIComponent(resultId)}/download?format=${format}`;
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
+}
+
 /**
  * Download table data as JSON
  */
 function downloadJson() {
   if (!tableData) return;
+  if (resultId) {
+    downloadResult('json');
+    return;
+  }
   
   const json = JSON.stringify(tableData, null, 2);
   const blob = new Blob([json], { type: 'application/json' });
@@ -332,6 +639,10 @@ function downloadJson() {
  */
 function downloadCsv() {
   if (!tableData) return;
+  if (resultId) {
+    downloadResult('csv');
+    return;
+  }
   
   const csv = convertToCSV(tableData);
   const blob = new Blob([csv], { type: 'text/csv' });
@@ -350,8 +661,9 @@ function downloadCsv() {
  * Initialize event listeners
  */
 function initEventListeners() {
-  // Capture screenshot
-  captureBtn.addEventListener('click', captureScreenshot);
+  // Capture screenshot (the whole screen, ignoring the last crop, from the second button)
+  captureBtn.addEventListener('click', () => captureScreenshot(false));
+  captureFullBtn.addEventListener('click', () => captureScreenshot(true));
   
   // Crop selection
   cropBtn.addEventListener('click', cropSelection);
@@ -359,6 +671,9 @@ function initEventListeners() {
   // Extract table
   extractTableBtn.addEventListener('click', extractTable);
   
+  // Repeat the capture and extraction on a schedule
+  scheduleBtn.addEventListener('click', scheduleExtraction);
+  
   // Reset application
   resetBtn.addEventListener('click', resetApplication);
   
@@ -0,0 +1,163 @@
+"""
+Tests for grid detection and cell assembly in modules/local_extraction.py.
+
+Tables are drawn with Pillow and OCR is replaced by a stub that reports
+words at known cell positions, so no Tesseract installation is needed.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from modules.image_processing import ImagePayload
+from modules.local_extraction import LocalTableEngine, find_grid
+
+MARGIN = 10
+CELL_WIDTH = 80
+CELL_HEIGHT = 30
+LINE = 2
+
+HEADER = ['Name', 'Price', 'Qty']
+BODY = [['Apple', '1.20', '3'], ['Pear', '0.80', '5'], ['Plum', '2.10', '1']]
+
+def draw_table(rows=4, columns=3):
+    """Draws an empty ruled table with LINE-pixel black lines on white"""
+    width = MARGIN * 2 + columns * (CELL_WIDTH + LINE) + LINE
+    height = MARGIN * 2 + rows * (CELL_HEIGHT + LINE) + LINE
+    img = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(img)
+    right = MARGIN + columns * (CELL_WIDTH + LINE) + LINE - 1
+    bottom = MARGIN + rows * (CELL_HEIGHT + LINE) + LINE - 1
+    for row in range(rows + 1):
+        y = MARGIN + row * (CELL_HEIGHT + LINE)
+        draw.rectangle((MARGIN, y, right, y + LINE - 1), fill='black')
+    for column in range(columns + 1):
+        x = MARGIN + column * (CELL_WIDTH + LINE)
+        draw.rectangle((x, MARGIN, x + LINE - 1, bottom), fill='black')
+    return img
+
+def cell_center(row, column):
+    """Returns the centre of a cell in image coordinates"""
+    return (
+        MARGIN + column * (CELL_WIDTH + LINE) + LINE + CELL_WIDTH / 2,
+        MARGIN + row * (CELL_HEIGHT + LINE) + LINE + CELL_HEIGHT / 2
+    )
+
+def word_box(x, y, half_width=12, half_height=5):
+    return (x - half_width, y - half_height, x + half_width, y + half_height)
+
+class StubOCR:
+    """
+    Reports fixed words, given in image coordinates, in the region's coordinates
+
+    The engine OCRs the table's bounding box upscaled by OCR_SCALE, so the
+    stub maps its words the same way and keeps the region it was given.
+    """
+
+    def __init__(self, words, columns=3, confidence=90.0):
+        self.words = words
+        self.table_width = columns * (CELL_WIDTH + LINE) + LINE
+        self.confidence = confidence
+        self.region = None
+
+    def __call__(self, region):
+        self.region = region
+        scale = region.width / self.table_width
+        return [
+            (text, tuple((value - MARGIN) * scale for value in box), self.confidence)
+            for text, box in self.words
+        ]
+
+def make_ocr(cells, extra_words=()):
+    words = [
+        (text, word_box(*cell_center(row, column)))
+        for row, values in enumerate(cells)
+        for column, text in enumerate(values)
+        if text
+    ]
+    return StubOCR(words + list(extra_words), columns=len(cells[0]))
+
+def payload(img):
+    output = BytesIO()
+    img.save(output, format='PNG')
+    return ImagePayload(output.getvalue(), 'image/png')
+
+def test_find_grid_locates_cells_between_ruling_lines():
+    grid = find_grid(draw_table().convert('L'))
+
+    assert grid is not None
+    assert len(grid['rows']) == 4
+    assert len(grid['columns']) == 3
+    for index, (start, end) in enumerate(grid['columns']):
+        assert start == MARGIN + index * (CELL_WIDTH + LINE) + LINE
+        assert end - start == CELL_WIDTH
+    for index, (start, end) in enumerate(grid['rows']):
+        assert start == MARGIN + index * (CELL_HEIGHT + LINE) + LINE
+        assert end - start == CELL_HEIGHT
+    assert grid['background'] == 255
+
+def test_find_grid_ignores_images_without_a_grid():
+    assert find_grid(Image.new('L', (200, 100), 255)) is None
+
+    img = Image.new('L', (200, 100), 255)
+    ImageDraw.Draw(img).rectangle((10, 40, 190, 41), fill=0)
+    # A single rule has no cells on both axes
+    assert find_grid(img) is None
+
+def test_extract_assigns_words_to_their_cells():
+    ocr = make_ocr([HEADER] + BODY)
+    success, result = LocalTableEngine(ocr=ocr).extract(payload(draw_table()))
+
+    assert success, result
+    assert result['grid'] == [4, 3]
+    assert result['table_data']['columns'] == HEADER
+    assert result['table_data']['rows'] == [dict(zip(HEADER, values)) for values in BODY]
+    assert result['confidence'] == 0.9
+
+def test_extract_erases_ruling_lines_before_ocr():
+    ocr = make_ocr([HEADER] + BODY)
+    LocalTableEngine(ocr=ocr).extract(payload(draw_table()))
+
+    # Every pixel the OCR saw on the first horizontal rule is background
+    line = ocr.region.crop((0, 0, ocr.region.width, 2))
+    assert line.getextrema() == (255, 255)
+
+def test_extract_joins_words_of_a_cell_in_reading_order():
+    x, y = cell_center(1, 0)
+    cells = [HEADER, ['', '1.20', '3']]
+    extra = [
+        ('York', word_box(x + 14, y - 7, 10, 4)),
+        ('New', word_box(x - 14, y - 7, 10, 4)),
+        ('City', word_box(x, y + 7, 10, 4))
+    ]
+    ocr = make_ocr(cells, extra)
+    img = draw_table(rows=2)
+    success, result = LocalTableEngine(ocr=ocr).extract(payload(img))
+
+    assert success, result
+    assert result['table_data']['rows'][0]['Name'] == 'New York\nCity'
+
+def test_extract_names_empty_and_repeated_headers_uniquely():
+    ocr = make_ocr([['Price', '', 'Price'], ['1', '2', '3']])
+    success, result = LocalTableEngine(ocr=ocr).extract(payload(draw_table(rows=2)))
+
+    assert success, result
+    assert result['table_data']['columns'] == ['Price', 'Column 2', 'Price (2)']
+    assert result['table_data']['rows'] == [{'Price': '1', 'Column 2': '2', 'Price (2)': '3'}]
+    # One header cell in three is empty
+    assert result['confidence'] == round(0.9 * 2 / 3, 3)
+
+def test_extract_lowers_confidence_for_words_outside_the_grid():
+    outside = ('stray', word_box(MARGIN / 2, MARGIN / 2, 2, 2))
+    ocr = make_ocr([HEADER] + BODY, [outside])
+    success, result = LocalTableEngine(ocr=ocr).extract(payload(draw_table()))
+
+    assert success, result
+    assert result['table_data']['rows'] == [dict(zip(HEADER, values)) for values in BODY]
+    words = len(HEADER) * 4
+    assert result['confidence'] == round(0.9 * words / (words + 1), 3)
+
+def test_extract_fails_without_a_grid():
+    success, error = LocalTableEngine(ocr=StubOCR([])).extract(payload(Image.new('RGB', (120, 60), 'white')))
+
+    assert not success
+    assert error == "No ruled table grid found"
@@ -0,0 +1,111 @@
+"""
+Tests for the hash index and the content check in modules/near_duplicate.py.
+
+Tables are drawn with Pillow's built-in font, so no image fixtures are needed.
+"""
+import random
+
+from PIL import Image, ImageDraw
+
+from modules.near_duplicate import MultiIndexHash, _flip_masks, hamming_distance, same_content
+
+ROWS = [['Item', 'Price', 'Qty'], ['Apple', '1.20', '3'], ['Pear', '0.80', '5'], ['Plum', '2.10', '17']]
+
+def flip_bits(value, bits):
+    for bit in bits:
+        value ^= 1 << bit
+    return value
+
+def draw_page(rows=ROWS, width=320, height=160):
+    """Draws a ruled table with text on a larger white page"""
+    img = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(img)
+    for index, values in enumerate(rows):
+        y = 20 + index * 28
+        draw.line((20, y, 290, y), fill=0)
+        for column, text in enumerate(values):
+            draw.text((28 + column * 90, y + 8), text, fill=0)
+    draw.line((20, 20 + len(rows) * 28, 290, 20 + len(rows) * 28), fill=0)
+    for column in range(4):
+        draw.line((20 + column * 90, 20, 20 + column * 90, 20 + len(rows) * 28), fill=0)
+    return img
+
+def crop(page, dx=0, dy=0, width=290, height=134):
+    return page.crop((10 + dx, 10 + dy, 10 + dx + width, 10 + dy + height))
+
+def test_flip_masks_cover_every_mask_within_the_radius():
+    assert _flip_masks(16, 0) == [0]
+    masks = _flip_masks(16, 1)
+    assert len(masks) == 17
+    assert set(masks) == {0} | {1 << bit for bit in range(16)}
+    masks = _flip_masks(16, 2)
+    assert len(masks) == len(set(masks)) == 1 + 16 + 16 * 15 // 2
+    assert max(bin(mask).count('1') for mask in masks) == 2
+
+def test_probe_radius_is_threshold_divided_by_chunks():
+    # 256 bits in sixteen 16-bit chunks: one flipped bit per chunk is probed
+    index = MultiIndexHash(16)
+    assert [len(probes) for probes in index._probes] == [17] * 16
+    index = MultiIndexHash(33)
+    assert [len(probes) for probes in index._probes] == [137] * 16
+    # A last, narrower chunk gets masks of its own width
+    index = MultiIndexHash(4, bits=40, chunk_bits=16)
+    assert [len(probes) for probes in index._probes] == [17, 17, 9]
+
+def test_search_finds_a_hash_spread_evenly_across_chunks():
+    index = MultiIndexHash(16)
+    query = random.Random(3).getrandbits(256)
+    # One differing bit in every chunk: only the probe radius can find it
+    spread = flip_bits(query, [chunk * 16 + 5 for chunk in range(16)])
+    index.add(spread, 'spread')
+    assert index.search(query) == [(16, 'spread')]
+
+def test_search_applies_the_distance_threshold():
+    index = MultiIndexHash(16)
+    query = random.Random(4).getrandbits(256)
+    # All differing bits in one chunk, so every other chunk matches exactly
+    index.add(flip_bits(query, range(16)), 'at threshold')
+    index.add(flip_bits(query, range(17)), 'beyond threshold')
+    index.add(query, 'identical')
+    assert index.search(query) == [(0, 'identical'), (16, 'at threshold')]
+
+def test_search_matches_brute_force():
+    rnd = random.Random(5)
+    index = MultiIndexHash(16)
+    query = rnd.getrandbits(256)
+    entries = []
+    for item in range(400):
+        value = flip_bits(query, rnd.sample(range(256), rnd.randint(0, 24)))
+        entries.append((value, item))
+        index.add(value, item)
+    for _ in range(200):
+        value = rnd.getrandbits(256)
+        entries.append((value, len(entries)))
+        index.add(value, len(entries) - 1)
+
+    expected = sorted(
+        (hamming_distance(query, value), item)
+        for value, item in entries
+        if hamming_distance(query, value) <= 16
+    )
+    assert sorted(index.search(query)) == expected
+    assert len(index) == 600
+
+def test_same_content_matches_a_shifted_crop():
+    page = draw_page()
+    assert same_content(crop(page), crop(page, dx=3, dy=-2), max_shift=8)
+    # A crop a few pixels larger along one edge is the same table too
+    assert same_content(crop(page), crop(page, dx=-4, width=296), max_shift=8)
+
+def test_same_content_rejects_one_changed_digit():
+    rows = [list(values) for values in ROWS]
+    rows[3][2] = '18'
+    original, changed = draw_page(), draw_page(rows)
+    assert not same_content(crop(original), crop(changed), max_shift=8)
+    assert not same_content(crop(original), crop(changed, dx=2, dy=1), max_shift=8)
+
+def test_same_content_rejects_offsets_beyond_max_shift():
+    page = draw_page()
+    assert not same_content(crop(page), crop(page, dx=6), max_shift=2)
+    # Sizes too different for two crops of the same table
+    assert not same_content(crop(page), crop(page, width=200), max_shift=8)
@@ -0,0 +1,111 @@
+"""
+Tests for modules/stream_parser.py.
+
+Every document is also fed split at each position, since the model's chunks
+can end anywhere: inside a string, an escape sequence or a key.
+"""
+import json
+
+from modules.stream_parser import TableStreamParser
+
+def parse(chunks):
+    parser = TableStreamParser()
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    return events, parser
+
+def assert_events_at_every_split(document, expected):
+    """Checks the events of the whole document, of every two-chunk split and of single characters"""
+    events, parser = parse([document])
+    assert events == expected
+    assert parser.text == document
+    for position in range(1, len(document)):
+        events, parser = parse([document[:position], document[position:]])
+        assert events == expected, f"split at {position}: {document[:position]!r}"
+        assert parser.text == document
+    assert parse(list(document))[0] == expected
+
+def test_columns_then_rows():
+    document = json.dumps({
+        'columns': ['Name', 'Price'],
+        'rows': [{'Name': 'Apple', 'Price': '1.20'}, {'Name': 'Pear', 'Price': '0.80'}]
+    })
+
+    assert_events_at_every_split(document, [
+        ('columns', ['Name', 'Price']),
+        ('row', {'Name': 'Apple', 'Price': '1.20'}),
+        ('row', {'Name': 'Pear', 'Price': '0.80'}),
+    ])
+
+def test_missing_row_values_default_to_none():
+    document = '{"columns": ["A", "B"], "rows": [{"A": "1"}]}'
+
+    assert_events_at_every_split(document, [('columns', ['A', 'B']), ('row', {'A': '1', 'B': None})])
+
+def test_escaped_quotes_and_brackets_inside_strings():
+    row = {'Name': 'He said "hi" \\ {not} [a row]', 'Note': '}]"{['}
+    document = json.dumps({'columns': ['Name', 'Note'], 'rows': [row, {'Name': 'x', 'Note': 'y'}]})
+
+    assert_events_at_every_split(document, [
+        ('columns', ['Name', 'Note']),
+        ('row', row),
+        ('row', {'Name': 'x', 'Note': 'y'}),
+    ])
+
+def test_escaped_quote_in_a_key_does_not_end_it():
+    document = '{"a\\"rows": [[1]], "columns": ["A"], "rows": [["x"]]}'
+
+    assert_events_at_every_split(document, [('columns', ['A']), ('row', {'A': 'x'})])
+
+def test_rows_given_as_lists_are_keyed_by_the_columns():
+    document = '{"columns": ["A", "B", "C"], "rows": [["1", "2", "3"], ["4", null, "6"], ["7"]]}'
+
+    assert_events_at_every_split(document, [
+        ('columns', ['A', 'B', 'C']),
+        ('row', {'A': '1', 'B': '2', 'C': '3'}),
+        ('row', {'A': '4', 'B': None, 'C': '6'}),
+        ('row', {'A': '7', 'B': None, 'C': None}),
+    ])
+
+def test_nested_values_inside_a_row_stay_in_the_row():
+    document = '{"columns": ["A", "B"], "rows": [{"A": {"rows": [1, 2]}, "B": [3, [4]]}]}'
+
+    assert_events_at_every_split(document, [
+        ('columns', ['A', 'B']),
+        ('row', {'A': {'rows': [1, 2]}, 'B': [3, [4]]}),
+    ])
+
+def test_nested_columns_and_rows_keys_are_ignored():
+    document = json.dumps({
+        'meta': {'columns': ['Wrong'], 'rows': [{'Wrong': 1}]},
+        'columns': ['Right'],
+        'notes': [{'columns': ['Also wrong']}],
+        'rows': [{'Right': 'yes'}],
+    })
+
+    assert_events_at_every_split(document, [('columns', ['Right']), ('row', {'Right': 'yes'})])
+
+def test_rows_before_columns():
+    # Object rows carry their own keys and are reported at once
+    document = '{"rows": [{"A": "1"}], "columns": ["A", "B"]}'
+    assert_events_at_every_split(document, [('row', {'A': '1'}), ('columns', ['A', 'B'])])
+
+    # Value lists wait for the columns that name them
+    document = '{"rows": [["1", "2"], ["3"]], "columns": ["A", "B"]}'
+    assert_events_at_every_split(document, [
+        ('columns', ['A', 'B']),
+        ('row', {'A': '1', 'B': '2'}),
+        ('row', {'A': '3', 'B': None}),
+    ])
+
+def test_incomplete_document_reports_only_closed_rows():
+    document = '{"columns": ["A"], "rows": [{"A": "1"}, {"A": "2'
+
+    events, parser = parse([document])
+
+    assert events == [('columns', ['A']), ('row', {'A': '1'})]
+    assert parser.columns == ['A']
+
+def test_non_table_json_reports_nothing():
+    assert_events_at_every_split('{"columns": "A", "rows": "none", "x": [1, {"y": 2}]}', [])
@@ -0,0 +1,154 @@
+"""
+Tests for type inference in modules/table.py and the text exporters.
+
+Typed formats (Parquet, Arrow, XLSX) convert values by these rules, while
+CSV and JSON must hand back exactly the values that were extracted.
+"""
+import csv
+import io
+import json
+from datetime import date, datetime
+
+import pytest
+
+from modules.exporters import export_table
+from modules.table import ColumnarTable, infer_dtype, parse_currency, parse_number
+
+@pytest.mark.parametrize('value, expected', [
+    ('12', 12.0),
+    ('-1,234.5', -1234.5),
+    ('+3', 3.0),
+    ('0', 0.0),
+    ('0.25', 0.25),
+    ('.5', 0.5),
+    ('1.5e3', 1500.0),
+    ('12 345', 12345.0),
+    ('(12)', -12.0),
+    ('(1,000.50)', -1000.5),
+    (7, 7.0),
+    (2.5, 2.5),
+    # Leading zeros mark codes, not numbers
+    ('007', None),
+    ('0012.5', None),
+    # Misplaced thousands separators
+    ('1,23', None),
+    ('12,3456', None),
+    ('(12', None),
+    ('12)', None),
+    ('1.2.3', None),
+    ('12%', None),
+    ('$12', None),
+    ('abc', None),
+    ('', None),
+    (True, None),
+])
+def test_parse_number(value, expected):
+    assert parse_number(value) == expected
+
+@pytest.mark.parametrize('value, expected', [
+    ('$1,234.50', 1234.5),
+    ('-€12', -12.0),
+    ('+£3', 3.0),
+    ('12 £', 12.0),
+    ('¥ 500', 500.0),
+    ('$(5)', -5.0),
+    ('12', None),
+    ('$', None),
+    ('$abc', None),
+    # A code behind a symbol is still a code
+    ('£007', None),
+    ('12%', None),
+    ('', None),
+])
+def test_parse_currency(value, expected):
+    assert parse_currency(value) == expected
+
+@pytest.mark.parametrize('values, expected', [
+    (['1', '2.5', '(12)'], ('numeric', None)),
+    (['1,000', '-', '', None, 'n/a'], ('numeric', None)),
+    (['0', '10'], ('numeric', None)),
+    # Codes with leading zeros stay text, even next to plain numbers
+    (['007', '012'], ('text', None)),
+    (['7', '012'], ('text', None)),
+    (['12%', '-3.5%', '(1)%'], ('percent', None)),
+    (['$1', '€2,000', '3 £'], ('currency', None)),
+    (['$1', '2'], ('text', None)),
+    (['1', '12%'], ('text', None)),
+    (['2024-01-02', '2024-12-31'], ('date', '%Y-%m-%d')),
+    (['01/02/2024', '12/31/2024'], ('date', '%m/%d/%Y')),
+    (['2 Jan 2024', '15 Mar 2024'], ('date', '%d %b %Y')),
+    (['2024-01-02 10:30', '2024-01-03 11:45'], ('date', '%Y-%m-%d %H:%M')),
+    # Dates need one format shared by the whole column
+    (['2024-01-02', '01/03/2024'], ('text', None)),
+    (['01/02/2024', '13/02/2024'], ('text', None)),
+    (['2024-01-02', 'soon'], ('text', None)),
+    (['Apple', '1'], ('text', None)),
+    (['', None, '—'], ('text', None)),
+    ([], ('text', None)),
+])
+def test_infer_dtype(values, expected):
+    assert infer_dtype(values) == expected
+
+@pytest.mark.parametrize('values, expected', [
+    (['1', '2', ''], [1, 2, None]),
+    (['1.5', '(2)', None], [1.5, -2.0, None]),
+    (['12.5%', '-', '100%'], [0.125, None, 1.0]),
+    (['$1,234.50', '-€2'], [1234.5, -2.0]),
+    (['2024-01-02', ''], [date(2024, 1, 2), None]),
+    (['2024-01-02 10:30'], [datetime(2024, 1, 2, 10, 30)]),
+    (['007', '012', None], ['007', '012', None]),
+    ([3, 'x'], ['3', 'x']),
+])
+def test_typed_column(values, expected):
+    table = ColumnarTable(['Value'], [values])
+
+    converted = table.typed_column(0)
+
+    assert converted == expected
+    assert [type(value) for value in converted] == [type(value) for value in expected]
+
+def test_schema_records_dtype_and_date_format():
+    table = ColumnarTable.from_table_data({
+        'columns': ['Code', 'When', 'Amount'],
+        'rows': [
+            {'Code': '007', 'When': '2024-01-02', 'Amount': '$5'},
+            {'Code': '010', 'When': '2024-02-03'},
+        ]
+    })
+
+    assert table.schema == [
+        {'name': 'Code', 'dtype': 'text'},
+        {'name': 'When', 'dtype': 'date', 'format': '%Y-%m-%d'},
+        {'name': 'Amount', 'dtype': 'currency'},
+    ]
+
+ROUND_TRIP = {
+    'columns': ['Code', 'Amount', 'Change', 'Date', 'Note'],
+    'rows': [
+        {'Code': '007', 'Amount': '$1,234.50', 'Change': '(12)', 'Date': '2024-01-02', 'Note': 'a, "quoted" note'},
+        {'Code': '010', 'Amount': '-€3', 'Change': '12.5%', 'Date': '01/02/2024', 'Note': 'line\nbreak'},
+        {'Code': '', 'Amount': None, 'Change': '-', 'Date': 'n/a', 'Note': 'Zürich ✓'},
+    ]
+}
+
+def export(fmt):
+    output = io.BytesIO()
+    export_table(ROUND_TRIP, fmt, output)
+    return output.getvalue().decode('utf-8')
+
+def test_csv_export_keeps_original_values():
+    rows = list(csv.reader(io.StringIO(export('csv'), newline='')))
+
+    assert rows[0] == ROUND_TRIP['columns']
+    assert rows[1:] == [
+        ['' if row[column] is None else row[column] for column in ROUND_TRIP['columns']]
+        for row in ROUND_TRIP['rows']
+    ]
+
+def test_json_export_keeps_original_values():
+    assert json.loads(export('json')) == ROUND_TRIP
+
+def test_jsonl_export_keeps_original_values():
+    lines = export('jsonl').splitlines()
+
+    assert [json.loads(line) for line in lines] == ROUND_TRIP['rows']
@@ -0,0 +1,118 @@
+"""
+Tests for band cutting and merging in modules/tiling.py.
+
+Band extraction itself calls the API, so these cover the image-only steps:
+choosing cuts and the header strip from row energy, counting the rows each
+overlap repeats, and merging band tables.
+"""
+from io import BytesIO
+
+from PIL import Image, ImageDraw
+
+from modules.image_processing import ImagePayload
+from modules.tiling import merge_band_tables, split_into_bands, _choose_cuts, _detect_header_height
+
+COLUMNS = ['Name', 'Value']
+HEADER_HEIGHT = 40
+ROW_HEIGHT = 30
+
+def table(rows, columns=COLUMNS):
+    return {'columns': list(columns), 'rows': [dict(zip(columns, values)) for values in rows]}
+
+def values(merged):
+    return [[row[column] for column in merged['columns']] for row in merged['rows']]
+
+def draw_tall_table(rows=60):
+    """Draws an unruled table: a header line, then one text line per ROW_HEIGHT pixels"""
+    img = Image.new('RGB', (300, HEADER_HEIGHT + rows * ROW_HEIGHT), 'white')
+    draw = ImageDraw.Draw(img)
+    draw.text((10, 12), 'Name      Value', fill='black')
+    for row in range(rows):
+        y = HEADER_HEIGHT + row * ROW_HEIGHT + 10
+        draw.text((10, y), f'row {row}', fill='black')
+        draw.text((150, y), '0', fill='black')
+    output = BytesIO()
+    img.save(output, format='PNG')
+    return img, ImagePayload(output.getvalue(), 'image/png')
+
+def test_merge_drops_rows_repeated_by_the_overlap():
+    first = table([['a', '1'], ['b', '2'], ['c', '3']])
+    second = table([['b', '2'], ['c', '3'], ['d', '4']])
+
+    merged = merge_band_tables([first, second], [0, 2])
+
+    assert values(merged) == [['a', '1'], ['b', '2'], ['c', '3'], ['d', '4']]
+
+def test_merge_keeps_identical_rows_beyond_the_overlap_row_count():
+    # a, five identical rows, b; the second band repeats two of them
+    first = table([['a', '1']] + [['', '0']] * 3)
+    second = table([['', '0']] * 4 + [['b', '2']])
+
+    merged = merge_band_tables([first, second], [0, 2])
+
+    assert values(merged) == [['a', '1']] + [['', '0']] * 5 + [['b', '2']]
+    # Without counted rows the longest repeat is taken, losing a real row
+    assert len(merge_band_tables([first, second])['rows']) == 6
+
+def test_merge_without_overlap_keeps_every_row():
+    first = table([['x', '1']])
+    second = table([['x', '1'], ['y', '2']])
+
+    assert values(merge_band_tables([first, second], [0, 0])) == [['x', '1'], ['x', '1'], ['y', '2']]
+    # Uncounted overlaps are bounded by MAX_OVERLAP_ROWS
+    assert values(merge_band_tables([first, second], [0, None])) == [['x', '1'], ['y', '2']]
+
+def test_merge_maps_columns_by_position_and_drops_repeated_headers():
+    first = table([['a', '1']])
+    # A later band may name its columns differently, and re-read the pasted header
+    second = table([['Name', 'Value'], ['b', '2']], columns=['Item', 'Amount'])
+
+    merged = merge_band_tables([first, second], [0, 0])
+
+    assert merged['columns'] == COLUMNS
+    assert values(merged) == [['a', '1'], ['b', '2']]
+
+def test_choose_cuts_snaps_to_the_quietest_row_near_each_band():
+    energy = [1.0] * 1000
+    energy[380] = energy[430] = 0.2
+    energy[410] = 0.0
+
+    cuts = _choose_cuts(energy, 400)
+
+    assert cuts[0] == 0 and cuts[-1] == 1000
+    assert cuts[1] == 410
+
+def test_choose_cuts_prefers_the_row_closest_to_the_ideal_cut_among_equals():
+    energy = [1.0] * 1000
+    energy[370] = energy[395] = energy[420] = 0.0
+
+    assert _choose_cuts(energy, 400)[1] == 395
+
+def test_choose_cuts_leaves_short_images_in_one_band():
+    assert _choose_cuts([1.0] * 450, 400) == [0, 450]
+
+def test_detect_header_height_ends_at_the_first_gutter():
+    energy = [0.0] * 5 + [10.0] * 15 + [0.0] * 10 + [10.0] * 300
+
+    assert _detect_header_height(energy, 300) == 20
+
+def test_detect_header_height_ignores_content_without_an_early_gutter():
+    assert _detect_header_height([10.0] * 400, 300) == 0
+    assert _detect_header_height([0.0] * 10 + [10.0] * 200 + [0.0] * 10, 300) == 0
+    assert _detect_header_height([], 300) == 0
+
+def test_split_into_bands_counts_the_rows_each_overlap_repeats():
+    img, payload = draw_tall_table()
+
+    bands, overlap_rows = split_into_bands(payload, band_height=400, overlap=80)
+
+    assert len(bands) == len(overlap_rows) > 1
+    assert overlap_rows[0] == 0
+    # An 80 pixel overlap holds two or three whole 30 pixel rows
+    assert all(rows in (2, 3) for rows in overlap_rows[1:])
+
+    first = Image.open(BytesIO(bands[0].data))
+    second = Image.open(BytesIO(bands[1].data))
+    assert first.height <= 400 + 80
+    # Later bands repeat the header strip above the overlap
+    assert second.crop((0, 0, img.width, 20)).tobytes() == img.crop((0, 0, img.width, 20)).tobytes()